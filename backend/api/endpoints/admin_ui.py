@@ -1,13 +1,15 @@
 from fastapi import APIRouter, Request, Depends, Form, HTTPException, UploadFile, File, Query, Body
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.templating import Jinja2Templates
-import google.generativeai as genai
 from google.api_core import exceptions as google_exceptions
 from sqlalchemy.orm import Session
 from backend.database import get_db
 from backend.models.usage_log import UsageLog
 from backend.models.admin_login_history import AdminLoginHistory
 from backend.services.api_key_manager import api_key_manager
+from backend.services.gemini_client_pool import gemini_client_pool
+from backend.services.llm_cache import llm_response_cache
+from backend.services.llm_metrics import llm_metrics
 from backend.services.otp_manager import otp_manager
 from user_agents import parse
 from backend.services.gcp_sa_manager import gcp_sa_manager
@@ -180,14 +182,14 @@ async def add_keys_bulk(request: Request, keys: list[str] = Body(..., embed=True
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    added_count = 0
-    for key in keys:
-        # The add_key method should ideally prevent duplicates.
-        # Assuming it does, or we add a check here.
-        api_key_manager.add_key(key.strip(), status="valid")
-        added_count += 1
-        
-    return JSONResponse({"success": True, "message": f"{added_count} keys added successfully."})
+    # Thêm cả lô trong một transaction; key đã tồn tại được bỏ qua
+    keys = [key.strip() for key in keys if key.strip()]
+    added_count = api_key_manager.add_keys(keys, status="valid")
+    skipped_count = len(set(keys)) - added_count
+    message = f"{added_count} keys added successfully."
+    if skipped_count:
+        message += f" {skipped_count} duplicate keys skipped."
+    return JSONResponse({"success": True, "message": message})
 
 @router.post("/admin/delete-key")
 async def delete_key(request: Request, key_to_delete: str = Form(...), user: str = Depends(get_current_admin)):
@@ -203,11 +205,9 @@ async def validate_key(request: Request, new_key: str = Form(...), user: str = D
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     try:
-        # Cấu hình tạm thời với key mới để xác thực
-        genai.configure(api_key=new_key.strip())
-        # Thử một lệnh gọi API nhẹ nhàng, ví dụ như liệt kê các model
+        # Thử một lệnh gọi API nhẹ nhàng (liệt kê model) bằng client riêng của key mới
         # Nếu lệnh này thành công, key được coi là hợp lệ
-        models = [m for m in genai.list_models()]
+        await asyncio.to_thread(gemini_client_pool.validate_key, new_key.strip())
         print(f"Key validation successful. Found models.")
         return JSONResponse({"valid": True})
     except (google_exceptions.PermissionDenied, google_exceptions.Unauthenticated) as e:
@@ -223,9 +223,8 @@ async def validate_key(request: Request, new_key: str = Form(...), user: str = D
 def _validate_key_sync(key: str):
     """Synchronous function to validate a single API key."""
     try:
-        genai.configure(api_key=key)
-        # Lightweight API call to validate
-        [m for m in genai.list_models()]
+        # Lightweight API call to validate, using a client bound to this key only
+        gemini_client_pool.validate_key(key)
         return key, True
     except Exception:
         return key, False
@@ -271,9 +270,8 @@ async def check_key_status(request: Request, key_to_check: str = Form(...), user
 
     new_status = "invalid"
     try:
-        genai.configure(api_key=key_to_check.strip())
         # Lệnh gọi API nhẹ nhàng để kiểm tra
-        [m for m in genai.list_models()]
+        await asyncio.to_thread(gemini_client_pool.validate_key, key_to_check.strip())
         new_status = "valid"
     except Exception as e:
         print(f"Status check failed for key ending in ...{key_to_check[-4:]}: {e}")
@@ -284,6 +282,25 @@ async def check_key_status(request: Request, key_to_check: str = Form(...), user
     
     return JSONResponse({"status": new_status})
 
+@router.get("/admin/llm-cache/stats")
+async def llm_cache_stats(user: str = Depends(get_current_admin)):
+    """Thống kê cache phản hồi LLM: số bản ghi và hit rate theo hàm gọi."""
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    stats = await asyncio.to_thread(llm_response_cache.get_stats)
+    return JSONResponse(stats)
+
+@router.get("/admin/llm-metrics")
+async def llm_call_metrics(hours: int = Query(24, ge=1, le=24 * 90), user: str = Depends(get_current_admin)):
+    """
+    Số liệu lệnh gọi LLM trong `hours` giờ gần nhất: số lượt, lỗi, thời gian chờ key, độ trễ và token
+    theo hàm gọi, model và key (đã che).
+    """
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    metrics = await asyncio.to_thread(llm_metrics.get_metrics, hours)
+    return JSONResponse(metrics)
+
 @router.get("/admin/history", response_class=HTMLResponse)
 async def view_history(
     request: Request,
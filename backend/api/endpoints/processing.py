@@ -1,33 +1,56 @@
+import asyncio
+import json
+import math
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from fastapi import APIRouter, Depends, HTTPException, status, Header, Request
-from fastapi.concurrency import run_in_threadpool
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Header, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from user_agents import parse
 
-from backend.database import get_db
+from backend.database import SessionLocal, get_db
 from backend.models.usage_log import UsageLog
 from backend.schemas.token import TokenData
 from backend.schemas.content import (
     ContentAnalysisRequest, 
     RewriteResponse,
+    BatchRewriteRequest,
+    BatchRewriteItemResult,
     SeoSuggestionRequest,
     SeoSuggestionResponse,
     SeoSuggestion,
+    SeoBatchSuggestionRequest,
+    SeoBatchItemResult,
     BioGenerationRequest,
-    BioGenerationResponse
+    BioGenerationResponse,
+    BioBulkRequest,
+    BioBulkItemResult,
+    BioJobCreated,
+    BioJobStatus
 )
 from backend.security import get_current_user
 from backend.services import gcp_nlp, llm_rewriter
+from backend.services.key_scheduler import KeyQuotaExhaustedError
+from backend.services.llm_cache import llm_cache_bypass
 from backend.core import seo_workflow, bio_workflow
+from backend.core.config import settings
+from backend.core.log import get_logger
+from backend.core.rewrite_batch import RewriteBatchPlan
+from backend.core.bio_batch import bio_jobs, run_bulk
 from langgraph.graph import StateGraph, END
 import pytz
 
-router = APIRouter()
+logger = get_logger(__name__)
 
-def _log_usage(db: Session, request: Request, user_email: str | None, feature_name: str):
-    """Hàm trợ giúp để ghi log sử dụng tính năng."""
+async def llm_cache_control(x_llm_cache: str | None = Header(default=None, alias="X-LLM-Cache")):
+    """Cho phép client bỏ qua cache phản hồi LLM cho request hiện tại bằng header `X-LLM-Cache: bypass`."""
+    llm_cache_bypass.set((x_llm_cache or "").strip().lower() == "bypass")
+
+router = APIRouter(dependencies=[Depends(llm_cache_control)])
+
+def _usage_fields(request: Request, user_email: str | None, feature_name: str) -> dict:
+    """Đọc thông tin của request (IP, user agent) thành các trường của một bản ghi UsageLog."""
     user_agent_string = request.headers.get("user-agent", "unknown")
     user_agent = parse(user_agent_string)
 
@@ -37,124 +60,201 @@ def _log_usage(db: Session, request: Request, user_email: str | None, feature_na
     else:
         ip_address = request.client.host
 
-    log_entry = UsageLog(
-        user_email=user_email or "unknown",
-        public_ip=ip_address,
-        user_agent=user_agent_string,
-        browser=user_agent.browser.family,
-        browser_version=user_agent.browser.version_string,
-        os=user_agent.os.family,
-        os_version=user_agent.os.version_string,
-        feature_name=feature_name
-    )
+    return {
+        "user_email": user_email or "unknown",
+        "public_ip": ip_address,
+        "user_agent": user_agent_string,
+        "browser": user_agent.browser.family,
+        "browser_version": user_agent.browser.version_string,
+        "os": user_agent.os.family,
+        "os_version": user_agent.os.version_string,
+        "feature_name": feature_name,
+    }
+
+def _log_usage(db: Session, request: Request, user_email: str | None, feature_name: str):
+    """Hàm trợ giúp để ghi log sử dụng tính năng."""
+    log_entry = UsageLog(**_usage_fields(request, user_email, feature_name))
     db.add(log_entry)
     db.commit()
     db.refresh(log_entry)
 
-def process_content_sync(
-    db: Session,
-    request_body: ContentAnalysisRequest,
-    current_user: TokenData,
-    x_user_email: str | None,
-    request: Request
-) -> RewriteResponse:
+def _write_usage_log(fields: dict):
+    """Ghi một bản ghi UsageLog bằng session riêng (chạy trong background task, sau khi đã trả response)."""
+    db = SessionLocal()
+    try:
+        db.add(UsageLog(**fields))
+        db.commit()
+    finally:
+        db.close()
+
+def _log_usage_in_background(background_tasks: BackgroundTasks, request: Request, user_email: str | None, feature_name: str):
     """
-    Hàm đồng bộ chứa logic xử lý nội dung nặng.
-    Hàm này sẽ được chạy trong một thread riêng để không block event loop.
+    Giống _log_usage nhưng không nằm trên đường xử lý chính: thông tin request được đọc ngay,
+    còn việc ghi DB được thực hiện sau khi response đã gửi đi.
     """
-    # --- Ghi log sử dụng ---
-    _log_usage(db, request, x_user_email, "Viết lại nội dung")
-
-    # --- GIAI ĐOẠN 1: Động cơ Phân tích & Đối chiếu ---
-    analysis_results = gcp_nlp.analyze_text(request_body.content)
-    enriched_data = {
-        "nlp_analysis": analysis_results,
-        "cross_reference_notes": []
-    }
+    background_tasks.add_task(_write_usage_log, _usage_fields(request, user_email, feature_name))
 
-    # --- Logic Đối chiếu Nâng cao bằng LLM (Async Wrapper) ---
-    async def async_tasks():
-        llm_analysis_task = llm_rewriter.analyze_context_with_llm(
+async def _analyze_for_rewrite(request_body: ContentAnalysisRequest) -> dict:
+    """
+    GIAI ĐOẠN 1: Động cơ Phân tích & Đối chiếu.
+    Phân tích NLP (client async) và phân tích ngữ cảnh bằng LLM không phụ thuộc nhau nên chạy song song.
+    """
+    analysis_results, llm_analysis_notes = await asyncio.gather(
+        gcp_nlp.analyze_text_async(request_body.content),
+        llm_rewriter.analyze_context_with_llm(
             content=request_body.content,
             main_topic=request_body.main_topic,
             search_intent=request_body.search_intent
         )
-        
-        # For now, we run this sequentially. Can be run in parallel if needed.
-        llm_analysis_notes = await llm_analysis_task
-        enriched_data["cross_reference_notes"].extend(llm_analysis_notes)
-
-        # --- GIAI ĐOẠN 2: Động cơ Tái cấu trúc ---
-        rewritten_content = await llm_rewriter.rewrite_content_with_gemini(
-            enriched_data=enriched_data,
-            content=request_body.content
-        )
-        return rewritten_content
-
-    # Since process_content_sync is a sync function run in a threadpool,
-    # we can create a new event loop to run our async functions.
-    import asyncio
-    rewritten_content = asyncio.run(async_tasks())
-
-    # Trả về kết quả cho client theo cấu trúc của schema RewriteResponse.
-    return RewriteResponse(
-        client_id=current_user.username,
-        original_content=request_body.content,
-        rewritten_content=rewritten_content,
-        analysis_notes=enriched_data["cross_reference_notes"]
     )
+    return {
+        "nlp_analysis": analysis_results,
+        "cross_reference_notes": list(llm_analysis_notes),
+        "main_topic": request_body.main_topic
+    }
 
 @router.post("/process-content", response_model=RewriteResponse)
 async def process_content(
     request_body: ContentAnalysisRequest,
     request: Request,
+    background_tasks: BackgroundTasks,
     current_user: TokenData = Depends(get_current_user),
-    db: Session = Depends(get_db),
     x_user_email: str | None = Header(default=None, alias="X-User-Email")
 ) -> RewriteResponse:
     """
     Endpoint được bảo vệ để xử lý nội dung.
     Nhận nội dung, phân tích và trả về phiên bản đã được viết lại.
-    Các tác vụ blocking sẽ được chạy trong một thread pool riêng.
+    Toàn bộ pipeline chạy trực tiếp trên event loop (không cần thread pool hay event loop riêng);
+    việc ghi log sử dụng được đẩy ra background task.
     """
+    # --- Ghi log sử dụng ---
+    _log_usage_in_background(background_tasks, request, x_user_email, "Viết lại nội dung")
+
     try:
-        # Chạy hàm xử lý đồng bộ trong một thread riêng
-        response = await run_in_threadpool(
-            process_content_sync,
-            db=db,
-            request_body=request_body,
-            current_user=current_user,
-            x_user_email=x_user_email,
-            request=request
+        enriched_data = await _analyze_for_rewrite(request_body)
+
+        # --- GIAI ĐOẠN 2: Động cơ Tái cấu trúc ---
+        rewritten_content = await llm_rewriter.rewrite_content_with_gemini(
+            enriched_data=enriched_data,
+            content=request_body.content,
+            rewrite_mode=request_body.rewrite_mode
         )
-        return response
+    except KeyQuotaExhaustedError:
+        # Được main.py chuyển thành 429 kèm Retry-After
+        raise
     except Exception as e:
         # Bắt các lỗi có thể xảy ra từ các service (ví dụ: lỗi xác thực API của Google).
-        # Trong ứng dụng thực tế, nên có logging chi tiết hơn.
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred during content analysis: {e}"
         )
 
-@router.post("/generate-seo-suggestions", response_model=SeoSuggestionResponse)
-async def generate_seo_suggestions(
-    request_body: SeoSuggestionRequest,
+    # Trả về kết quả cho client theo cấu trúc của schema RewriteResponse.
+    return RewriteResponse(
+        client_id=current_user.username,
+        original_content=request_body.content,
+        rewritten_content=rewritten_content,
+        analysis_notes=enriched_data["cross_reference_notes"],
+        patch=enriched_data.get("rewrite_patch")
+    )
+
+def _sse_event(event: str, data: dict) -> str:
+    """Định dạng một sự kiện Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/process-content/stream")
+async def process_content_stream(
+    request_body: ContentAnalysisRequest,
     request: Request,
-    db: Session = Depends(get_db),
+    background_tasks: BackgroundTasks,
+    current_user: TokenData = Depends(get_current_user),
     x_user_email: str | None = Header(default=None, alias="X-User-Email")
-) -> SeoSuggestionResponse:
+) -> StreamingResponse:
     """
-    Endpoint để tạo gợi ý nội dung SEO dựa trên từ khóa.
-    Sử dụng LangGraph để điều phối một workflow phức tạp:
-    1. Crawl top 10 Google results.
-    2. Analyze each result using GCP NLP and a custom LLM analyzer.
-    3. Synthesize insights into a master content brief.
-    4. Generate multiple content suggestions based on the brief.
+    Phiên bản streaming (Server-Sent Events) của /process-content.
+    Thứ tự sự kiện:
+    - `status`: gửi ngay khi nhận request.
+    - `analysis`: kết quả NLP và các ghi chú phân tích (analysis_notes).
+    - `chunk`: từng đoạn nội dung viết lại ngay khi Gemini sinh ra.
+    - `done` hoặc `error`: kết thúc stream.
     """
     # --- Ghi log sử dụng ---
-    _log_usage(db, request, x_user_email, "Gợi ý SEO")
-    
-    # --- 1. Xây dựng Graph Workflow ---
+    _log_usage_in_background(background_tasks, request, x_user_email, "Viết lại nội dung (streaming)")
+
+    async def event_stream():
+        yield _sse_event("status", {"client_id": current_user.username, "stage": "analyzing"})
+        try:
+            # --- GIAI ĐOẠN 1: Phân tích NLP và phân tích ngữ cảnh bằng LLM chạy song song ---
+            enriched_data = await _analyze_for_rewrite(request_body)
+            yield _sse_event("analysis", {
+                "nlp_analysis": enriched_data["nlp_analysis"],
+                "analysis_notes": enriched_data["cross_reference_notes"]
+            })
+
+            # --- GIAI ĐOẠN 2: Stream nội dung viết lại ---
+            async for chunk in llm_rewriter.stream_rewrite_content_with_gemini(
+                enriched_data=enriched_data,
+                content=request_body.content
+            ):
+                yield _sse_event("chunk", {"text": chunk})
+
+            yield _sse_event("done", {"client_id": current_user.username})
+        except KeyQuotaExhaustedError as e:
+            yield _sse_event("error", {"detail": str(e), "retry_after": math.ceil(e.retry_after)})
+        except Exception as e:
+            # Header đã được gửi đi nên lỗi được báo qua một sự kiện thay vì HTTP 500.
+            logger.error(f"Error during streaming content rewrite: {e}")
+            yield _sse_event("error", {"detail": f"An error occurred during content analysis: {e}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/process-content/batch")
+async def process_content_batch(
+    request_body: BatchRewriteRequest,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    current_user: TokenData = Depends(get_current_user),
+    x_user_email: str | None = Header(default=None, alias="X-User-Email")
+) -> StreamingResponse:
+    """
+    Viết lại nhiều bài trong một request.
+    - Giai đoạn NLP và LLM của mọi bài được điều phối bởi một kế hoạch song song chung (xem core/rewrite_batch),
+      được tính theo số key/service account hiện có.
+    - Bài trùng lặp (cùng nội dung và tham số) chỉ được xử lý một lần.
+    - Kết quả của từng bài được stream về dạng NDJSON ngay khi hoàn thành (trường `index` là vị trí của bài trong request);
+      bài lỗi được báo qua trường `error` mà không làm hỏng cả batch.
+    """
+    documents = request_body.documents
+    if not documents:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No documents provided.")
+    if len(documents) > settings.REWRITE_BATCH_MAX_DOCUMENTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch may contain at most {settings.REWRITE_BATCH_MAX_DOCUMENTS} documents."
+        )
+
+    # --- Ghi log sử dụng ---
+    _log_usage_in_background(background_tasks, request, x_user_email, "Viết lại nội dung hàng loạt")
+
+    plan = RewriteBatchPlan()
+
+    async def stream_results():
+        async for indices, result, error in plan.run(documents):
+            for index in indices:
+                if error is not None:
+                    item = BatchRewriteItemResult(index=index, error=str(error))
+                else:
+                    item = BatchRewriteItemResult(index=index, **result)
+                yield json.dumps(item.dict(), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+def _build_seo_workflow():
+    """Xây dựng và compile graph LangGraph cho workflow gợi ý SEO."""
     workflow = StateGraph(seo_workflow.GraphState)
 
     # Thêm các node vào graph theo workflow mới
@@ -164,22 +264,37 @@ async def generate_seo_suggestions(
     workflow.add_node("generate_ideas", seo_workflow.generate_initial_ideas)
     workflow.add_node("generate_outlines", seo_workflow.generate_outlines)
     workflow.add_node("generate_articles", seo_workflow.generate_full_articles)
+    workflow.add_node("classify_categories", seo_workflow.classify_categories)
+    workflow.add_node("assemble_suggestions", seo_workflow.assemble_suggestions)
 
     # Kết nối các node theo đúng thứ tự
     workflow.set_entry_point("fetch_articles")
     workflow.add_edge("fetch_articles", "analyze_content")
     workflow.add_edge("analyze_content", "synthesize")
     workflow.add_edge("synthesize", "generate_ideas")
-    workflow.add_edge("generate_ideas", "generate_outlines")
+    # Các giai đoạn sau được lập kế hoạch dựa trên output_fields:
+    # bỏ qua outline/article nếu không cần 'content', bỏ qua NLP nếu không cần 'categories'.
+    workflow.add_conditional_edges("generate_ideas", seo_workflow.route_after_ideas, {
+        "generate_outlines": "generate_outlines",
+        "classify_categories": "classify_categories",
+        "assemble_suggestions": "assemble_suggestions",
+    })
     workflow.add_edge("generate_outlines", "generate_articles")
-    workflow.add_edge("generate_articles", END)
+    workflow.add_conditional_edges("generate_articles", seo_workflow.route_after_articles, {
+        "classify_categories": "classify_categories",
+        "assemble_suggestions": "assemble_suggestions",
+    })
+    workflow.add_edge("classify_categories", "assemble_suggestions")
+    workflow.add_edge("assemble_suggestions", END)
 
     # Compile graph thành một đối tượng có thể thực thi
     app = workflow.compile()
+    return app
 
-    # --- 2. Chuẩn bị đầu vào và thực thi Graph ---
-    initial_state = {
-        "keyword": request_body.keyword,
+def _seo_initial_state(request_body, keyword: str, shared_cache=None) -> dict:
+    """Tạo state ban đầu cho workflow SEO từ request (đơn lẻ hoặc batch)."""
+    return {
+        "keyword": keyword,
         "output_fields": request_body.output_fields,
         "num_suggestions": request_body.num_suggestions,
         "language": request_body.language,
@@ -195,9 +310,33 @@ async def generate_seo_suggestions(
         "content_brief": "",
         "seo_ideas": [],
         "outlines": [],
-        "final_suggestions": []
+        "articles": [],
+        "categories": [],
+        "final_suggestions": [],
+        "shared_cache": shared_cache
     }
 
+@router.post("/generate-seo-suggestions", response_model=SeoSuggestionResponse)
+async def generate_seo_suggestions(
+    request_body: SeoSuggestionRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    x_user_email: str | None = Header(default=None, alias="X-User-Email")
+) -> SeoSuggestionResponse:
+    """
+    Endpoint để tạo gợi ý nội dung SEO dựa trên từ khóa.
+    Sử dụng LangGraph để điều phối một workflow phức tạp:
+    1. Crawl top 10 Google results.
+    2. Analyze each result using GCP NLP and a custom LLM analyzer.
+    3. Synthesize insights into a master content brief.
+    4. Generate multiple content suggestions based on the brief.
+    """
+    # --- Ghi log sử dụng ---
+    _log_usage(db, request, x_user_email, "Gợi ý SEO")
+    
+    app = _build_seo_workflow()
+    initial_state = _seo_initial_state(request_body, request_body.keyword)
+
     try:
         # Chạy workflow bất đồng bộ
         final_state = await app.ainvoke(initial_state)
@@ -208,6 +347,9 @@ async def generate_seo_suggestions(
         
         return SeoSuggestionResponse(suggestions=suggestions_list)
 
+    except KeyQuotaExhaustedError:
+        # Được main.py chuyển thành 429 kèm Retry-After
+        raise
     except Exception as e:
         # Xử lý lỗi chung từ workflow
         # Trong thực tế, nên có logging chi tiết hơn
@@ -217,24 +359,74 @@ async def generate_seo_suggestions(
             detail=f"An error occurred in the SEO suggestion workflow: {e}"
         )
 
-@router.post("/generate-bio-entities", response_model=BioGenerationResponse)
-async def generate_bio_entities(
-    request_body: BioGenerationRequest,
+@router.post("/generate-seo-suggestions-batch")
+async def generate_seo_suggestions_batch(
+    request_body: SeoBatchSuggestionRequest,
     request: Request,
     db: Session = Depends(get_db),
     x_user_email: str | None = Header(default=None, alias="X-User-Email")
-) -> BioGenerationResponse:
+) -> StreamingResponse:
     """
-    Endpoint to generate bio entities based on provided keywords and information.
-    Uses a LangGraph workflow to orchestrate LLM calls for generating:
-    1. Basic company/entity info if missing.
-    2. Relevant hashtags.
-    3. A list of bio paragraphs.
+    Endpoint tạo gợi ý SEO cho nhiều từ khóa cùng lúc.
+    - Các từ khóa được crawl và xử lý đồng thời, tối đa seo_workflow.batch_concurrency() từ khóa cùng lúc
+      (số crawl song song vẫn bị giới hạn bởi worker).
+    - URL đối thủ trùng nhau giữa các từ khóa chỉ được tải và phân tích một lần.
+    - Kết quả (brief + suggestions) của từng từ khóa được stream về dạng NDJSON ngay khi hoàn thành.
     """
     # --- Ghi log sử dụng ---
-    _log_usage(db, request, x_user_email, "Tạo Bio")
+    _log_usage(db, request, x_user_email, "Gợi ý SEO hàng loạt")
 
-    # --- 1. Build Workflow Graph ---
+    # Loại bỏ từ khóa rỗng/trùng lặp nhưng giữ nguyên thứ tự
+    keywords = list(dict.fromkeys(k.strip() for k in request_body.keywords if k and k.strip()))
+    if not keywords:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No keywords provided.")
+    if len(keywords) > settings.SEO_BATCH_MAX_KEYWORDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch may contain at most {settings.SEO_BATCH_MAX_KEYWORDS} keywords."
+        )
+
+    app = _build_seo_workflow()
+    shared_cache = seo_workflow.SharedArticleCache()
+    keyword_slots = asyncio.Semaphore(seo_workflow.batch_concurrency())
+
+    async def run_keyword(keyword: str) -> SeoBatchItemResult:
+        try:
+            async with keyword_slots:
+                final_state = await app.ainvoke(_seo_initial_state(request_body, keyword, shared_cache))
+            return SeoBatchItemResult(
+                keyword=keyword,
+                content_brief=final_state.get('content_brief'),
+                suggestions=[SeoSuggestion(**s) for s in final_state.get('final_suggestions', [])]
+            )
+        except Exception as e:
+            # Lỗi của một từ khóa không làm hỏng cả batch
+            logger.error(f"Error during batch SEO workflow: {e}", extra={"fields": {"keyword": keyword}})
+            return SeoBatchItemResult(keyword=keyword, error=str(e))
+
+    async def stream_results():
+        tasks = [asyncio.create_task(run_keyword(keyword)) for keyword in keywords]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield json.dumps(result.dict(), ensure_ascii=False) + "\n"
+        finally:
+            # Client ngắt kết nối giữa chừng: hủy các từ khóa còn lại
+            for task in tasks:
+                task.cancel()
+        logger.info("Batch SEO finished", extra={"fields": {
+            "keywords": len(keywords),
+            "shared_content_hits": shared_cache.content_hits,
+            "shared_analysis_hits": shared_cache.analysis_hits,
+        }})
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+def _build_bio_workflow():
+    """
+    Xây dựng và compile graph LangGraph cho workflow tạo bio.
+    Hashtag và bio chỉ phụ thuộc vào thông tin cơ bản nên chạy song song sau generate_info.
+    """
     workflow = StateGraph(bio_workflow.BioGraphState)
 
     # Add nodes to the graph
@@ -242,22 +434,66 @@ async def generate_bio_entities(
     workflow.add_node("generate_hashtags", bio_workflow.generate_hashtags)
     workflow.add_node("generate_bios", bio_workflow.generate_bio_entities)
 
-    # Connect the nodes in sequence
+    # generate_info -> (generate_hashtags || generate_bios) -> END
     workflow.set_entry_point("generate_info")
     workflow.add_edge("generate_info", "generate_hashtags")
-    workflow.add_edge("generate_hashtags", "generate_bios")
+    workflow.add_edge("generate_info", "generate_bios")
+    workflow.add_edge("generate_hashtags", END)
     workflow.add_edge("generate_bios", END)
 
     # Compile the graph
-    app = workflow.compile()
+    return workflow.compile()
 
-    # --- 2. Prepare Initial State and Invoke Graph ---
+def _bio_initial_state(request_body: BioGenerationRequest) -> dict:
+    """Tạo state ban đầu cho workflow bio từ một request (hoặc một dòng của bulk)."""
     initial_state = request_body.dict()
-    
+
     # Ensure keys for populated fields exist
     initial_state.setdefault("hashtag", None)
     initial_state.setdefault("bioEntities", None)
+    return initial_state
+
+def _bio_row_runner():
+    """Hàm chạy workflow bio cho từng dòng của bulk (graph được compile một lần cho cả batch)."""
+    app = _build_bio_workflow()
 
+    async def run_row(row: BioGenerationRequest) -> dict:
+        final_state = await app.ainvoke(_bio_initial_state(row))
+        return BioGenerationResponse(**final_state).dict()
+
+    return run_row
+
+def _validate_bio_rows(rows: list):
+    if not rows:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No rows provided.")
+    if len(rows) > settings.BIO_BULK_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A bulk request may contain at most {settings.BIO_BULK_MAX_ROWS} rows."
+        )
+
+@router.post("/generate-bio-entities", response_model=BioGenerationResponse)
+async def generate_bio_entities(
+    request_body: BioGenerationRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    x_user_email: str | None = Header(default=None, alias="X-User-Email")
+) -> BioGenerationResponse:
+    """
+    Endpoint to generate bio entities based on provided keywords and information.
+    Uses a LangGraph workflow to orchestrate LLM calls for generating:
+    1. Basic company/entity info if missing.
+    2. Relevant hashtags.
+    3. A list of bio paragraphs.
+    """
+    # --- Ghi log sử dụng ---
+    _log_usage(db, request, x_user_email, "Tạo Bio")
+
+    # --- 1. Build Workflow Graph ---
+    app = _build_bio_workflow()
+
+    # --- 2. Prepare Initial State and Invoke Graph ---
+    initial_state = _bio_initial_state(request_body)
 
     try:
         # Asynchronously invoke the workflow
@@ -267,9 +503,70 @@ async def generate_bio_entities(
         # The final state should match the BioGenerationResponse schema
         return BioGenerationResponse(**final_state)
 
+    except KeyQuotaExhaustedError:
+        # Được main.py chuyển thành 429 kèm Retry-After
+        raise
     except Exception as e:
         print(f"Error during bio generation workflow: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred in the bio generation workflow: {e}"
         )
+
+@router.post("/generate-bio-entities/bulk")
+async def generate_bio_entities_bulk(
+    request_body: BioBulkRequest,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    x_user_email: str | None = Header(default=None, alias="X-User-Email")
+) -> StreamingResponse:
+    """
+    Tạo bio cho nhiều hồ sơ (ví dụ mọi dòng của sheet Bio_Input) trong một request.
+    - Số hồ sơ chạy đồng thời được giới hạn theo số key hiện có (xem core/bio_batch).
+    - Hồ sơ trùng nhau chỉ được tạo một lần.
+    - Kết quả của từng dòng được stream về dạng NDJSON ngay khi hoàn thành (trường `index` là vị trí của dòng);
+      dòng lỗi được báo qua trường `error` mà không làm hỏng cả batch.
+    """
+    _validate_bio_rows(request_body.rows)
+    # --- Ghi log sử dụng ---
+    _log_usage_in_background(background_tasks, request, x_user_email, "Tạo Bio hàng loạt")
+
+    async def stream_results():
+        async for indices, result, error in run_bulk(request_body.rows, _bio_row_runner()):
+            for index in indices:
+                item = BioBulkItemResult(index=index, result=result, error=str(error) if error is not None else None)
+                yield json.dumps(item.dict(), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@router.post("/bio-jobs", response_model=BioJobCreated)
+async def create_bio_job(
+    request_body: BioBulkRequest,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    x_user_email: str | None = Header(default=None, alias="X-User-Email")
+) -> BioJobCreated:
+    """
+    Giống /generate-bio-entities/bulk nhưng chạy như một job trong nền: trả về job_id ngay,
+    client (ví dụ Apps Script, vốn không đọc được stream) poll GET /bio-jobs/{job_id} để lấy kết quả dần.
+    """
+    _validate_bio_rows(request_body.rows)
+    # --- Ghi log sử dụng ---
+    _log_usage_in_background(background_tasks, request, x_user_email, "Tạo Bio hàng loạt (job)")
+
+    job = bio_jobs.start(request_body.rows, _bio_row_runner())
+    return BioJobCreated(job_id=job.id, total=job.total)
+
+@router.get("/bio-jobs/{job_id}", response_model=BioJobStatus)
+async def get_bio_job(job_id: str, offset: int = 0) -> BioJobStatus:
+    """Trạng thái của một job bio và các kết quả đã xong kể từ vị trí `offset` (số kết quả client đã nhận)."""
+    job = bio_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found or expired.")
+    return BioJobStatus(
+        job_id=job.id,
+        status=job.status,
+        total=job.total,
+        completed=len(job.results),
+        results=[BioBulkItemResult(**item) for item in job.results[max(0, offset):]]
+    )
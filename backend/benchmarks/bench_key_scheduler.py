@@ -0,0 +1,124 @@
+"""
+Benchmark cho backend/services/key_scheduler.py: nhiều lệnh gọi đồng thời tranh một nhóm key có giới hạn tần suất.
+
+Chạy từ thư mục gốc của repo:
+    python -m backend.benchmarks.bench_key_scheduler [--keys 50] [--callers 200] [--interval 0.05] [--seconds 3]
+
+So sánh với thuật toán cũ của RateLimitedApiKeyManager.get_next_key_async (deque cho mỗi tier, một asyncio.Lock
+chung cho mọi tier, chờ key "nóng" trong khi vẫn giữ lock). Hai kịch bản:
+- "one tier": mọi key và mọi lệnh gọi cùng một tier. Thông lượng tối đa là keys / interval lần lấy key mỗi giây.
+- "two tiers": 20% key phục vụ tier "pro" đang quá tải, 80% key phục vụ tier "flash" còn dư; một nửa lệnh gọi
+  thuộc mỗi tier. Với lock chung, lệnh gọi "flash" phải xếp hàng sau các lệnh gọi "pro" đang ngủ chờ key.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+
+from backend.services.key_scheduler import KeyScheduler
+
+class LegacyDequeScheduler:
+    """Tái hiện thuật toán cũ (một tier) để so sánh; `lock` được dùng chung giữa các tier như trong manager cũ."""
+    def __init__(self, keys, interval, lock):
+        self.interval = interval
+        self.lock = lock
+        self.queue = deque((key, 0) for key in keys)
+
+    async def acquire(self, preferred_keys=None):
+        async with self.lock:
+            queue = self.queue
+            if preferred_keys:
+                current_time = time.monotonic()
+                for index, (key, last_used_time) in enumerate(queue):
+                    if key in preferred_keys and current_time - last_used_time >= self.interval:
+                        del queue[index]
+                        queue.append((key, current_time))
+                        return key
+            while True:
+                index = min(range(len(queue)), key=lambda i: queue[i][1])
+                key, last_used_time = queue[index]
+                current_time = time.monotonic()
+                elapsed_time = current_time - last_used_time
+                if elapsed_time >= self.interval:
+                    del queue[index]
+                    queue.append((key, current_time))
+                    return key
+                await asyncio.sleep(self.interval - elapsed_time)
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))] * 1000 if values else 0.0
+
+async def _run(tiers: dict, callers_per_tier: dict, seconds: float, call_seconds: float, seed: int):
+    """`tiers`: tên tier -> scheduler. Trả về số key/giây và độ trễ chờ key theo từng tier."""
+    rng = random.Random(seed)
+    waits = {tier: [] for tier in tiers}
+    deadline = time.monotonic() + seconds
+
+    async def caller(tier):
+        scheduler = tiers[tier]
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            await scheduler.acquire()
+            waits[tier].append(time.monotonic() - started)
+            # Giả lập thời gian của lệnh gọi LLM (không giữ key/lock)
+            await asyncio.sleep(rng.uniform(0, 2 * call_seconds))
+
+    started = time.monotonic()
+    await asyncio.gather(*(caller(tier) for tier, count in callers_per_tier.items() for _ in range(count)))
+    elapsed = time.monotonic() - started
+    return {
+        tier: {
+            "grants_per_second": len(tier_waits) / elapsed,
+            "p50_wait_ms": _percentile(tier_waits, 0.5),
+            "p95_wait_ms": _percentile(tier_waits, 0.95),
+        }
+        for tier, tier_waits in waits.items()
+    }
+
+def _print(label: str, results: dict):
+    for tier, result in results.items():
+        print(f"{label:<26} {tier:<6} {result['grants_per_second']:>8.1f} keys/s   "
+              f"p50 wait {result['p50_wait_ms']:>7.1f} ms   p95 wait {result['p95_wait_ms']:>7.1f} ms")
+
+def _heap_tiers(key_sets: dict, interval: float) -> dict:
+    tiers = {}
+    for tier, keys in key_sets.items():
+        tiers[tier] = KeyScheduler(interval)
+        tiers[tier].set_keys(keys)
+    return tiers
+
+async def _legacy_run(key_sets: dict, interval: float, *run_args):
+    # asyncio.Lock phải được tạo trong event loop của lần chạy
+    lock = asyncio.Lock()
+    tiers = {tier: LegacyDequeScheduler(keys, interval, lock) for tier, keys in key_sets.items()}
+    return await _run(tiers, *run_args)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=50)
+    parser.add_argument("--callers", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.05, help="Khoảng cách tối thiểu giữa hai lần dùng một key (giây)")
+    parser.add_argument("--call-seconds", type=float, default=0.02, help="Thời gian trung bình của một lệnh gọi giả lập")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    keys = [f"key-{i}" for i in range(args.keys)]
+    print(f"{args.keys} keys, {args.callers} concurrent callers, interval {args.interval}s, {args.seconds}s per run\n")
+
+    print(f"One tier (max {args.keys / args.interval:.0f} keys/s):")
+    one_tier = {"all": keys}
+    run_args = ({"all": args.callers}, args.seconds, args.call_seconds, 1)
+    _print("KeyScheduler (min-heap)", asyncio.run(_run(_heap_tiers(one_tier, args.interval), *run_args)))
+    _print("Legacy deque + lock", asyncio.run(_legacy_run(one_tier, args.interval, *run_args)))
+
+    split = max(1, args.keys // 5)
+    two_tiers = {"pro": keys[:split], "flash": keys[split:]}
+    print(f"\nTwo tiers (pro: {split} keys, flash: {args.keys - split} keys, {args.callers // 2} callers each):")
+    run_args = ({"pro": args.callers // 2, "flash": args.callers - args.callers // 2}, args.seconds, args.call_seconds, 1)
+    _print("KeyScheduler (min-heap)", asyncio.run(_run(_heap_tiers(two_tiers, args.interval), *run_args)))
+    _print("Legacy deque + lock", asyncio.run(_legacy_run(two_tiers, args.interval, *run_args)))
+
+if __name__ == "__main__":
+    main()
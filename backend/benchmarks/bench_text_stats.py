@@ -0,0 +1,90 @@
+"""
+Benchmark cho backend/services/text_stats.py trên văn bản 50.000 từ.
+
+Chạy từ thư mục gốc của repo:
+    python -m backend.benchmarks.bench_text_stats [--words 50000] [--repeat 3]
+
+So sánh với các heuristic cũ của llm_rewriter (tách câu bằng split('.'),
+đếm thực thể bằng list.count trong set comprehension - độ phức tạp bậc hai).
+"""
+import argparse
+import random
+import time
+
+from backend.services import text_stats
+
+_SYLLABLES = [
+    "công", "ty", "dịch", "vụ", "khách", "hàng", "chất", "lượng", "sản", "phẩm", "thị", "trường", "giá", "tốt",
+    "nhanh", "chóng", "uy", "tín", "hệ", "thống", "phát", "triển", "doanh", "nghiệp", "giải", "pháp", "an", "toàn",
+]
+_FRAGMENTS = ["TP. HCM", "PGS. TS. Nguyễn", "3.5 triệu", "1.000.000 đồng", "v.v.", "Q. 1"]
+
+def build_document(word_count: int, seed: int = 42) -> str:
+    """Tạo văn bản tiếng Việt giả lập có heading, viết tắt, số thập phân và câu dài/ngắn xen kẽ."""
+    rng = random.Random(seed)
+    parts, words = [], 0
+    section = 0
+    while words < word_count:
+        if words % 800 < 20:
+            section += 1
+            parts.append(f"\n\n## Phần {section}\n\n")
+        length = rng.choice([8, 12, 18, 30, 40])
+        sentence = [rng.choice(_SYLLABLES) for _ in range(length)]
+        if rng.random() < 0.2:
+            sentence.insert(rng.randrange(len(sentence)), rng.choice(_FRAGMENTS))
+        parts.append(" ".join(sentence).capitalize() + rng.choice([". ", ". ", "! ", "? "]))
+        words += length
+    return "".join(parts)
+
+def build_entities(count: int, unique: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    return [{"name": f"Thực thể {rng.randrange(unique)}", "type": "OTHER"} for _ in range(count)]
+
+def _naive_long_sentences(content: str) -> int:
+    sentences = content.split('.')
+    return len([s for s in sentences if len(s.split()) > 25])
+
+def _naive_top_entities(entities: list) -> list:
+    entity_names = [e.get("name", "").lower() for e in entities]
+    entity_counts = {name: entity_names.count(name) for name in set(entity_names)}
+    return sorted(entity_counts.items(), key=lambda item: item[1], reverse=True)[:3]
+
+def _time(label: str, func, repeat: int):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    print(f"{label:<42} {best * 1000:>10.1f} ms")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=50000)
+    parser.add_argument("--entities", type=int, default=50000)
+    parser.add_argument("--unique-entities", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    document = build_document(args.words)
+    entities = build_entities(args.entities, args.unique_entities)
+    print(f"Document: {len(text_stats.tokenize_words(document))} words, {len(document)} chars; "
+          f"entities: {len(entities)} ({args.unique_entities} unique)\n")
+
+    sentences = _time("text_stats.split_sentences", lambda: text_stats.split_sentences(document), args.repeat)
+    stats = _time("text_stats.readability", lambda: text_stats.readability(document), args.repeat)
+    _time("text_stats.keyword_density", lambda: text_stats.keyword_density(document, "dịch vụ khách hàng"), args.repeat)
+    _time("text_stats.heading_structure", lambda: text_stats.heading_structure(document), args.repeat)
+    _time("text_stats.analyze (all, one pass)", lambda: text_stats.analyze(document, keyword="giá tốt"), args.repeat)
+    top = _time("text_stats.entity_frequency (Counter)", lambda: text_stats.entity_frequency(entities, top_n=3), args.repeat)
+    print()
+    naive_long = _time("naive split('.') long sentences", lambda: _naive_long_sentences(document), args.repeat)
+    naive_top = _time("naive list.count entity frequency", lambda: _naive_top_entities(entities), 1)
+
+    print(f"\nSentences: {len(sentences)} (naive split('.') gives {document.count('.') + 1} fragments)")
+    print(f"Long sentences: {stats['long_sentences']} (naive: {naive_long})")
+    print(f"Top entities: {top} (naive: {naive_top})")
+
+if __name__ == "__main__":
+    main()
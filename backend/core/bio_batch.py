@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from backend.core import model_routing
+from backend.core.config import settings
+from backend.services.api_key_manager import api_key_manager
+from backend.core.log import get_logger
+
+logger = get_logger(__name__)
+
+# Tạo bio hàng loạt (một dòng sheet = một hồ sơ): giới hạn số hồ sơ chạy đồng thời theo số key,
+# hồ sơ trùng nhau chỉ chạy một lần, kết quả trả về ngay khi từng hồ sơ xong (stream NDJSON hoặc job để poll).
+
+RowRunner = Callable[[Any], Awaitable[Dict[str, Any]]]
+
+def _profile_key(row) -> str:
+    """Các dòng có cùng toàn bộ thông tin đầu vào được coi là một hồ sơ."""
+    return hashlib.sha256(json.dumps(row.dict(), sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def bulk_concurrency() -> int:
+    """Số hồ sơ chạy đồng thời: theo số key của tier tạo bio, không vượt quá BIO_BULK_MAX_CONCURRENCY."""
+    keys = api_key_manager.key_count(model_routing.tier_for_task("bio_entities"))
+    return max(1, min(settings.BIO_BULK_MAX_CONCURRENCY, keys * settings.BATCH_CALLS_PER_KEY))
+
+async def run_bulk(
+    rows: List, run_row: RowRunner, concurrency: Optional[int] = None
+) -> AsyncIterator[Tuple[List[int], Optional[Dict[str, Any]], Optional[Exception]]]:
+    """
+    Chạy `run_row` cho mọi hồ sơ với số lượng đồng thời giới hạn và trả về (các vị trí trong request, kết quả, lỗi)
+    ngay khi từng hồ sơ xong. Lỗi của một hồ sơ không làm hỏng các hồ sơ khác.
+    """
+    groups: Dict[str, List[int]] = {}
+    for index, row in enumerate(rows):
+        groups.setdefault(_profile_key(row), []).append(index)
+    concurrency = concurrency or bulk_concurrency()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_group(indices: List[int]):
+        async with semaphore:
+            try:
+                return indices, await run_row(rows[indices[0]]), None
+            except Exception as e:
+                logger.error(f"Bulk bio generation failed for a row: {e}", extra={"fields": {"indices": indices}})
+                return indices, None, e
+
+    started = time.monotonic()
+    tasks = [asyncio.create_task(run_group(indices)) for indices in groups.values()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client ngắt kết nối hoặc job bị hủy: hủy các hồ sơ còn lại
+        for task in tasks:
+            task.cancel()
+    logger.info("Bulk bio generation finished", extra={"fields": {
+        "rows": len(rows), "duplicates": len(rows) - len(groups), "concurrency": concurrency,
+        "seconds": round(time.monotonic() - started, 2),
+    }})
+
+class BioJob:
+    """Một lần chạy bulk ở chế độ job: kết quả được tích lũy theo thứ tự hoàn thành để client poll dần."""
+    def __init__(self, total: int):
+        self.id = uuid.uuid4().hex
+        self.total = total
+        self.results: List[Dict[str, Any]] = []
+        self.status = "running"
+        self.created_at = time.monotonic()
+        # Thời điểm job kết thúc (hoàn tất, lỗi hoặc bị hủy); None khi còn đang chạy
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self, rows: List, run_row: RowRunner) -> None:
+        try:
+            async for indices, result, error in run_bulk(rows, run_row):
+                for index in indices:
+                    if error is not None:
+                        self.results.append({"index": index, "result": None, "error": str(error)})
+                    else:
+                        self.results.append({"index": index, "result": result, "error": None})
+            self.status = "completed"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Bulk bio job failed: {e}", extra={"fields": {"job_id": self.id}})
+            self.status = "failed"
+        finally:
+            self.finished_at = time.monotonic()
+
+class BioJobStore:
+    """
+    Lưu các job trong bộ nhớ của process. Job đã kết thúc quá BIO_JOB_TTL_SECONDS (tính từ lúc kết thúc)
+    được dọn khi tạo job mới; job đang chạy không bao giờ bị dọn.
+    """
+    def __init__(self):
+        self._jobs: Dict[str, BioJob] = {}
+
+    def _evict_expired(self) -> None:
+        cutoff = time.monotonic() - settings.BIO_JOB_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def start(self, rows: List, run_row: RowRunner) -> BioJob:
+        self._evict_expired()
+        job = BioJob(len(rows))
+        job.task = asyncio.create_task(job.run(rows, run_row))
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[BioJob]:
+        return self._jobs.get(job_id)
+
+bio_jobs = BioJobStore()
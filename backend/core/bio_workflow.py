@@ -50,18 +50,19 @@ async def generate_basic_info(state: BioGraphState) -> BioGraphState:
     state.update(updated_info)
     return state
 
-async def generate_hashtags(state: BioGraphState) -> BioGraphState:
+# generate_hashtags và generate_bio_entities chỉ phụ thuộc vào thông tin cơ bản nên chạy song song (fan-out sau generate_info).
+# Hai node song song chỉ được trả về trường mình cập nhật; LangGraph báo lỗi nếu cả hai cùng ghi một trường.
+
+async def generate_hashtags(state: BioGraphState) -> Dict[str, Any]:
     """
     Node to generate hashtags based on the completed basic info.
     """
-    updated_state = await llm_bio_generator.generate_hashtags(state)
-    state.update(updated_state)
-    return state
+    updated_state = await llm_bio_generator.generate_hashtags(dict(state))
+    return {"hashtag": updated_state.get("hashtag")}
 
-async def generate_bio_entities(state: BioGraphState) -> BioGraphState:
+async def generate_bio_entities(state: BioGraphState) -> Dict[str, Any]:
     """
     Node to generate the final bio entities.
     """
-    updated_state = await llm_bio_generator.generate_bio_entities(state)
-    state.update(updated_state)
-    return state
+    updated_state = await llm_bio_generator.generate_bio_entities(dict(state))
+    return {"bioEntities": updated_state.get("bioEntities")}
@@ -1,3 +1,5 @@
+from typing import Any, Dict, Optional
+from pydantic import Field
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -17,6 +19,134 @@ class Settings(BaseSettings):
     WORKER_SECRET_ID: str 
     MAX_CONCURRENT_CRAWLS: int = 3
 
+    # LLM response cache
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_PATH: str = "backend/llm_cache.db"
+    LLM_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    LLM_CACHE_MAX_ENTRIES: int = 10000
+    # Chu kỳ dọn các bản ghi hết hạn
+    LLM_CACHE_PURGE_SECONDS: float = 3600.0
+
+    # LLM model routing: tier -> model & per-key rate limit, task -> tier
+    # (có thể ghi đè bằng JSON trong biến môi trường)
+    # rate_limit_seconds: khoảng cách tối thiểu giữa hai lần dùng một key;
+    # rpm / tpm / rpd: quota mỗi key trên model (request/phút, token đầu vào/phút, request/ngày), bỏ trống = không giới hạn.
+    # Mặc định không đặt: giới hạn thực tế được học từ lỗi 429 (xem services/key_quota.py). Với key free tier có thể khai báo trước, ví dụ
+    # LLM_MODEL_TIERS='{"pro": {"model": "gemini-2.5-pro", "rate_limit_seconds": 6, "rpm": 5, "tpm": 250000, "rpd": 100},
+    #   "flash": {"model": "gemini-2.5-flash", "rate_limit_seconds": 6, "rpm": 10, "tpm": 250000, "rpd": 250},
+    #   "lite": {"model": "gemini-2.5-flash-lite", "rate_limit_seconds": 4, "rpm": 15, "tpm": 250000, "rpd": 1000}}'
+    LLM_MODEL_TIERS: Dict[str, Dict[str, Any]] = {
+        "pro": {"model": "gemini-2.5-pro", "rate_limit_seconds": 6},
+        "flash": {"model": "gemini-2.5-flash", "rate_limit_seconds": 6},
+        "lite": {"model": "gemini-2.5-flash-lite", "rate_limit_seconds": 4},
+    }
+    LLM_TASK_TIERS: Dict[str, str] = {
+        "competitor_analysis": "flash",
+        "brief_synthesis": "pro",
+        "ideas": "pro",
+        "outline": "pro",
+        "article": "pro",
+        "hashtags": "lite",
+        "basic_info": "flash",
+        "bio_entities": "flash",
+        "context_analysis": "flash",
+        "rewrite": "pro",
+    }
+    LLM_DEFAULT_TIER: str = "pro"
+
+    # LLM retry policy & key failover
+    LLM_MAX_ATTEMPTS: int = Field(5, ge=1)
+    LLM_BACKOFF_BASE_SECONDS: float = 1.0
+    LLM_BACKOFF_MAX_SECONDS: float = 30.0
+    KEY_COOLDOWN_SECONDS: float = 60.0
+    KEY_MAX_COOLDOWN_SECONDS: float = 600.0
+    KEY_QUARANTINE_AFTER: int = 3
+    KEY_QUARANTINE_SECONDS: float = 3600.0
+    # Số lần 403 liên tiếp trước khi key bị đánh dấu invalid (mỗi lần 403 key bị cách ly KEY_QUARANTINE_SECONDS trong tier)
+    KEY_INVALID_AFTER_FORBIDDEN: int = 3
+    # Thời gian tối đa một lệnh gọi chờ key còn quota; vượt quá thì trả 429 kèm Retry-After (None = chờ không giới hạn)
+    KEY_MAX_WAIT_SECONDS: Optional[float] = 60.0
+
+    # Kho Gemini API key (xem services/key_store.py); api_keys.json cũ được nhập ở lần chạy đầu tiên
+    API_KEYS_DB_PATH: str = "backend/api_keys.db"
+
+    # Theo dõi quota RPM/TPM/RPD của từng key (xem services/key_quota.py)
+    KEY_QUOTA_PATH: str = "backend/key_quota.db"
+    KEY_QUOTA_FLUSH_SECONDS: float = 30.0
+    # Giới hạn học được từ lỗi 429 hết hiệu lực sau khoảng này (quota của key có thể được nâng)
+    KEY_QUOTA_LEARNED_TTL_SECONDS: float = 86400.0
+
+    # Context caching cho tiền tố prompt dùng chung (content brief của outline/article)
+    # "gemini": dùng CachedContent của Gemini API, "fake": giả lập offline, "none": tắt
+    LLM_CONTEXT_CACHE_BACKEND: str = "none"
+    LLM_CONTEXT_CACHE_TTL_SECONDS: int = 3600
+    # Gemini yêu cầu số token tối thiểu cho một cached content; prefix ngắn hơn sẽ gửi dạng prompt đầy đủ
+    LLM_CONTEXT_CACHE_MIN_PREFIX_CHARS: int = 8000
+
+    # Đo lường lệnh gọi LLM (token, độ trễ, thời gian chờ key)
+    LLM_METRICS_PATH: str = "backend/llm_metrics.db"
+    LLM_METRICS_FLUSH_SECONDS: float = 30.0
+    LLM_METRICS_WINDOW_SIZE: int = 500
+
+    # Backend của các lệnh gọi model bên ngoài (Gemini, Natural Language) - xem services/model_backends.py
+    # "live" | "record" | "replay" | "synthetic"
+    MODEL_BACKEND_MODE: str = "live"
+    MODEL_CASSETTE_DIR: str = "backend/cassettes"
+    # Khi replay không tìm thấy cassette: "synthesize" (sinh phản hồi giả) hoặc "error"
+    MODEL_REPLAY_MISS_POLICY: str = "synthesize"
+    # Replay với độ trễ đã ghi trong cassette thay vì độ trễ giả lập
+    MODEL_REPLAY_RECORDED_LATENCY: bool = True
+    # Phân phối log-normal của độ trễ giả lập (trung vị và sigma)
+    MODEL_FAKE_LATENCY: Dict[str, Dict[str, float]] = {
+        "llm": {"median_seconds": 2.0, "sigma": 0.5},
+        "llm_stream_chunk": {"median_seconds": 0.05, "sigma": 0.3},
+        "nlp": {"median_seconds": 0.3, "sigma": 0.4},
+    }
+
+    # Viết lại song song theo từng phần cho bài dài
+    REWRITE_SECTION_THRESHOLD_CHARS: int = 12000  # Chế độ "auto" chỉ chia phần khi bài dài hơn ngưỡng này
+    REWRITE_SECTION_TARGET_CHARS: int = 5000  # Kích thước mục tiêu của mỗi phần
+    REWRITE_MAX_CONCURRENT_SECTIONS: int = 6
+
+    # Chế độ viết lại có chọn lọc (rewrite_mode="targeted")
+    REWRITE_TARGETED_PARAGRAPH_WORDS: int = 150  # Đoạn dài hơn ngưỡng này được đánh dấu cần viết lại
+    REWRITE_TARGETED_MAX_FRACTION: float = 0.6  # Nếu các đoạn cần sửa vượt quá tỷ lệ này của bài thì viết lại toàn bài
+
+    # Batch viết lại nhiều bài (/process-content/batch) - xem core/rewrite_batch.py
+    REWRITE_BATCH_MAX_DOCUMENTS: int = 100
+    # Trần số lệnh gọi đồng thời của cả batch; giá trị thực tế còn bị giới hạn bởi số key/service account hiện có
+    REWRITE_BATCH_MAX_LLM_CONCURRENCY: int = 16
+    REWRITE_BATCH_MAX_NLP_CONCURRENCY: int = 8
+
+    # Số lệnh gọi đồng thời tối đa trên mỗi key/service account khi lập kế hoạch cho các batch
+    BATCH_CALLS_PER_KEY: int = 2
+
+    # Gợi ý SEO hàng loạt (/generate-seo-suggestions-batch) - xem core/seo_workflow.py
+    SEO_BATCH_MAX_KEYWORDS: int = 50
+    SEO_BATCH_MAX_CONCURRENCY: int = 8
+
+    # Tạo bio hàng loạt (/generate-bio-entities/bulk và /bio-jobs) - xem core/bio_batch.py
+    BIO_BULK_MAX_ROWS: int = 500
+    BIO_BULK_MAX_CONCURRENCY: int = 16
+    BIO_JOB_TTL_SECONDS: int = 3600
+
+    # Dữ liệu mã bưu chính cục bộ (xem services/postal_gazetteer.py)
+    POSTAL_GAZETTEER_PATH: str = "backend/data/vn_postal_codes.csv"
+
+    # Hashtag cho bio (xem services/hashtag_engine.py)
+    HASHTAG_TOTAL: int = 15
+    # Số hashtag ngách tối thiểu LLM được yêu cầu bổ sung; LLM bù thêm nếu hashtag cục bộ chưa đủ HASHTAG_TOTAL (0 = chỉ dùng hashtag cục bộ)
+    HASHTAG_LLM_NICHE_COUNT: int = 5
+    HASHTAG_CACHE_MAX_ENTRIES: int = 1024
+
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    # "json" (một dòng JSON mỗi bản ghi) hoặc "text"
+    LOG_FORMAT: str = "json"
+    # Tỷ lệ payload lớn (prompt, bài viết) được ghi log và số ký tự tối đa được giữ lại
+    LOG_PAYLOAD_SAMPLE_RATE: float = 0.01
+    LOG_PAYLOAD_MAX_CHARS: int = 2000
+
     class Config:
         env_file = "backend/.env"
 
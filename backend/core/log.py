@@ -0,0 +1,105 @@
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Any, Optional
+
+from backend.core.config import settings
+
+# Logging có cấu trúc cho backend.
+# Bản ghi được định dạng (JSON một dòng) ở thread gọi rồi đưa vào hàng đợi; một thread nền (QueueListener)
+# chịu trách nhiệm ghi ra stderr, nên việc ghi log không bao giờ chặn event loop.
+# Mỗi dòng log mang request_id của request đang xử lý (xem middleware trong main.py).
+
+# Correlation id của request hiện tại; được sao chép sang task/thread con cùng với context
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Một dòng JSON cho mỗi bản ghi: thời gian, level, logger, request_id, message và các trường bổ sung."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Định dạng dễ đọc cho môi trường phát triển, vẫn kèm request_id và các trường bổ sung."""
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+def setup_logging():
+    """Gắn QueueHandler vào logger `backend` và khởi động thread ghi log nền. Gọi lại nhiều lần là an toàn."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(_RequestIdFilter())
+    if settings.LOG_FORMAT == "json":
+        queue_handler.setFormatter(JsonFormatter())
+    else:
+        queue_handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+
+    # Bản ghi đã được định dạng sẵn trong QueueHandler; handler nền chỉ việc ghi ra
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    backend_logger = logging.getLogger("backend")
+    backend_logger.setLevel(settings.LOG_LEVEL)
+    backend_logger.addHandler(queue_handler)
+    backend_logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger của một module (dùng `__name__`, nằm dưới namespace `backend`)."""
+    setup_logging()
+    return logging.getLogger(name)
+
+def log_payload(logger: logging.Logger, label: str, payload: str, **fields: Any):
+    """
+    Ghi một payload lớn (prompt, bài viết) theo chính sách lấy mẫu và cắt ngắn:
+    chỉ một tỷ lệ LOG_PAYLOAD_SAMPLE_RATE lệnh gọi được ghi, và payload bị cắt ở LOG_PAYLOAD_MAX_CHARS ký tự.
+    Độ dài và hash của payload luôn được ghi kèm để đối chiếu.
+    """
+    if not logger.isEnabledFor(logging.DEBUG) and random.random() >= settings.LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    max_chars = settings.LOG_PAYLOAD_MAX_CHARS
+    truncated = len(payload) > max_chars
+    logger.info(
+        label,
+        extra={"fields": {
+            **fields,
+            "payload_chars": len(payload),
+            "payload_sha256": hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16],
+            "payload_truncated": truncated,
+            "payload": payload[:max_chars] + ("…" if truncated else ""),
+        }},
+    )
@@ -0,0 +1,32 @@
+from typing import Any, Dict, List, Optional
+
+from backend.core.config import settings
+
+# Bảng định tuyến model: mỗi tác vụ LLM được gán vào một "tier" (pro / flash / lite),
+# mỗi tier có model và giới hạn tốc độ riêng. Tác vụ nhẹ dùng model nhanh, giữ quota pro cho tác vụ nặng.
+
+def all_tiers() -> List[str]:
+    """Danh sách các tier đã cấu hình."""
+    return list(settings.LLM_MODEL_TIERS.keys())
+
+def get_tier_config(tier: str) -> Dict[str, Any]:
+    """Cấu hình của một tier (model, rate_limit_seconds, rpm, tpm, rpd)."""
+    try:
+        return settings.LLM_MODEL_TIERS[tier]
+    except KeyError:
+        raise ValueError(f"Unknown LLM model tier: {tier}")
+
+def tier_for_task(task: str) -> str:
+    """Tier được gán cho tác vụ; tác vụ chưa khai báo dùng LLM_DEFAULT_TIER."""
+    return settings.LLM_TASK_TIERS.get(task, settings.LLM_DEFAULT_TIER)
+
+def model_for_tier(tier: str) -> str:
+    return get_tier_config(tier)["model"]
+
+def rate_limit_for_tier(tier: str) -> float:
+    return float(get_tier_config(tier).get("rate_limit_seconds", 6))
+
+def quota_limits_for_tier(tier: str) -> Dict[str, Optional[int]]:
+    """Giới hạn quota của mỗi key trên model của tier: rpm, tpm (token đầu vào/phút), rpd. None = không giới hạn."""
+    config = get_tier_config(tier)
+    return {dimension: config.get(dimension) for dimension in ("rpm", "tpm", "rpd")}
@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from backend.core import model_routing
+from backend.core.config import settings
+from backend.services import gcp_nlp, llm_rewriter
+from backend.services.api_key_manager import api_key_manager
+from backend.services.gcp_sa_manager import gcp_sa_manager
+from backend.core.log import get_logger
+
+logger = get_logger(__name__)
+
+def _capacity(units: int, cap: int) -> int:
+    """Số lệnh gọi đồng thời hợp lý cho `units` key/service account, không vượt quá `cap`."""
+    return max(1, min(cap, units * settings.BATCH_CALLS_PER_KEY))
+
+def _document_key(document) -> str:
+    """Các bài có cùng nội dung và tham số viết lại chỉ được xử lý một lần trong batch."""
+    raw = "\x1f".join([
+        document.content, document.main_topic or "", document.search_intent or "", document.rewrite_mode,
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class RewriteBatchPlan:
+    """
+    Kế hoạch song song dùng chung cho một batch viết lại, thay vì mỗi bài tự tranh key/service account:
+    - `nlp_slots`: số lệnh gọi Natural Language đồng thời, theo số service account hiện có.
+    - `llm_slots`: số lệnh gọi Gemini đồng thời, theo số key của tier "rewrite"; dùng chung cho phân tích ngữ cảnh,
+      viết lại toàn bài và từng phần của bài dài.
+    - `admission`: số bài được xử lý cùng lúc. Bài được nhận theo thứ tự, nên các bài đầu xong sớm và được stream về
+      ngay thay vì mọi bài cùng tiến chậm và xong cùng lúc.
+    """
+    def __init__(self, nlp_limit: Optional[int] = None, llm_limit: Optional[int] = None):
+        rewrite_tier = model_routing.tier_for_task("rewrite")
+        self.nlp_limit = nlp_limit or _capacity(gcp_sa_manager.account_count(), settings.REWRITE_BATCH_MAX_NLP_CONCURRENCY)
+        self.llm_limit = llm_limit or _capacity(api_key_manager.key_count(rewrite_tier), settings.REWRITE_BATCH_MAX_LLM_CONCURRENCY)
+        self.nlp_slots = asyncio.Semaphore(self.nlp_limit)
+        self.llm_slots = asyncio.Semaphore(self.llm_limit)
+        self.admission = asyncio.Semaphore(self.llm_limit)
+        self.duplicates = 0
+
+    async def _analyze(self, document) -> dict:
+        """GIAI ĐOẠN 1 của một bài: NLP và phân tích ngữ cảnh chạy song song, mỗi lệnh gọi chiếm một slot của batch."""
+        async def nlp_stage():
+            async with self.nlp_slots:
+                return await gcp_nlp.analyze_text_async(document.content)
+
+        async def context_stage():
+            if not document.main_topic and not document.search_intent:
+                return []
+            async with self.llm_slots:
+                return await llm_rewriter.analyze_context_with_llm(
+                    content=document.content,
+                    main_topic=document.main_topic,
+                    search_intent=document.search_intent
+                )
+
+        analysis_results, llm_analysis_notes = await asyncio.gather(nlp_stage(), context_stage())
+        return {
+            "nlp_analysis": analysis_results,
+            "cross_reference_notes": list(llm_analysis_notes),
+            "main_topic": document.main_topic
+        }
+
+    async def process(self, document) -> Dict[str, Any]:
+        """Phân tích và viết lại một bài theo kế hoạch của batch."""
+        async with self.admission:
+            enriched_data = await self._analyze(document)
+            # --- GIAI ĐOẠN 2: các phần của bài dài dùng chung llm_slots với các bài khác ---
+            rewritten_content = await llm_rewriter.rewrite_content_with_gemini(
+                enriched_data=enriched_data,
+                content=document.content,
+                rewrite_mode=document.rewrite_mode,
+                llm_slots=self.llm_slots
+            )
+        return {
+            "rewritten_content": rewritten_content,
+            "analysis_notes": enriched_data["cross_reference_notes"],
+            "patch": enriched_data.get("rewrite_patch"),
+        }
+
+    async def run(self, documents: List) -> AsyncIterator[Tuple[List[int], Optional[Dict[str, Any]], Optional[Exception]]]:
+        """
+        Xử lý các bài đồng thời và trả về (các vị trí trong request, kết quả, lỗi) ngay khi từng bài xong.
+        Bài trùng lặp dùng chung một lần xử lý. Lỗi của một bài không làm hỏng các bài khác.
+        """
+        groups: Dict[str, List[int]] = {}
+        for index, document in enumerate(documents):
+            groups.setdefault(_document_key(document), []).append(index)
+        self.duplicates = len(documents) - len(groups)
+
+        async def run_group(indices: List[int]):
+            try:
+                return indices, await self.process(documents[indices[0]]), None
+            except Exception as e:
+                logger.error(f"Batch rewrite failed for a document: {e}", extra={"fields": {"indices": indices}})
+                return indices, None, e
+
+        tasks = [asyncio.create_task(run_group(indices)) for indices in groups.values()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Client ngắt kết nối giữa chừng: hủy các bài còn lại
+            for task in tasks:
+                task.cancel()
+        logger.info("Batch rewrite finished", extra={"fields": {
+            "documents": len(documents), "duplicates": self.duplicates,
+            "llm_concurrency": self.llm_limit, "nlp_concurrency": self.nlp_limit,
+        }})
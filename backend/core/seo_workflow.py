@@ -1,8 +1,69 @@
 import asyncio
-from typing import List, Dict, TypedDict, Any
+from typing import List, Dict, TypedDict, Any, Awaitable, Callable, Optional
 
-from backend.api.endpoints.crawl import crawl_endpoint
-from backend.services import gcp_nlp, llm_seo_analyzer
+from backend.api.endpoints.crawl import crawl_endpoint, fetch_content
+from backend.core import model_routing
+from backend.core.config import settings
+from backend.services import gcp_nlp, llm_seo_analyzer, text_stats
+from backend.services.api_key_manager import api_key_manager
+from backend.core.log import get_logger, log_payload
+
+logger = get_logger(__name__)
+
+# --- 0. Bộ nhớ dùng chung cho chế độ batch ---
+def batch_concurrency() -> int:
+    """Số từ khóa chạy đồng thời trong một batch: theo số key của tier viết bài, không vượt quá SEO_BATCH_MAX_CONCURRENCY."""
+    keys = api_key_manager.key_count(model_routing.tier_for_task("article"))
+    return max(1, min(settings.SEO_BATCH_MAX_CONCURRENCY, keys * settings.BATCH_CALLS_PER_KEY))
+
+class SharedArticleCache:
+    """
+    Memo dùng chung giữa các từ khóa trong cùng một batch.
+    Mỗi URL đối thủ chỉ được tải nội dung và phân tích (GCP NLP + LLM) đúng một lần,
+    các từ khóa khác trùng URL sẽ chờ trên cùng một task.
+    Task lỗi hoặc bị hủy được bỏ khỏi memo để các từ khóa sau thử lại thay vì nhận cùng một lỗi.
+    """
+    def __init__(self):
+        self._contents: Dict[str, asyncio.Task] = {}
+        self._analyses: Dict[str, asyncio.Task] = {}
+        self.content_hits = 0
+        self.analysis_hits = 0
+
+    @staticmethod
+    def _memoize(store: Dict[str, asyncio.Task], key: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        task = store.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            store[key] = task
+
+            def forget_failed(done: asyncio.Task):
+                if (done.cancelled() or done.exception() is not None) and store.get(key) is done:
+                    del store[key]
+
+            task.add_done_callback(forget_failed)
+        return task
+
+    async def get_content(self, item: Dict) -> str:
+        """Tải nội dung bài viết của một URL (chỉ một lần cho cả batch)."""
+        link = item['link']
+        if link in self._contents:
+            self.content_hits += 1
+        task = self._memoize(
+            self._contents, link,
+            lambda: asyncio.to_thread(fetch_content, dict(item))
+        )
+        fetched = await task
+        return fetched.get('content', '')
+
+    async def get_analysis(self, link: str, content: str) -> Dict[str, Any]:
+        """Phân tích một URL đối thủ (chỉ một lần cho cả batch)."""
+        if link in self._analyses:
+            self.analysis_hits += 1
+        task = self._memoize(
+            self._analyses, link,
+            lambda: _analyze_article(link, content)
+        )
+        return await task
 
 # --- 1. Định nghĩa State của Graph ---
 class GraphState(TypedDict):
@@ -23,17 +84,86 @@ class GraphState(TypedDict):
     # --- Dữ liệu cho workflow mới ---
     seo_ideas: List[Dict]
     outlines: List[str]
+    articles: List[str]
+    categories: List[List[Dict]]
     final_suggestions: List[Dict] # Giữ tên này để tương thích output
+    # --- Chế độ batch: bộ nhớ dùng chung giữa các từ khóa (None nếu chạy đơn lẻ) ---
+    shared_cache: Optional[SharedArticleCache]
+
+# --- Lập kế hoạch các giai đoạn dựa trên output_fields ---
+# Các trường chỉ cần bộ ý tưởng (title, meta description, sapo).
+IDEA_FIELDS = {"title", "description", "h1", "sapo"}
+# Các trường cần tới dàn ý + bài viết hoàn chỉnh.
+ARTICLE_FIELDS = {"content"}
+# Các trường cần tới phân loại chuyên mục bằng GCP NLP.
+CATEGORY_FIELDS = {"categories"}
+
+def _wants(state: GraphState, fields: set) -> bool:
+    """Kiểm tra xem người dùng có yêu cầu ít nhất một trường trong `fields` hay không."""
+    requested = state.get('output_fields') or []
+    return any(field in fields for field in requested)
+
+def _valid_ideas(state: GraphState) -> List[Dict]:
+    """Các ý tưởng có title, khớp 1-1 với outlines và articles."""
+    return [idea for idea in state.get('seo_ideas', []) if idea.get('title')]
+
+def route_after_ideas(state: GraphState) -> str:
+    """
+    Router: Quyết định giai đoạn tiếp theo sau khi đã có bộ ý tưởng.
+    Bỏ qua outline/article nếu không cần 'content', bỏ qua NLP nếu không cần 'categories'.
+    """
+    if _wants(state, ARTICLE_FIELDS):
+        return "generate_outlines"
+    if _wants(state, CATEGORY_FIELDS):
+        return "classify_categories"
+    return "assemble_suggestions"
+
+def route_after_articles(state: GraphState) -> str:
+    """
+    Router: Chỉ chạy phân loại chuyên mục khi người dùng yêu cầu 'categories'.
+    """
+    if _wants(state, CATEGORY_FIELDS):
+        return "classify_categories"
+    return "assemble_suggestions"
 
 # --- 2. Định nghĩa các Node của Graph ---
 
+async def _analyze_article(link: str, content: str) -> Dict[str, Any]:
+    """
+    Phân tích một bài viết bằng GCP NLP và LLM chạy song song.
+    """
+    # gcp_nlp.analyze_text vẫn là sync, llm_seo_analyzer.analyze_competitor là async
+    gcp_task = asyncio.to_thread(gcp_nlp.analyze_text, content)
+    llm_task = llm_seo_analyzer.analyze_competitor(content)
+
+    gcp_result, llm_result = await asyncio.gather(gcp_task, llm_task)
+
+    # Thống kê cục bộ (độ dài, dễ đọc, cấu trúc heading) giúp bản brief so sánh được độ sâu của các đối thủ
+    stats = text_stats.analyze(content)
+    return {
+        "link": link,
+        "gcp_analysis": gcp_result,
+        "llm_seo_analysis": llm_result,
+        "text_stats": {
+            "readability": stats["readability"],
+            "headings": [f"H{heading['level']}: {heading['text']}" for heading in stats["headings"]["headings"]],
+        }
+    }
+
 async def fetch_top_articles(state: GraphState) -> GraphState:
     """
     Node: Lấy top 10 bài viết từ Google cho từ khóa.
     """
-    print(f"--- Node: Fetching top articles for keyword: {state['keyword']} ---")
-    # Gọi hàm crawl đã có và lấy nội dung
-    articles = await crawl_endpoint(keyword=state['keyword'], get_content=True)
+    logger.info("Node: fetching top articles", extra={"fields": {"keyword": state['keyword']}})
+    shared_cache = state.get('shared_cache')
+    if shared_cache is None:
+        # Gọi hàm crawl đã có và lấy nội dung
+        articles = await crawl_endpoint(keyword=state['keyword'], get_content=True)
+    else:
+        # Chế độ batch: chỉ crawl danh sách, nội dung được tải qua bộ nhớ dùng chung
+        articles = await crawl_endpoint(keyword=state['keyword'], get_content=False) or []
+        contents = await asyncio.gather(*(shared_cache.get_content(item) for item in articles))
+        articles = [{**item, 'content': content} for item, content in zip(articles, contents)]
     state['top_articles'] = articles
     return state
 
@@ -41,24 +171,17 @@ async def analyze_articles(state: GraphState) -> GraphState:
     """
     Node: Phân tích từng bài viết bằng GCP NLP và LLM.
     """
-    print(f"--- Node: Analyzing {len(state['top_articles'])} articles ---")
+    logger.info("Node: analyzing articles", extra={"fields": {"articles": len(state['top_articles'])}})
+    shared_cache = state.get('shared_cache')
     analysis_results = []
     for article in state['top_articles']:
         if not article.get('content'):
             continue
-        
-        # Chạy song song GCP NLP và LLM Analyzer
-        # gcp_nlp.analyze_text vẫn là sync, llm_seo_analyzer.analyze_competitor bây giờ là async
-        gcp_task = asyncio.to_thread(gcp_nlp.analyze_text, article['content'])
-        llm_task = llm_seo_analyzer.analyze_competitor(article['content'])
-        
-        gcp_result, llm_result = await asyncio.gather(gcp_task, llm_task)
-        
-        combined_analysis = {
-            "link": article['link'],
-            "gcp_analysis": gcp_result,
-            "llm_seo_analysis": llm_result
-        }
+
+        if shared_cache is None:
+            combined_analysis = await _analyze_article(article['link'], article['content'])
+        else:
+            combined_analysis = await shared_cache.get_analysis(article['link'], article['content'])
         analysis_results.append(combined_analysis)
         
     state['analysis_results'] = analysis_results
@@ -68,7 +191,7 @@ async def synthesize_analysis(state: GraphState) -> GraphState:
     """
     Node: Tổng hợp các phân tích thành một Content Brief duy nhất.
     """
-    print("--- Node: Synthesizing analysis into a content brief ---")
+    logger.info("Node: synthesizing analysis into a content brief")
     # Gọi trực tiếp hàm async mới
     brief = await llm_seo_analyzer.synthesize_insights(
         analyses=state['analysis_results'],
@@ -79,7 +202,7 @@ async def synthesize_analysis(state: GraphState) -> GraphState:
         language=state.get('language'),
         article_type=state.get('article_type')
     )
-    print(f"Synthesized Brief: {brief[:500]}...")  # In một phần của brief để kiểm tra
+    log_payload(logger, "Synthesized brief", brief, keyword=state['keyword'])
     state['content_brief'] = brief
     return state
 
@@ -88,7 +211,7 @@ async def generate_initial_ideas(state: GraphState) -> GraphState:
     Node: Tạo ra N bộ ý tưởng (title, meta description, sapo) ban đầu.
     Sử dụng hàm generate_seo_ideas đã được cập nhật với structured output.
     """
-    print(f"--- Node: Generating {state['num_suggestions']} initial ideas ---")
+    logger.info("Node: generating initial ideas", extra={"fields": {"num_suggestions": state['num_suggestions']}})
     # Gọi trực tiếp hàm async mới
     ideas = await llm_seo_analyzer.generate_seo_ideas(
         state['content_brief'],
@@ -102,7 +225,7 @@ async def generate_outlines(state: GraphState) -> GraphState:
     """
     Node: Tạo dàn ý chi tiết cho từng ý tưởng.
     """
-    print(f"--- Node: Generating outlines for {len(state['seo_ideas'])} ideas ---")
+    logger.info("Node: generating outlines", extra={"fields": {"ideas": len(state['seo_ideas'])}})
     tasks = []
     for idea in state['seo_ideas']:
         # --- BẢO VỆ CHỐNG LỖI KEYERROR ---
@@ -112,7 +235,7 @@ async def generate_outlines(state: GraphState) -> GraphState:
 
         # Bỏ qua việc tạo outline nếu không có title
         if not title:
-            print(f"--- Warning: Skipping outline generation for an idea with no title. ---")
+            logger.warning("Skipping outline generation for an idea with no title.")
             continue
 
         # Gọi trực tiếp hàm async
@@ -135,13 +258,12 @@ async def generate_outlines(state: GraphState) -> GraphState:
 
 async def generate_full_articles(state: GraphState) -> GraphState:
     """
-    Node: Viết bài viết hoàn chỉnh và phân tích chuyên mục.
+    Node: Viết bài viết hoàn chỉnh cho từng dàn ý.
     """
-    print(f"--- Node: Generating {len(state['outlines'])} full articles ---")
-    
-    # --- 1. Generate article content ---
+    logger.info("Node: generating full articles", extra={"fields": {"outlines": len(state['outlines'])}})
+
     generation_tasks = []
-    valid_ideas_for_articles = [idea for idea in state['seo_ideas'] if idea.get('title')]
+    valid_ideas_for_articles = _valid_ideas(state)
 
     for i, outline in enumerate(state['outlines']):
         # Đảm bảo chúng ta không bị lỗi index nếu số lượng outline và idea hợp lệ không khớp
@@ -159,45 +281,78 @@ async def generate_full_articles(state: GraphState) -> GraphState:
             )
 
     if not generation_tasks:
-        print("--- Warning: No valid outlines to generate articles from. ---")
-        state['final_suggestions'] = []
+        logger.warning("No valid outlines to generate articles from.")
+        state['articles'] = []
         return state
 
-    articles_content = await asyncio.gather(*generation_tasks)
-    
-    # --- 2. Analyze categories for each article ---
+    state['articles'] = list(await asyncio.gather(*generation_tasks))
+    return state
+
+async def classify_categories(state: GraphState) -> GraphState:
+    """
+    Node: Phân tích chuyên mục bằng GCP NLP.
+    Dùng nội dung bài viết nếu đã được tạo, nếu không thì dùng title + description + sapo của ý tưởng.
+    """
+    articles = state.get('articles') or []
+    if articles:
+        texts = articles
+    else:
+        texts = [
+            "\n\n".join(filter(None, [idea.get('title'), idea.get('meta_description'), idea.get('sapo')]))
+            for idea in _valid_ideas(state)
+        ]
+    logger.info("Node: classifying categories", extra={"fields": {"suggestions": len(texts)}})
+
+    # Chỉ cần chuyên mục: gọi classify_text thay vì annotate_text đầy đủ.
     analysis_tasks = [
-        asyncio.to_thread(gcp_nlp.analyze_text, content)
-        for content in articles_content
+        asyncio.to_thread(gcp_nlp.analyze_text, text, features={gcp_nlp.CATEGORIES})
+        for text in texts
     ]
     analysis_results = await asyncio.gather(*analysis_tasks)
 
-    # --- 3. Assemble final results ---
-    final_suggestions = []
-    for i, article_content in enumerate(articles_content):
-        idea = state['seo_ideas'][i]
-        nlp_result = analysis_results[i]
-        
+    categories = []
+    for nlp_result in analysis_results:
         # Sort categories by confidence and get top 10
         sorted_categories = sorted(
             nlp_result.get('categories', []),
             key=lambda x: x.get('confidence', 0),
             reverse=True
         )
-        top_10_categories = [
+        categories.append([
             {"name": cat['name'], "score": cat['confidence']}
             for cat in sorted_categories[:10]
-        ]
+        ])
 
-        final_suggestions.append({
+    state['categories'] = categories
+    return state
+
+async def assemble_suggestions(state: GraphState) -> GraphState:
+    """
+    Node: Ghép kết quả cuối cùng, chỉ giữ lại các trường có trong output_fields.
+    """
+    requested = set(state.get('output_fields') or [])
+    articles = state.get('articles') or []
+    categories = state.get('categories') or []
+    valid_ideas = _valid_ideas(state)
+
+    # Nếu đã yêu cầu content thì chỉ trả về các ý tưởng đã có bài viết.
+    if _wants(state, ARTICLE_FIELDS):
+        valid_ideas = valid_ideas[:len(articles)]
+
+    final_suggestions = []
+    for i, idea in enumerate(valid_ideas):
+        suggestion = {
             "title": idea.get("title"),
             "description": idea.get("meta_description"),
             "h1": idea.get("title"),
             "sapo": idea.get("sapo"),
-            "content": article_content,
-            "categories": top_10_categories
+            "content": articles[i] if i < len(articles) else None,
+            "categories": categories[i] if i < len(categories) else None,
+        }
+        final_suggestions.append({
+            field: value for field, value in suggestion.items() if field in requested
         })
-        
+
     state['final_suggestions'] = final_suggestions
     return state
 
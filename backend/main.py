@@ -1,11 +1,20 @@
 import asyncio
-from fastapi import FastAPI, HTTPException
+import math
+import uuid
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
 from starlette.middleware.sessions import SessionMiddleware
 from backend.api.api import api_router
 from backend.database import engine
 from backend.models import usage_log, client_app, admin_login_history
 from backend.core.config import settings
+from backend.core.log import request_id_var, setup_logging
 from backend.socket_manager import socket_app, trigger_crawl_and_wait
+from backend.services.key_quota import key_quota
+from backend.services.key_scheduler import KeyQuotaExhaustedError
+from backend.services.llm_metrics import llm_metrics
+
+setup_logging()
 
 # Create the database tables
 usage_log.Base.metadata.create_all(bind=engine)
@@ -24,11 +33,39 @@ app.add_middleware(
     secret_key=settings.SECRET_KEY
 )
 
+# Gắn correlation id cho mọi request: lấy từ header X-Request-ID (nếu client gửi) hoặc tạo mới,
+# đưa vào mọi dòng log trong quá trình xử lý và trả lại trong header của response.
+@app.middleware("http")
+async def request_correlation_id(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+# Mọi key đều hết quota lâu hơn KEY_MAX_WAIT_SECONDS: trả 429 để client thử lại sau thay vì treo request
+@app.exception_handler(KeyQuotaExhaustedError)
+async def key_quota_exhausted_handler(request: Request, exc: KeyQuotaExhaustedError):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
 # --- API Routes ---
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the SEO Content Refactoring API"}
 
+@app.on_event("shutdown")
+def flush_llm_metrics():
+    # Ghi nốt các rollup số liệu LLM và trạng thái quota của key chưa được flush
+    llm_metrics.flush()
+    key_quota.flush()
+
 
 app.include_router(api_router, prefix="/api")
 app.mount("/socket.io", socket_app)
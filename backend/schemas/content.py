@@ -1,10 +1,31 @@
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 
 class ContentAnalysisRequest(BaseModel):
     content: str
     main_topic: Optional[str] = None
     search_intent: Optional[str] = None
+    # "auto": bài dài được viết lại song song theo từng phần, "full": một prompt cho cả bài, "sections": luôn chia phần,
+    # "targeted": chỉ viết lại các đoạn được phân tích đánh dấu và trả về kèm patch
+    rewrite_mode: Literal["auto", "full", "sections", "targeted"] = "auto"
+
+class ParagraphPatch(BaseModel):
+    paragraph: int  # Chỉ số đoạn văn trong bài gốc
+    start: int  # Vị trí [start, end) của đoạn trong bài gốc
+    end: int
+    original: str
+    replacement: str
+    reasons: List[str]
+
+class BatchRewriteRequest(BaseModel):
+    documents: List[ContentAnalysisRequest]
+
+class BatchRewriteItemResult(BaseModel):
+    index: int  # Vị trí của bài trong request
+    rewritten_content: Optional[str] = None
+    analysis_notes: List[str] = []
+    patch: Optional[List[ParagraphPatch]] = None
+    error: Optional[str] = None
 
 class EnrichedAnalysis(BaseModel):
     nlp_analysis: Dict[str, Any]
@@ -19,6 +40,7 @@ class RewriteResponse(BaseModel):
     original_content: str
     rewritten_content: str
     analysis_notes: List[str]
+    patch: Optional[List[ParagraphPatch]] = None  # Chỉ có với rewrite_mode="targeted"
 
 # --- Schemas for SEO Suggestion Feature ---
 
@@ -32,7 +54,7 @@ class SeoSuggestionRequest(BaseModel):
     custom_notes: Optional[str] = None
     language: Optional[str] = "Vietnamese"
     num_suggestions: int = 3
-    output_fields: List[str] = ["title", "description", "h1", "sapo", "content"]
+    output_fields: List[str] = ["title", "description", "h1", "sapo", "content", "categories"]
 
 class CategoryScore(BaseModel):
     name: str
@@ -49,6 +71,23 @@ class SeoSuggestion(BaseModel):
 class SeoSuggestionResponse(BaseModel):
     suggestions: List[SeoSuggestion]
 
+class SeoBatchSuggestionRequest(BaseModel):
+    keywords: List[str]
+    article_type: Optional[str] = None
+    marketing_goal: Optional[str] = None
+    target_audience: Optional[str] = None
+    brand_voice: Optional[str] = None
+    custom_notes: Optional[str] = None
+    language: Optional[str] = "Vietnamese"
+    num_suggestions: int = 3
+    output_fields: List[str] = ["title", "description", "h1", "sapo", "content", "categories"]
+
+class SeoBatchItemResult(BaseModel):
+    keyword: str
+    content_brief: Optional[str] = None
+    suggestions: List[SeoSuggestion] = []
+    error: Optional[str] = None
+
 # --- Schemas for Bio Generation Feature ---
 
 class BioGenerationRequest(BaseModel):
@@ -73,3 +112,23 @@ class BioGenerationResponse(BaseModel):
     hotline: str
     hashtag: str
     bioEntities: List[str]
+
+class BioBulkRequest(BaseModel):
+    rows: List[BioGenerationRequest]
+
+class BioBulkItemResult(BaseModel):
+    index: int  # Vị trí của dòng trong request
+    result: Optional[BioGenerationResponse] = None
+    error: Optional[str] = None
+
+class BioJobCreated(BaseModel):
+    job_id: str
+    total: int
+
+class BioJobStatus(BaseModel):
+    job_id: str
+    status: str  # "running" | "completed" | "failed" | "cancelled"
+    total: int
+    completed: int
+    # Kết quả theo thứ tự hoàn thành, bắt đầu từ vị trí `offset` của request poll
+    results: List[BioBulkItemResult]
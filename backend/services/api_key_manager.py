@@ -1,135 +1,252 @@
 import json
 import threading
 import os
-import time
-import asyncio
-from collections import deque
+from backend.core import model_routing
+from backend.core.config import settings
+from backend.services.gemini_client_pool import gemini_client_pool
+from backend.services.key_quota import QuotaGate, key_quota
+from backend.services.key_scheduler import KeyQuotaExhaustedError, KeyScheduler
+from backend.services.key_store import ApiKeyStore
+from backend.core.log import get_logger
+
+logger = get_logger(__name__)
 
 # --- Rate-Limited API Key Manager (NEW) ---
 class RateLimitedApiKeyManager:
-    def __init__(self, keys_file_path=os.path.join("backend", "api_keys.json"), rate_limit_seconds=6):
+    def __init__(self, keys_db_path=None, legacy_keys_file_path=os.path.join("backend", "api_keys.json"), rate_limit_seconds=None):
         """
         Khởi tạo manager với cơ chế điều tiết.
-        :param keys_file_path: Đường dẫn đến file JSON chứa API keys.
-        :param rate_limit_seconds: Thời gian tối thiểu (giây) giữa các lần sử dụng của cùng một key.
-                                  (Mặc định là 6 giây cho 10 requests/phút).
+        :param keys_db_path: Đường dẫn tới SQLite chứa API keys (mặc định API_KEYS_DB_PATH).
+        :param legacy_keys_file_path: File JSON cũ, được nhập vào SQLite ở lần khởi tạo đầu tiên.
+        :param rate_limit_seconds: Ghi đè thời gian tối thiểu (giây) giữa các lần sử dụng của cùng một key
+                                  cho mọi tier. Mặc định lấy theo `rate_limit_seconds` của từng tier
+                                  trong LLM_MODEL_TIERS (quota của Gemini tính riêng theo từng model).
         """
-        self.keys_file_path = keys_file_path
-        self.rate_limit_seconds = rate_limit_seconds
-        self.lock = asyncio.Lock()  # Sử dụng asyncio.Lock cho môi trường bất đồng bộ
+        self.store = ApiKeyStore(keys_db_path or settings.API_KEYS_DB_PATH, legacy_keys_file_path)
+        self.rate_limit_override = rate_limit_seconds
+        # Chỉ bảo vệ các thao tác ngắn (không có await bên trong), dùng được cả từ event loop lẫn threadpool
+        self.lock = threading.Lock()
 
-        # Hàng đợi (deque) để lưu trữ (key, last_used_time)
-        # Sử dụng deque vì nó hiệu quả cho việc thêm/xóa ở cả hai đầu
-        self._keys_queue = deque()
+        # Mỗi tier có một bộ lập lịch riêng (min-heap theo thời điểm key sẵn sàng, xem key_scheduler.py);
+        # quota RPM/TPM/RPD của từng key được theo dõi và lưu lại qua các lần khởi động bởi key_quota
+        self._schedulers = {tier: KeyScheduler(self._rate_limit(tier)) for tier in model_routing.all_tiers()}
+        # Số lần liên tiếp mỗi (tier, key) bị lỗi quota (429), dùng để tính thời gian cooldown/quarantine
+        self._consecutive_quota_errors = {}
+        # Số lần liên tiếp mỗi key bị từ chối 403, dùng để quyết định đánh dấu key invalid
+        self._consecutive_forbidden = {}
         self._load_keys() # Tải và khởi tạo hàng đợi
 
+    def _rate_limit(self, tier):
+        if self.rate_limit_override is not None:
+            return self.rate_limit_override
+        return model_routing.rate_limit_for_tier(tier)
+
+    @staticmethod
+    def _key_serves_tier(key_info, tier):
+        """Key có thể giới hạn các tier được phép dùng qua trường 'tiers'; mặc định phục vụ mọi tier."""
+        tiers = key_info.get("tiers")
+        return not tiers or tier in tiers
+
     def _load_keys(self):
         """
-        Tải các key từ file JSON và khởi tạo hàng đợi.
-        Mỗi key được lưu dưới dạng một tuple (key_string, last_used_time).
-        Ban đầu, last_used_time là 0 để key có thể được sử dụng ngay lập tức.
+        Tải các key từ SQLite và đồng bộ bộ lập lịch của từng tier.
+        Key mới sẵn sàng ngay (trong giới hạn quota đã ghi nhận); key đã có giữ nguyên slot và cooldown.
         """
         try:
-            if not os.path.exists(self.keys_file_path):
-                with open(self.keys_file_path, "w") as f:
-                    json.dump({"keys": []}, f)
-                self.keys_config = []
-                self._keys_queue.clear()
-                return
+            keys_config = self.store.all()
+        except Exception as e:
+            logger.error(f"Error loading API keys: {e}.")
+            keys_config = []
 
-            with open(self.keys_file_path, "r") as f:
-                data = json.load(f)
-                self.keys_config = data.get("keys", [])
+        # Chỉ tải các key hợp lệ vào bộ lập lịch của các tier mà key được phép phục vụ
+        valid_keys = [k_info for k_info in keys_config if k_info.get("status") == "valid"]
+        for tier, scheduler in self._schedulers.items():
+            scheduler.sync(k_info["key"] for k_info in valid_keys if self._key_serves_tier(k_info, tier))
+        logger.info("Loaded valid API keys into the rate-limited manager.", extra={"fields": {"valid_keys": len(valid_keys)}})
 
-            # Chuyển đổi cấu trúc dữ liệu cũ nếu cần
-            if self.keys_config and isinstance(self.keys_config[0], str):
-                print("Old key format detected. Converting to new format.")
-                self.keys_config = [{"key": key, "status": "unchecked"} for key in self.keys_config]
-                self._save_keys()
+    def _schedule(self, key_info):
+        """Cập nhật bộ lập lịch cho một key vừa thêm/đổi trạng thái, không ảnh hưởng các key khác."""
+        for tier, scheduler in self._schedulers.items():
+            if key_info.get("status") == "valid" and self._key_serves_tier(key_info, tier):
+                scheduler.add(key_info["key"])
+            else:
+                scheduler.remove(key_info["key"])
 
-            # Chỉ tải các key hợp lệ vào hàng đợi
-            valid_keys = [k_info["key"] for k_info in self.keys_config if k_info.get("status") == "valid"]
-            self._keys_queue = deque((key, 0) for key in valid_keys)
-            print(f"Loaded {len(self._keys_queue)} valid API keys into the rate-limited manager.")
+    def _unschedule(self, key):
+        for scheduler in self._schedulers.values():
+            scheduler.remove(key)
+        for error_key in [k for k in self._consecutive_quota_errors if k[1] == key]:
+            del self._consecutive_quota_errors[error_key]
+        self._consecutive_forbidden.pop(key, None)
 
-        except Exception as e:
-            print(f"Error loading API keys: {e}.")
-            self.keys_config = []
-            self._keys_queue.clear()
-
-    async def get_next_key_async(self):
-        """
-        Lấy key hợp lệ tiếp theo một cách bất đồng bộ với cơ chế điều tiết.
-        """
-        async with self.lock:
-            if not self._keys_queue:
-                print("Error: No valid API keys available in the queue.")
-                # Có thể raise Exception ở đây để xử lý ở nơi gọi
-                raise ValueError("No valid API keys available.")
-
-            while True:
-                # Lấy key ở đầu hàng đợi (key đã nghỉ lâu nhất)
-                key, last_used_time = self._keys_queue[0]
-                current_time = time.monotonic()
-                elapsed_time = current_time - last_used_time
-
-                if elapsed_time >= self.rate_limit_seconds:
-                    # Key này đã "nguội", sẵn sàng để sử dụng
-                    # Xoay vòng: lấy key ra khỏi đầu và đưa xuống cuối
-                    self._keys_queue.popleft()
-                    self._keys_queue.append((key, current_time)) # Cập nhật thời gian sử dụng
-                    return key
-
-                # Nếu key vẫn còn "nóng", tính thời gian phải chờ
-                wait_time = self.rate_limit_seconds - elapsed_time
-                # print(f"Rate limit hit. Waiting for {wait_time:.2f} seconds...")
-                await asyncio.sleep(wait_time)
-                # Vòng lặp sẽ thử lại với chính key này, lúc này chắc chắn đã hợp lệ
+    def _get_scheduler(self, tier):
+        try:
+            return self._schedulers[tier]
+        except KeyError:
+            raise ValueError(f"Unknown LLM model tier: {tier}")
+
+    async def acquire_key(self, tier=None, preferred_keys=None, tokens=0):
+        """
+        Lấy key hợp lệ tiếp theo của một tier một cách bất đồng bộ với cơ chế điều tiết.
+        Key sẵn sàng sớm nhất mà còn đủ quota (RPM, TPM cho `tokens` token đầu vào, RPD) được chọn;
+        nếu chưa có key nào, lệnh gọi giữ chỗ slot sớm nhất và chờ mà không chặn các lệnh gọi khác.
+        Raise KeyQuotaExhaustedError nếu slot sớm nhất xa hơn KEY_MAX_WAIT_SECONDS.
+        `preferred_keys`: các key nên được ưu tiên nếu đang sẵn sàng (ví dụ key đã giữ context cache của prompt).
+        Trả về (key, lượt dùng quota); lượt dùng được truyền lại cho report_success/report_quota_error.
+        """
+        tier = tier or settings.LLM_DEFAULT_TIER
+        scheduler = self._get_scheduler(tier)
+        gate = QuotaGate(key_quota, tier, tokens)
+        try:
+            key = await scheduler.acquire(preferred_keys, gate, settings.KEY_MAX_WAIT_SECONDS)
+        except KeyQuotaExhaustedError as e:
+            logger.warning("All API keys are rate limited.", extra={"fields": {"tier": tier, "retry_after": round(e.retry_after, 1)}})
+            raise
+        except ValueError:
+            logger.error("No valid API keys available.", extra={"fields": {"tier": tier}})
+            raise
+        return key, gate.usage
+
+    async def get_next_key_async(self, tier=None, preferred_keys=None):
+        """Như acquire_key nhưng chỉ trả về key (cho các lệnh gọi không báo lại số token)."""
+        key, _ = await self.acquire_key(tier, preferred_keys)
+        return key
+
+    def key_count(self, tier=None):
+        """Số key hợp lệ đang phục vụ tier (dùng để lập kế hoạch song song cho các batch)."""
+        return len(self._get_scheduler(tier or settings.LLM_DEFAULT_TIER))
+
+    def _defer_key(self, key, tier, delay_seconds):
+        """Chỉ cho phép dùng lại key trong tier sau `delay_seconds` giây."""
+        self._get_scheduler(tier).defer(key, delay_seconds)
+
+    def report_success(self, key, tier=None, usage=None, input_tokens=0):
+        """
+        Phản hồi từ nơi gọi: key vừa phục vụ thành công, xóa bộ đếm lỗi quota.
+        `input_tokens`: số token đầu vào thực tế, thay cho ước tính trong lượt dùng quota `usage`.
+        """
+        tier = tier or settings.LLM_DEFAULT_TIER
+        self._consecutive_quota_errors.pop((tier, key), None)
+        self._consecutive_forbidden.pop(key, None)
+        key_quota.settle(tier, key, usage, input_tokens)
+
+    async def report_quota_error(self, key, tier=None, error=None, usage=None):
+        """
+        Phản hồi từ nơi gọi: key vừa bị lỗi quota (429) trên model của `tier`.
+        Request bị từ chối không tính vào quota; giới hạn và thời gian chờ báo trong lỗi được ghi nhận.
+        Key được cooldown (chỉ trong tier đó) theo thời gian chờ trong lỗi, nếu không có thì tăng dần theo số lần
+        lỗi liên tiếp, và bị cách ly (quarantine) lâu hơn khi vượt ngưỡng KEY_QUARANTINE_AFTER.
+        """
+        tier = tier or settings.LLM_DEFAULT_TIER
+        key_quota.release(tier, key, usage)
+        retry_after = key_quota.learn(tier, key, error) if error is not None else None
+        with self.lock:
+            errors = self._consecutive_quota_errors.get((tier, key), 0) + 1
+            self._consecutive_quota_errors[(tier, key)] = errors
+            if errors >= settings.KEY_QUARANTINE_AFTER:
+                cooldown = settings.KEY_QUARANTINE_SECONDS
+                logger.warning("Quarantining API key after consecutive quota errors.", extra={"fields": {"key_id": f"...{key[-4:]}", "tier": tier, "cooldown_seconds": round(cooldown), "errors": errors}})
+            elif retry_after is not None:
+                cooldown = retry_after
+                logger.info("Cooling down API key for the delay reported by the quota error.", extra={"fields": {"key_id": f"...{key[-4:]}", "tier": tier, "cooldown_seconds": round(cooldown)}})
+            else:
+                cooldown = min(settings.KEY_COOLDOWN_SECONDS * 2 ** (errors - 1), settings.KEY_MAX_COOLDOWN_SECONDS)
+                logger.info("Cooling down API key after a quota error.", extra={"fields": {"key_id": f"...{key[-4:]}", "tier": tier, "cooldown_seconds": round(cooldown)}})
+            self._defer_key(key, tier, cooldown)
+
+    async def report_forbidden(self, key, tier=None, usage=None):
+        """
+        Phản hồi từ nơi gọi: key bị từ chối 403 trên model của `tier`.
+        403 thường do cấu hình (model chưa bật, vùng bị chặn, API bị tắt cho project) chứ không phải key sai,
+        nên key chỉ bị cách ly trong tier; sau KEY_INVALID_AFTER_FORBIDDEN lần liên tiếp key mới bị đánh dấu invalid.
+        """
+        tier = tier or settings.LLM_DEFAULT_TIER
+        key_quota.release(tier, key, usage)
+        with self.lock:
+            errors = self._consecutive_forbidden.get(key, 0) + 1
+            self._consecutive_forbidden[key] = errors
+            if errors < settings.KEY_INVALID_AFTER_FORBIDDEN:
+                logger.warning("Quarantining API key after a permission error.", extra={"fields": {"key_id": f"...{key[-4:]}", "tier": tier, "cooldown_seconds": round(settings.KEY_QUARANTINE_SECONDS), "errors": errors}})
+                self._defer_key(key, tier, settings.KEY_QUARANTINE_SECONDS)
+                return
+        await self.report_invalid_key(key)
+
+    async def report_invalid_key(self, key):
+        """
+        Phản hồi từ nơi gọi: key bị từ chối xác thực (401) hoặc bị 403 liên tiếp nhiều lần.
+        Key bị loại khỏi bộ lập lịch của mọi tier và được đánh dấu 'invalid' trong kho key.
+        """
+        with self.lock:
+            self._unschedule(key)
+            self.store.update_status_many([key], "invalid")
+        gemini_client_pool.evict(key)
+        logger.warning("API key was rejected and has been marked invalid.", extra={"fields": {"key_id": f"...{key[-4:]}"}})
+
+    async def get_model_async(self, tier=None):
+        """
+        Lấy key tiếp theo (có điều tiết) của tier và trả về GenerativeModel của tier đó đã gắn client của key.
+        Thay thế cho cặp `genai.configure(api_key=...)` + `genai.GenerativeModel(...)`.
+        """
+        tier = tier or settings.LLM_DEFAULT_TIER
+        api_key = await self.get_next_key_async(tier)
+        return gemini_client_pool.get_model(api_key, model_routing.model_for_tier(tier))
+
+    async def get_chat_model_async(self, tier=None):
+        """Tương tự get_model_async nhưng trả về model LangChain ChatGoogleGenerativeAI."""
+        tier = tier or settings.LLM_DEFAULT_TIER
+        api_key = await self.get_next_key_async(tier)
+        return gemini_client_pool.get_chat_model(api_key, model_routing.model_for_tier(tier))
 
     def get_all_keys(self):
-        """Lấy tất cả các đối tượng key hiện tại từ file config."""
-        return self.keys_config
+        """Lấy tất cả các key (key, status[, tiers]) từ kho key."""
+        return self.store.all()
+
+    def add_keys(self, new_keys, status="unchecked"):
+        """Thêm nhiều key trong một transaction; chỉ các key mới được đưa vào bộ lập lịch. Trả về số key đã thêm."""
+        with self.lock:
+            added = self.store.insert_many(new_keys, status)
+            for key in added:
+                self._schedule({"key": key, "status": status})
+        if added:
+            logger.info("Added API keys.", extra={"fields": {"added": len(added), "status": status}})
+        return len(added)
 
     def add_key(self, new_key, status="unchecked"):
-        """Thêm một key mới và lưu vào file, sau đó reload lại hàng đợi."""
-        # Sử dụng threading.Lock ở đây vì các thao tác file là đồng bộ
-        with threading.Lock():
-            if any(k.get("key") == new_key for k in self.keys_config):
-                return False
-            self.keys_config.append({"key": new_key, "status": status})
-            self._save_keys()
-            self._load_keys() # Tải lại để cập nhật hàng đợi
-            return True
+        """Thêm một key mới; trả về False nếu key đã tồn tại."""
+        return self.add_keys([new_key], status) == 1
+
+    def delete_keys(self, keys_to_delete):
+        """Xóa nhiều key trong một transaction và gỡ chúng khỏi bộ lập lịch. Trả về số key đã xóa."""
+        with self.lock:
+            deleted = self.store.delete_many(keys_to_delete)
+            for key in deleted:
+                self._unschedule(key)
+        for key in deleted:
+            gemini_client_pool.evict(key)
+        return len(deleted)
 
     def delete_key(self, key_to_delete):
-        """Xóa một key, lưu file và reload lại hàng đợi."""
-        with threading.Lock():
-            original_length = len(self.keys_config)
-            self.keys_config = [k for k in self.keys_config if k.get("key") != key_to_delete]
-            if len(self.keys_config) < original_length:
-                self._save_keys()
-                self._load_keys() # Tải lại
-                return True
-        return False
+        """Xóa một key; trả về False nếu key không tồn tại."""
+        return self.delete_keys([key_to_delete]) == 1
 
-    def update_key_status(self, key_to_update, new_status):
-        """Cập nhật trạng thái của một key và reload lại hàng đợi."""
-        with threading.Lock():
-            key_found = False
-            for key_info in self.keys_config:
-                if key_info.get("key") == key_to_update:
-                    key_info["status"] = new_status
-                    key_found = True
-                    break
-            if key_found:
-                self._save_keys()
-                self._load_keys() # Tải lại
-            return key_found
+    def update_keys_status(self, keys_to_update, new_status):
+        """
+        Cập nhật trạng thái nhiều key trong một transaction.
+        Key còn hợp lệ giữ nguyên trạng thái điều tiết trong bộ lập lịch. Trả về số key đã cập nhật.
+        """
+        with self.lock:
+            updated = self.store.update_status_many(keys_to_update, new_status)
+            key_infos = self.store.get_many(updated)
+            for key_info in key_infos.values():
+                self._schedule(key_info)
+        if new_status != "valid":
+            for key in updated:
+                gemini_client_pool.evict(key)
+        return len(updated)
 
-    def _save_keys(self):
-        """Lưu danh sách key hiện tại vào file JSON."""
-        with open(self.keys_file_path, "w") as f:
-            json.dump({"keys": self.keys_config}, f, indent=2)
+    def update_key_status(self, key_to_update, new_status):
+        """Cập nhật trạng thái của một key; trả về False nếu key không tồn tại."""
+        return self.update_keys_status([key_to_update], new_status) == 1
 
 
 # --- API Key Manager (OLD - for reference, will be replaced) ---
@@ -157,7 +274,7 @@ class ApiKeyManager:
 
             # Kiểm tra và chuyển đổi cấu trúc dữ liệu nếu cần
             if keys_data and isinstance(keys_data[0], str):
-                print("Old key format detected. Converting to new format.")
+                logger.info("Old key format detected. Converting to new format.")
                 new_keys_data = [{"key": key, "status": "unchecked"} for key in keys_data]
                 self.keys = new_keys_data
                 self._save_keys() # Lưu lại ngay sau khi chuyển đổi
@@ -165,7 +282,7 @@ class ApiKeyManager:
             
             return keys_data
         except Exception as e:
-            print(f"Error loading API keys: {e}.")
+            logger.error(f"Error loading API keys: {e}.")
             return []
 
     def get_next_key(self):
@@ -176,7 +293,7 @@ class ApiKeyManager:
         with self.lock:
             valid_keys = [k for k in self.keys if k.get("status") == "valid"]
             if not valid_keys:
-                print("Error: No valid API keys available.")
+                logger.error("No valid API keys available.")
                 return None
             
             # Logic xoay vòng chỉ trên các key hợp lệ
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from typing import Any, Dict, Optional, Set, Tuple
+
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+
+from backend.core.config import settings
+from backend.core.log import get_logger
+from backend.services.gemini_client_pool import gemini_client_pool
+from backend.services.llm_metrics import record_response_usage
+
+logger = get_logger(__name__)
+
+# --- Prompt có tiền tố dùng chung ---
+class SharedPrefixPrompt:
+    """
+    Prompt gồm hai phần: `prefix` dùng chung giữa nhiều lệnh gọi (ví dụ: content brief)
+    và `suffix` riêng cho từng lệnh gọi (title, outline, yêu cầu cụ thể).
+    Khi provider hỗ trợ context caching, prefix chỉ được upload/xử lý một lần.
+    """
+    def __init__(self, prefix: str, suffix: str):
+        self.prefix = prefix
+        self.suffix = suffix
+
+    @property
+    def text(self) -> str:
+        """Prompt đầy đủ, dùng khi không có context cache."""
+        return f"{self.prefix}\n\n{self.suffix}"
+
+    @property
+    def prefix_hash(self) -> str:
+        return hashlib.sha256(self.prefix.encode("utf-8")).hexdigest()
+
+# --- Backend context caching ---
+class ContextCacheBackend(ABC):
+    """
+    Giao diện chung của backend context caching.
+    Handle của cache gắn với (api_key, model, prefix) vì cache của Gemini thuộc về project của key tạo ra nó.
+    """
+    # Phản hồi sinh qua backend này có được dùng/lưu trong cache phản hồi LLM (llm_cache.db) hay không
+    cacheable_responses = True
+
+    def __init__(self, ttl_seconds: int, min_prefix_chars: int):
+        self.ttl_seconds = ttl_seconds
+        self.min_prefix_chars = min_prefix_chars
+        # (api_key, model_name, prefix_hash) -> (handle hoặc None nếu tạo thất bại, expires_at)
+        self._handles: Dict[Tuple[str, str, str], Tuple[Optional[str], float]] = {}
+        self._pending: Dict[Tuple[str, str, str], asyncio.Task] = {}
+        self.stats = {"created": 0, "reused": 0, "create_failed": 0, "cached_chars": 0}
+
+    def supports(self, prompt: SharedPrefixPrompt) -> bool:
+        """Prefix quá ngắn thì không đáng (hoặc không được phép) tạo cache."""
+        return len(prompt.prefix) >= self.min_prefix_chars
+
+    def keys_with_prefix(self, model_name: str, prompt: SharedPrefixPrompt) -> Set[str]:
+        """Các key đã có cache còn hạn cho prefix này; key manager sẽ ưu tiên các key này."""
+        now = time.monotonic()
+        self._evict_expired(now)
+        return {
+            api_key for (api_key, model, prefix_hash), (handle, _) in self._handles.items()
+            if model == model_name and prefix_hash == prompt.prefix_hash and handle
+        }
+
+    def _evict_expired(self, now: float):
+        for registry_key in [key for key, (_, expires_at) in self._handles.items() if expires_at <= now]:
+            del self._handles[registry_key]
+
+    async def get_or_create(self, api_key: str, model_name: str, prompt: SharedPrefixPrompt) -> Optional[str]:
+        """
+        Trả về handle cache cho prefix (tạo mới nếu chưa có). Các lệnh gọi đồng thời cùng prefix chờ chung một lần tạo.
+        Trả về None nếu backend không tạo được cache; khi đó nơi gọi dùng prompt đầy đủ.
+        """
+        registry_key = (api_key, model_name, prompt.prefix_hash)
+        entry = self._handles.get(registry_key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                if entry[0] is not None:
+                    self.stats["reused"] += 1
+                    self.stats["cached_chars"] += len(prompt.prefix)
+                return entry[0]
+            # Handle đã hết hạn: bỏ khỏi registry rồi tạo lại
+            del self._handles[registry_key]
+
+        task = self._pending.get(registry_key)
+        if task is None:
+            task = asyncio.ensure_future(self._create_entry(registry_key, api_key, model_name, prompt))
+            self._pending[registry_key] = task
+            task.add_done_callback(lambda _: self._pending.pop(registry_key, None))
+        return await task
+
+    async def _create_entry(self, registry_key, api_key: str, model_name: str, prompt: SharedPrefixPrompt) -> Optional[str]:
+        try:
+            handle = await self._create(api_key, model_name, prompt.prefix)
+            self.stats["created"] += 1
+            # Hết hạn sớm hơn provider một chút để tránh dùng handle vừa bị xóa
+            self._handles[registry_key] = (handle, time.monotonic() + self.ttl_seconds * 0.9)
+            return handle
+        except Exception as e:
+            logger.warning(f"Could not create context cache, using full prompts: {e}", extra={"fields": {"model": model_name}})
+            self.stats["create_failed"] += 1
+            # Ghi nhớ thất bại để không thử tạo lại ở mỗi lệnh gọi
+            self._handles[registry_key] = (None, time.monotonic() + self.ttl_seconds)
+            return None
+
+    def invalidate(self, api_key: str, model_name: str, prompt: SharedPrefixPrompt):
+        self._handles.pop((api_key, model_name, prompt.prefix_hash), None)
+
+    @abstractmethod
+    async def _create(self, api_key: str, model_name: str, prefix: str) -> str:
+        """Tạo cache cho prefix trên provider và trả về handle."""
+
+    @abstractmethod
+    async def generate(
+        self, api_key: str, model_name: str, handle: str, suffix: str,
+        generation_config: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Sinh phản hồi cho `suffix` dựa trên prefix đã cache của `handle`."""
+
+class GeminiContextCacheBackend(ContextCacheBackend):
+    """Context caching thật của Gemini API (CachedContent)."""
+
+    async def _create(self, api_key: str, model_name: str, prefix: str) -> str:
+        client = gemini_client_pool.get_cache_client(api_key)
+        request = glm.CreateCachedContentRequest(
+            cached_content=glm.CachedContent(
+                model=f"models/{model_name}",
+                contents=[glm.Content(role="user", parts=[glm.Part(text=prefix)])],
+                ttl=timedelta(seconds=self.ttl_seconds),
+            )
+        )
+        cached_content = await asyncio.to_thread(client.create_cached_content, request=request)
+        return cached_content.name
+
+    async def generate(
+        self, api_key: str, model_name: str, handle: str, suffix: str,
+        generation_config: Optional[Dict[str, Any]] = None
+    ) -> str:
+        client = gemini_client_pool.get_async_client(api_key)
+        request = glm.GenerateContentRequest(
+            model=f"models/{model_name}",
+            contents=[glm.Content(role="user", parts=[glm.Part(text=suffix)])],
+            cached_content=handle,
+            generation_config=glm.GenerationConfig(**generation_config) if generation_config else None,
+        )
+        response = await client.generate_content(request=request)
+        record_response_usage(response)
+        if not response.candidates:
+            raise ValueError("Gemini returned no candidates for the cached-context request.")
+        return "".join(part.text for part in response.candidates[0].content.parts)
+
+class FakeContextCacheBackend(ContextCacheBackend):
+    """
+    Backend giả lập chạy hoàn toàn offline: tạo handle cục bộ và sinh phản hồi xác định (deterministic),
+    dùng để kiểm thử luồng chia sẻ prefix mà không cần mạng hay quota.
+    Chỉ dùng cho kiểm thử: phản hồi giả không bao giờ được đọc/ghi vào cache phản hồi LLM.
+    """
+    cacheable_responses = False
+
+    def __init__(self, ttl_seconds: int, min_prefix_chars: int):
+        super().__init__(ttl_seconds, min_prefix_chars)
+        self.prefixes: Dict[str, str] = {}
+
+    async def _create(self, api_key: str, model_name: str, prefix: str) -> str:
+        handle = f"cachedContents/fake-{hashlib.sha256((api_key + model_name + prefix).encode('utf-8')).hexdigest()[:16]}"
+        self.prefixes[handle] = prefix
+        return handle
+
+    async def generate(
+        self, api_key: str, model_name: str, handle: str, suffix: str,
+        generation_config: Optional[Dict[str, Any]] = None
+    ) -> str:
+        if handle not in self.prefixes:
+            raise google_exceptions.NotFound(f"Cached content {handle} not found.")
+        return f"[{model_name} | cached prefix {len(self.prefixes[handle])} chars] {suffix[:200]}"
+
+def _build_backend() -> Optional[ContextCacheBackend]:
+    backend = (settings.LLM_CONTEXT_CACHE_BACKEND or "none").lower()
+    options = dict(
+        ttl_seconds=settings.LLM_CONTEXT_CACHE_TTL_SECONDS,
+        min_prefix_chars=settings.LLM_CONTEXT_CACHE_MIN_PREFIX_CHARS,
+    )
+    if backend == "gemini":
+        return GeminiContextCacheBackend(**options)
+    if backend == "fake":
+        logger.warning("LLM_CONTEXT_CACHE_BACKEND=fake is for tests only: prompts with a shared prefix get fake responses.")
+        return FakeContextCacheBackend(**options)
+    return None
+
+# Backend dùng chung cho toàn bộ ứng dụng (None = tắt context caching, dùng prompt đầy đủ như trước)
+context_cache_backend = _build_backend()
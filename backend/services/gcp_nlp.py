@@ -1,71 +1,183 @@
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
 from google.cloud import language_v2
 from backend.services.gcp_sa_manager import gcp_sa_manager
+from backend.services.model_backends import MODE_LIVE, nlp_backend
+from backend.core.log import get_logger
+
+logger = get_logger(__name__)
 
 # Việc xác thực giờ đây được quản lý bởi GcpServiceAccountManager.
 # Nó sẽ xoay vòng qua các service account có sẵn và cung cấp một client đã được xác thực.
 
-def analyze_text(text_content: str) -> dict:
+# --- Các tính năng phân tích được hỗ trợ ---
+ENTITIES = "entities"
+CATEGORIES = "categories"
+SENTIMENT = "sentiment"
+ALL_FEATURES = frozenset({ENTITIES, CATEGORIES, SENTIMENT})
+
+# --- Cache kết quả theo (nội dung, bộ tính năng) ---
+# Cache giữ bản sao riêng và trả về bản sao, để nơi gọi sửa kết quả (thêm text_stats, ghi chú...) không làm hỏng các lần hit sau
+_CACHE_MAX_ENTRIES = 512
+_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_key(text_content: str, features: frozenset) -> tuple:
+    digest = hashlib.sha256(text_content.encode("utf-8")).hexdigest()
+    return digest, tuple(sorted(features))
+
+def _cache_get(key: tuple) -> Optional[dict]:
+    # Chỉ cache kết quả của API thật; ở chế độ record/replay/synthetic mọi lệnh gọi đều đi qua backend
+    if nlp_backend.mode != MODE_LIVE:
+        return None
+    with _cache_lock:
+        result = _cache.get(key)
+        if result is None:
+            return None
+        _cache.move_to_end(key)
+    return copy.deepcopy(result)
+
+def _cache_put(key: tuple, result: dict) -> None:
+    if nlp_backend.mode != MODE_LIVE:
+        return
+    result = copy.deepcopy(result)
+    with _cache_lock:
+        _cache[key] = result
+        _cache.move_to_end(key)
+        while len(_cache) > _CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+def _format_entities(entities) -> list:
+    # --- Lọc bỏ các thực thể không cần thiết ---
+    excluded_entity_types = {"NUMBER", "PRICE", "DATE", "TIME"}
+    return [
+        {"name": entity.name, "type": entity.type_.name}
+        for entity in entities
+        if entity.type_.name not in excluded_entity_types
+    ]
+
+def _format_categories(categories) -> list:
+    return [{"name": category.name, "confidence": category.confidence} for category in categories]
+
+def _format_sentiment(document_sentiment) -> dict:
+    return {
+        "score": document_sentiment.score,
+        "magnitude": document_sentiment.magnitude,
+    }
+
+def _build_request(text_content: str, requested: frozenset) -> tuple:
+    """Chọn lệnh gọi hẹp nhất cho bộ tính năng được yêu cầu; trả về (tên method của client, request)."""
+    # Tạo một đối tượng Document để gửi đến API.
+    document = language_v2.Document(
+        content=text_content,
+        type_=language_v2.Document.Type.PLAIN_TEXT, # Chỉ định đây là văn bản thuần túy.
+        language_code="en" # Có thể để trống để API tự động phát hiện ngôn ngữ.
+    )
+    if requested == {CATEGORIES}:
+        return "classify_text", {"document": document}
+    if requested == {ENTITIES}:
+        return "analyze_entities", {"document": document}
+    if requested == {SENTIMENT}:
+        return "analyze_sentiment", {"document": document}
+    # Chỉ định các tính năng phân tích chúng ta muốn API thực hiện bằng cách sử dụng đối tượng Features.
+    return "annotate_text", language_v2.AnnotateTextRequest(
+        document=document,
+        features=language_v2.AnnotateTextRequest.Features(
+            extract_entities=ENTITIES in requested,
+            classify_text=CATEGORIES in requested,
+            extract_document_sentiment=SENTIMENT in requested,
+        ),
+    )
+
+def _format_response(response, requested: frozenset) -> dict:
+    results = {}
+    if ENTITIES in requested:
+        results[ENTITIES] = _format_entities(response.entities)
+    if CATEGORIES in requested:
+        results[CATEGORIES] = _format_categories(response.categories)
+    if SENTIMENT in requested:
+        results[SENTIMENT] = _format_sentiment(response.document_sentiment)
+    results["language"] = response.language_code
+    return results
+
+def _analyze_live(text_content: str, requested: frozenset) -> dict:
+    """Gọi Cloud Natural Language API thật (client đồng bộ) cho bộ tính năng `requested`."""
+    # Lấy client đã được xác thực từ manager.
+    # Manager sẽ xử lý việc xoay vòng qua các service account.
+    client = gcp_sa_manager.get_next_client()
+    method, request = _build_request(text_content, requested)
+    response = getattr(client, method)(request=request)
+    return _format_response(response, requested)
+
+async def _analyze_live_async(text_content: str, requested: frozenset) -> dict:
+    """Giống _analyze_live nhưng dùng client async, không chiếm thread nào trong khi chờ API."""
+    client = gcp_sa_manager.get_next_async_client()
+    method, request = _build_request(text_content, requested)
+    response = await getattr(client, method)(request=request)
+    return _format_response(response, requested)
+
+def _requested_features(features: Optional[Iterable[str]]) -> frozenset:
+    requested = frozenset(features) if features is not None else ALL_FEATURES
+    unknown = requested - ALL_FEATURES
+    if unknown:
+        raise ValueError(f"Unsupported NLP features: {', '.join(sorted(unknown))}")
+    if not requested:
+        raise ValueError("At least one NLP feature must be requested.")
+    return requested
+
+def analyze_text(text_content: str, features: Optional[Iterable[str]] = None) -> dict:
     """
     Phân tích văn bản bằng Google Cloud Natural Language API.
     Đây là "Động cơ Phân tích" chính của hệ thống.
 
     Args:
         text_content: Nội dung văn bản cần phân tích.
+        features: Các tính năng cần phân tích ("entities", "categories", "sentiment").
+                  Mặc định là tất cả. Nếu chỉ cần một tính năng, hàm sẽ gọi API hẹp nhất
+                  (ví dụ: classify_text) thay vì annotate_text.
 
     Returns:
-        Một dictionary chứa kết quả phân tích chi tiết.
+        Một dictionary chứa kết quả phân tích, chỉ gồm các tính năng được yêu cầu và "language".
     """
+    requested = _requested_features(features)
+    key = _cache_key(text_content, requested)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
     try:
-        # Lấy client đã được xác thực từ manager.
-        # Manager sẽ xử lý việc xoay vòng qua các service account.
-        client = gcp_sa_manager.get_next_client()
-
-        # Tạo một đối tượng Document để gửi đến API.
-        document = language_v2.Document(
-            content=text_content,
-            type_=language_v2.Document.Type.PLAIN_TEXT, # Chỉ định đây là văn bản thuần túy.
-            language_code="en" # Có thể để trống để API tự động phát hiện ngôn ngữ.
-        )
-
-        # Chỉ định các tính năng phân tích chúng ta muốn API thực hiện bằng cách sử dụng đối tượng Features.
-        features = language_v2.AnnotateTextRequest.Features(
-            extract_entities=True,
-            classify_text=True,
-            extract_document_sentiment=True,
-        )
-
-        # --- THỰC HIỆN GỌI API ---
-        # Gửi yêu cầu phân tích đến Google Cloud.
-        # Lưu ý: Tham số `features` được truyền trực tiếp.
-        request = language_v2.AnnotateTextRequest(
-            document=document,
-            features=features,
-        )
-        response = client.annotate_text(request=request)
-
-        # Xử lý và cấu trúc lại phản hồi từ API thành một dictionary dễ sử dụng hơn.
-        
-        # --- Lọc bỏ các thực thể không cần thiết ---
-        excluded_entity_types = {"NUMBER", "PRICE", "DATE", "TIME"}
-        filtered_entities = [
-            {"name": entity.name, "type": entity.type_.name}
-            for entity in response.entities
-            if entity.type_.name not in excluded_entity_types
-        ]
-
-        results = {
-            "entities": filtered_entities,
-            "categories": [{"name": category.name, "confidence": category.confidence} for category in response.categories],
-            "sentiment": {
-                "score": response.document_sentiment.score,
-                "magnitude": response.document_sentiment.magnitude,
-            },
-            "language": response.language_code,
-        }
+        # Backend quyết định gọi API thật, ghi cassette, hay replay/sinh kết quả giả (xem model_backends)
+        results = nlp_backend.analyze(text_content, requested, _analyze_live)
+
+        _cache_put(key, results)
         return results
 
     except Exception as e:
         # Trong một ứng dụng thực tế, bạn sẽ muốn có cơ chế xử lý lỗi và logging tốt hơn.
-        print(f"An error occurred with the NLP service: {e}")
+        logger.error(f"An error occurred with the NLP service: {e}")
         # Ném lại exception để endpoint có thể bắt và trả về lỗi HTTP 500.
         raise e
+
+async def analyze_text_async(text_content: str, features: Optional[Iterable[str]] = None) -> dict:
+    """
+    Phiên bản async của analyze_text (cùng tham số, kết quả và cache), dùng client async của Natural Language API
+    để có thể chạy song song với các lệnh gọi LLM trên cùng event loop.
+    """
+    requested = _requested_features(features)
+    key = _cache_key(text_content, requested)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        results = await nlp_backend.analyze_async(text_content, requested, _analyze_live_async)
+        _cache_put(key, results)
+        return results
+
+    except Exception as e:
+        logger.error(f"An error occurred with the NLP service: {e}")
+        raise e
@@ -1,9 +1,14 @@
 import os
 import json
 import uuid
+import asyncio
 import threading
+import weakref
 from google.cloud import language_v2
 from google.oauth2 import service_account
+from backend.core.log import get_logger
+
+logger = get_logger(__name__)
 
 class GcpServiceAccountManager:
     def __init__(self, creds_dir="backend/credentials/service_accounts"):
@@ -12,6 +17,10 @@ class GcpServiceAccountManager:
         self.accounts = self._load_accounts()
         self.current_index = 0
         self.lock = threading.Lock()
+        # Credentials đã nạp theo file (tránh đọc lại file ở mỗi lệnh gọi)
+        self._credentials = {}
+        # Client async (gRPC aio) bị gắn với event loop tạo ra nó: loop -> {file_path: client}
+        self._async_clients = weakref.WeakKeyDictionary()
 
     def _load_accounts(self):
         """Quét thư mục và tải thông tin từ các tệp service account hợp lệ."""
@@ -31,7 +40,7 @@ class GcpServiceAccountManager:
                             "file_path": file_path
                         })
                 except (json.JSONDecodeError, KeyError) as e:
-                    print(f"Could not load or parse {filename}: {e}")
+                    logger.error(f"Could not load or parse {filename}: {e}")
         return account_list
 
     def get_all_accounts_info(self):
@@ -40,6 +49,11 @@ class GcpServiceAccountManager:
             # Chỉ trả về thông tin cần thiết cho UI, không bao gồm file_path
             return [{"filename": acc["filename"], "project_id": acc["project_id"], "client_email": acc["client_email"]} for acc in self.accounts]
 
+    def account_count(self) -> int:
+        """Số service account hợp lệ hiện có."""
+        with self.lock:
+            return len(self.accounts)
+
     def add_account(self, file_stream):
         """Lưu một tệp service account mới và tải lại danh sách."""
         try:
@@ -63,7 +77,7 @@ class GcpServiceAccountManager:
                 self.accounts = self._load_accounts()
             return {"success": True, "filename": filename}
         except Exception as e:
-            print(f"Error adding service account: {e}")
+            logger.error(f"Error adding service account: {e}")
             return {"success": False, "error": str(e)}
 
     def delete_account(self, filename: str):
@@ -73,11 +87,15 @@ class GcpServiceAccountManager:
             if os.path.exists(file_path):
                 try:
                     os.remove(file_path)
+                    # Bỏ credentials và client async đã cache của account này
+                    self._credentials.pop(file_path, None)
+                    for clients in self._async_clients.values():
+                        clients.pop(file_path, None)
                     # Tải lại danh sách sau khi xóa
                     self.accounts = self._load_accounts()
                     return True
                 except OSError as e:
-                    print(f"Error deleting file {filename}: {e}")
+                    logger.error(f"Error deleting file {filename}: {e}")
                     return False
             return False
 
@@ -86,21 +104,42 @@ class GcpServiceAccountManager:
         Lấy client đã xác thực bằng service account tiếp theo (xoay vòng).
         """
         with self.lock:
-            if not self.accounts:
-                raise Exception("No valid GCP service accounts configured.")
-            
-            if self.current_index >= len(self.accounts):
-                self.current_index = 0
-            
-            account_to_use = self.accounts[self.current_index]
-            self.current_index = (self.current_index + 1) % len(self.accounts)
-            
-            print(f"Using GCP Service Account: {account_to_use['client_email']}")
+            account_to_use = self._next_account()
+            logger.debug("Using GCP service account.", extra={"fields": {"client_email": account_to_use['client_email']}})
             
             # Khởi tạo client một cách tường minh từ tệp
             credentials = service_account.Credentials.from_service_account_file(account_to_use['file_path'])
             client = language_v2.LanguageServiceClient(credentials=credentials)
             return client
 
+    def _next_account(self) -> dict:
+        if not self.accounts:
+            raise Exception("No valid GCP service accounts configured.")
+        if self.current_index >= len(self.accounts):
+            self.current_index = 0
+        account_to_use = self.accounts[self.current_index]
+        self.current_index = (self.current_index + 1) % len(self.accounts)
+        return account_to_use
+
+    def get_next_async_client(self) -> language_v2.LanguageServiceAsyncClient:
+        """
+        Lấy client async đã xác thực bằng service account tiếp theo (xoay vòng).
+        Client được tái sử dụng theo từng event loop, credentials được nạp một lần cho mỗi file.
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            account_to_use = self._next_account()
+            file_path = account_to_use['file_path']
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(file_path)
+            if client is None:
+                credentials = self._credentials.get(file_path)
+                if credentials is None:
+                    credentials = service_account.Credentials.from_service_account_file(file_path)
+                    self._credentials[file_path] = credentials
+                client = language_v2.LanguageServiceAsyncClient(credentials=credentials)
+                clients[file_path] = client
+            return client
+
 # Tạo một instance duy nhất (singleton) để toàn bộ ứng dụng sử dụng
 gcp_sa_manager = GcpServiceAccountManager()
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import weakref
+from typing import Dict, Tuple
+
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+class GeminiClientPool:
+    """
+    Quản lý client Gemini theo từng API key, thay cho `genai.configure(api_key=...)`.
+
+    `genai.configure` thay đổi trạng thái toàn cục của process, nên khi nhiều coroutine chạy
+    đồng thời, một lệnh gọi có thể đi ra ngoài bằng key của coroutine khác.
+    Pool này gắn client trực tiếp vào từng GenerativeModel nên mỗi model luôn dùng đúng key của nó,
+    và client được tái sử dụng thay vì khởi tạo lại ở mỗi lệnh gọi.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Client đồng bộ dùng chung cho mọi event loop: api_key -> client
+        self._sync_clients: Dict[str, glm.GenerativeServiceClient] = {}
+        self._cache_clients: Dict[str, glm.CacheServiceClient] = {}
+        # Client async (gRPC aio) bị gắn với event loop tạo ra nó: loop -> {api_key: client}
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, glm.GenerativeServiceAsyncClient]]" = weakref.WeakKeyDictionary()
+        # GenerativeModel theo từng event loop: loop -> {(api_key, model_name): model}
+        self._models: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str], genai.GenerativeModel]]" = weakref.WeakKeyDictionary()
+        # Model LangChain: (api_key, model_name) -> ChatGoogleGenerativeAI
+        self._chat_models: Dict[Tuple[str, str], ChatGoogleGenerativeAI] = {}
+
+    def _get_sync_client(self, api_key: str) -> glm.GenerativeServiceClient:
+        client = self._sync_clients.get(api_key)
+        if client is None:
+            client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+            self._sync_clients[api_key] = client
+        return client
+
+    def _get_async_client(self, loop: asyncio.AbstractEventLoop, api_key: str) -> glm.GenerativeServiceAsyncClient:
+        clients = self._async_clients.setdefault(loop, {})
+        client = clients.get(api_key)
+        if client is None:
+            client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+            clients[api_key] = client
+        return client
+
+    def get_async_client(self, api_key: str) -> glm.GenerativeServiceAsyncClient:
+        """Client async của `api_key` cho event loop hiện tại (dùng cho các request glm trực tiếp)."""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            return self._get_async_client(loop, api_key)
+
+    def get_cache_client(self, api_key: str) -> glm.CacheServiceClient:
+        """Client (đồng bộ) của dịch vụ context caching cho `api_key`."""
+        with self.lock:
+            client = self._cache_clients.get(api_key)
+            if client is None:
+                client = glm.CacheServiceClient(client_options={"api_key": api_key})
+                self._cache_clients[api_key] = client
+            return client
+
+    def get_model(self, api_key: str, model_name: str) -> genai.GenerativeModel:
+        """
+        Lấy GenerativeModel đã gắn sẵn client của `api_key` (tạo mới nếu chưa có).
+        Client async được tạo riêng cho event loop hiện tại.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        with self.lock:
+            if loop is not None:
+                models = self._models.setdefault(loop, {})
+                model = models.get((api_key, model_name))
+                if model is not None:
+                    return model
+
+            model = genai.GenerativeModel(model_name)
+            model._client = self._get_sync_client(api_key)
+            if loop is not None:
+                model._async_client = self._get_async_client(loop, api_key)
+                models[(api_key, model_name)] = model
+            return model
+
+    def get_chat_model(self, api_key: str, model_name: str) -> ChatGoogleGenerativeAI:
+        """Lấy model LangChain ChatGoogleGenerativeAI dùng chung cho `api_key`."""
+        with self.lock:
+            chat_model = self._chat_models.get((api_key, model_name))
+            if chat_model is None:
+                # Retry được xử lý tập trung ở llm_client (đổi key khi gặp 429), nên tắt retry nội bộ của LangChain.
+                chat_model = ChatGoogleGenerativeAI(model=model_name, google_api_key=api_key, max_retries=1)
+                self._chat_models[(api_key, model_name)] = chat_model
+            return chat_model
+
+    def evict(self, api_key: str):
+        """Loại bỏ mọi client của một key (ví dụ khi key bị xóa hoặc bị vô hiệu hóa)."""
+        with self.lock:
+            self._sync_clients.pop(api_key, None)
+            self._cache_clients.pop(api_key, None)
+            for clients in self._async_clients.values():
+                clients.pop(api_key, None)
+            for models in self._models.values():
+                for cache_key in [k for k in models if k[0] == api_key]:
+                    del models[cache_key]
+            for cache_key in [k for k in self._chat_models if k[0] == api_key]:
+                del self._chat_models[cache_key]
+
+    @staticmethod
+    def validate_key(api_key: str) -> None:
+        """
+        Kiểm tra một key bằng lệnh gọi nhẹ (liệt kê model) với client riêng, không đụng tới cấu hình toàn cục.
+        Ném exception của google.api_core nếu key không hợp lệ.
+        """
+        client = glm.ModelServiceClient(client_options={"api_key": api_key})
+        next(iter(client.list_models(request=glm.ListModelsRequest(page_size=1))), None)
+
+# Tạo một instance duy nhất (singleton) để toàn bộ ứng dụng sử dụng
+gemini_client_pool = GeminiClientPool()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+
+from backend.core.config import settings
+from backend.services.postal_gazetteer import postal_gazetteer
+from backend.services.text_stats import strip_accents
+
+# Sinh hashtag cục bộ, xác định (cùng hồ sơ -> cùng kết quả) từ các trường của hồ sơ:
+# bỏ dấu tiếng Việt, chuyển PascalCase và trích n-gram ứng viên từ từ khóa, tên, địa điểm và mô tả.
+# LLM chỉ được dùng để bổ sung một số hashtag ngách (xem llm_bio_generator.generate_hashtags).
+
+_TOKEN_RE = re.compile(r"[0-9A-Za-z]+")
+_HASHTAG_RE = re.compile(r"#?([^\s#,;]+)")
+# Tiền tố pháp lý của tên doanh nghiệp (đã bỏ dấu, chữ thường)
+_LEGAL_PREFIXES = ("cong ty", "tnhh", "co phan", "mtv", "cp", "jsc", "co ltd", "ltd", "dntn", "doanh nghiep tu nhan")
+_STOPWORDS = frozenset({
+    "va", "cua", "cho", "voi", "cac", "nhung", "la", "co", "duoc", "tai", "trong", "mot", "nhieu", "khi", "de",
+    "den", "tu", "nay", "do", "ve", "theo", "chung", "toi", "ban", "se", "da", "dang", "rat", "hon",
+    "the", "and", "of", "for", "with", "to", "in", "a", "an", "our", "your", "we", "is", "are", "on", "at", "by",
+})
+_MIN_TAG_CHARS = 3
+_MAX_TAG_CHARS = 30
+
+def _tokens(text: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall(strip_accents(text or ""))
+
+def to_pascal_tag(phrase: Optional[str]) -> Optional[str]:
+    """
+    "Món ngon Việt Nam" -> "#MonNgonVietNam". Từ viết hoa toàn bộ (SEO, HCM) được giữ nguyên.
+    Trả về None nếu hashtag quá ngắn/quá dài.
+    """
+    words = [word if word.isupper() and len(word) > 1 else word[:1].upper() + word[1:].lower() for word in _tokens(phrase)]
+    tag = "".join(words)
+    if not _MIN_TAG_CHARS <= len(tag) <= _MAX_TAG_CHARS:
+        return None
+    return f"#{tag}"
+
+def _strip_legal_prefixes(name: str) -> str:
+    tokens = [token.lower() for token in _tokens(name)]
+    original = _tokens(name)
+    start = 0
+    changed = True
+    while changed:
+        changed = False
+        for prefix in _LEGAL_PREFIXES:
+            size = len(prefix.split())
+            if " ".join(tokens[start:start + size]) == prefix:
+                start += size
+                changed = True
+    return " ".join(original[start:])
+
+def _ngrams(tokens: List[str], sizes=(3, 2)) -> List[str]:
+    """Các n-gram không bắt đầu/kết thúc bằng từ dừng, theo thứ tự xuất hiện (n lớn trước)."""
+    grams = []
+    for size in sizes:
+        for start in range(len(tokens) - size + 1):
+            gram = tokens[start:start + size]
+            if gram[0].lower() in _STOPWORDS or gram[-1].lower() in _STOPWORDS:
+                continue
+            grams.append(" ".join(gram))
+    return grams
+
+def _description_phrases(description: Optional[str], limit: int) -> List[str]:
+    """
+    N-gram lặp lại nhiều nhất của mô tả (tách theo dấu câu để không ghép từ qua hai mệnh đề).
+    Cụm chỉ xuất hiện một lần thường là mảnh câu ("Cung Cap May") nên bị bỏ qua.
+    """
+    counter: Counter = Counter()
+    display: Dict[str, str] = {}
+    for clause in re.split(r"[.,;:!?\n()]+", description or ""):
+        for gram in _ngrams(_tokens(clause)):
+            key = gram.lower()
+            counter[key] += 1
+            display.setdefault(key, gram)
+    # Counter.most_common giữ thứ tự xuất hiện đầu tiên khi tần suất bằng nhau
+    return [display[key] for key, count in counter.most_common(limit) if count > 1]
+
+def local_hashtags(profile: Dict[str, Any], limit: Optional[int] = None) -> List[str]:
+    """
+    Hashtag xác định từ hồ sơ, theo thứ tự ưu tiên:
+    từ khóa chính, tên (bỏ tiền tố pháp lý), từ khóa + địa điểm, địa điểm, n-gram của từ khóa, cụm từ nổi bật của mô tả.
+    Ứng viên là tiền tố của một hashtag đã chọn bị bỏ qua.
+    """
+    limit = limit or settings.HASHTAG_TOTAL
+    keyword = profile.get("main_keyword") or profile.get("keyword") or ""
+    name = _strip_legal_prefixes(profile.get("name") or "")
+    location = None
+    match = postal_gazetteer.lookup(profile.get("address"))
+    # Chỉ dùng địa điểm khi tỉnh là thành phần cuối của địa chỉ (kết quả chắc chắn nhất)
+    if match and match["source"] == "trailing":
+        location = match["province"]
+
+    candidates = [keyword, name]
+    if profile.get("keyword") and profile.get("keyword") != keyword:
+        candidates.append(profile["keyword"])
+    if location:
+        candidates.extend([f"{keyword} {location}", location])
+    candidates.extend(_ngrams(_tokens(keyword)))
+    candidates.extend(_description_phrases(profile.get("short_description"), limit))
+
+    tags, seen = [], set()
+    for phrase in candidates:
+        tag = to_pascal_tag(phrase)
+        if not tag or tag.lower() in seen:
+            continue
+        # Bỏ mảnh của hashtag đã có ("#SpaDuong" khi đã có "#SpaDuongDa")
+        if any(existing.startswith(tag.lower()) for existing in seen):
+            continue
+        seen.add(tag.lower())
+        tags.append(tag)
+        if len(tags) >= limit:
+            break
+    return tags
+
+def normalize_hashtags(text: str) -> List[str]:
+    """Chuẩn hóa hashtag do LLM trả về (bỏ dấu, PascalCase, bỏ ký tự lạ)."""
+    tags = []
+    for raw in _HASHTAG_RE.findall(text or ""):
+        # Giữ nguyên cách viết hoa của LLM nếu đã là PascalCase, chỉ bỏ dấu và ký tự không hợp lệ
+        tag = "".join(_tokens(raw))
+        if _MIN_TAG_CHARS <= len(tag) <= _MAX_TAG_CHARS:
+            tags.append(f"#{tag[:1].upper()}{tag[1:]}")
+    return tags
+
+def merge_hashtags(*groups: List[str], limit: Optional[int] = None) -> List[str]:
+    """Gộp các nhóm hashtag theo thứ tự, bỏ trùng (không phân biệt hoa thường)."""
+    limit = limit or settings.HASHTAG_TOTAL
+    merged, seen = [], set()
+    for group in groups:
+        for tag in group:
+            if tag.lower() not in seen:
+                seen.add(tag.lower())
+                merged.append(tag)
+    return merged[:limit]
+
+# --- Cache kết quả theo hồ sơ ---
+_PROFILE_FIELDS = ("keyword", "main_keyword", "name", "website", "address", "short_description", "language")
+
+class HashtagCache:
+    """LRU trong bộ nhớ: hồ sơ (các trường ảnh hưởng tới hashtag) -> chuỗi hashtag cuối cùng."""
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(profile: Dict[str, Any]) -> str:
+        fields = {field: profile.get(field) for field in _PROFILE_FIELDS}
+        return hashlib.sha256(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+hashtag_cache = HashtagCache(settings.HASHTAG_CACHE_MAX_ENTRIES)
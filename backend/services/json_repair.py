@@ -0,0 +1,120 @@
+import ast
+import json
+import re
+from typing import Any, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+# Lớp trích xuất/sửa JSON "dễ tính" cho phản hồi LLM.
+# Dùng làm phương án dự phòng khi structured output thất bại: phản hồi thường bị bọc trong ```json,
+# có chữ thừa trước/sau, dấu phẩy thừa, nháy kép kiểu "thông minh", hoặc bị cắt cụt giữa chừng.
+
+SchemaT = TypeVar("SchemaT", bound=BaseModel)
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = {"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'"}
+# Nháy thông minh ở vị trí cấu trúc: ngay sau { [ , : hoặc ngay trước : , } ] (bỏ qua khoảng trắng).
+# Nháy thông minh bên trong giá trị chuỗi (rất phổ biến trong văn bản tiếng Việt) được giữ nguyên.
+_STRUCTURAL_SMART_QUOTE_RE = re.compile(r"(?<=[{\[,:])(\s*)([“”„‘’])|([“”„‘’])(?=\s*[:,}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+class JsonRepairError(ValueError):
+    """Không thể trích xuất JSON hợp lệ từ phản hồi."""
+
+def _strip_fences(text: str) -> str:
+    match = _FENCE_RE.search(text)
+    if match:
+        return match.group(1)
+    # Phản hồi bị cắt cụt có thể chỉ có fence mở
+    return text.replace("```json", "").replace("```JSON", "").replace("```", "")
+
+def _balanced_candidate(text: str) -> str:
+    """
+    Lấy khối JSON đầu tiên (bắt đầu bằng '{' hoặc '[') bằng cách quét và đếm ngoặc, bỏ qua ngoặc trong chuỗi.
+    Nếu khối bị cắt cụt, tự động đóng chuỗi và các ngoặc còn mở.
+    """
+    start = min((i for i in (text.find("{"), text.find("[")) if i != -1), default=-1)
+    if start == -1:
+        raise JsonRepairError("No JSON object or array found in response.")
+
+    stack = []
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(_CLOSERS[char])
+        elif char in ("}", "]"):
+            if stack and stack[-1] == char:
+                stack.pop()
+            if not stack:
+                return text[start:index + 1]
+
+    # Bị cắt cụt: đóng chuỗi đang mở và các ngoặc theo thứ tự ngược lại
+    candidate = text[start:]
+    if in_string:
+        candidate += '"'
+    candidate = candidate.rstrip().rstrip(",")
+    return candidate + "".join(reversed(stack))
+
+def _normalize_structural_quotes(text: str) -> str:
+    return _STRUCTURAL_SMART_QUOTE_RE.sub(
+        lambda match: (match.group(1) or "") + _SMART_QUOTES[match.group(2) or match.group(3)], text
+    )
+
+def _loads_lenient(candidate: str) -> Any:
+    repaired = _TRAILING_COMMA_RE.sub(r"\1", candidate)
+    try:
+        return json.loads(repaired, strict=False)
+    except json.JSONDecodeError:
+        pass
+    # Chỉ thay nháy thông minh đóng vai trò cú pháp (bao quanh khóa/giá trị), không đụng tới nội dung chuỗi
+    repaired = _normalize_structural_quotes(repaired)
+    try:
+        return json.loads(repaired, strict=False)
+    except json.JSONDecodeError:
+        pass
+    # Phương án cuối: cú pháp kiểu Python (nháy đơn, True/False/None)
+    python_like = re.sub(r"\btrue\b", "True", repaired)
+    python_like = re.sub(r"\bfalse\b", "False", python_like)
+    python_like = re.sub(r"\bnull\b", "None", python_like)
+    try:
+        return ast.literal_eval(python_like)
+    except (ValueError, SyntaxError) as e:
+        raise JsonRepairError(f"Could not repair JSON: {e}")
+
+def extract_json(text: str) -> Any:
+    """Trích xuất và sửa JSON từ phản hồi LLM. Ném JsonRepairError nếu không thể."""
+    if not text or not text.strip():
+        raise JsonRepairError("Empty response.")
+    body = _strip_fences(text.strip()).strip()
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError:
+        pass
+    return _loads_lenient(_balanced_candidate(body))
+
+def parse_model(text: str, schema: Type[SchemaT]) -> SchemaT:
+    """
+    Trích xuất JSON từ `text` và validate theo `schema`.
+    Nếu LLM trả về một mảng trong khi schema chỉ có một trường, mảng được gán vào trường đó.
+    """
+    data = extract_json(text)
+    fields = list(schema.model_fields)
+    if isinstance(data, list) and len(fields) == 1:
+        data = {fields[0]: data}
+    try:
+        return schema.model_validate(data)
+    except ValidationError as e:
+        raise JsonRepairError(f"Response does not match {schema.__name__}: {e}")
@@ -0,0 +1,291 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from backend.core import model_routing
+from backend.core.config import settings
+from backend.core.log import get_logger
+
+logger = get_logger(__name__)
+
+# Theo dõi quota của từng (tier, key) trên ba chiều mà Gemini áp dụng: số request/phút (RPM),
+# số token đầu vào/phút (TPM) và số request/ngày (RPD), bằng cửa sổ trượt trên các lượt dùng key.
+# Mỗi lần bộ lập lịch giữ chỗ một key, một lượt dùng (thời điểm, token ước tính) được ghi lại;
+# token thực tế được cập nhật khi lệnh gọi xong. Giới hạn lấy từ LLM_MODEL_TIERS (rpm/tpm/rpd)
+# và được hạ xuống theo quota_value trong lỗi 429. Trạng thái được lưu xuống SQLite để không mất khi khởi động lại.
+# Thời gian trong module này là wall clock (time.time()) để còn ý nghĩa sau khi khởi động lại.
+
+MINUTE_SECONDS = 60.0
+DAY_SECONDS = 86400.0
+
+# Chi tiết QuotaFailure/RetryInfo trong thông điệp lỗi 429 của Gemini API, ví dụ:
+#   quota_id: "GenerateRequestsPerMinutePerProjectPerModel-FreeTier" ... quota_value: 10 ... retry_delay { seconds: 37 }
+_VIOLATION_RE = re.compile(r'quota_id:\s*"([^"]+)"(?:(?!quota_id:).)*?quota_value:\s*(\d+)', re.DOTALL)
+_RETRY_DELAY_RE = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)")
+_RETRY_IN_RE = re.compile(r"retry in\s+([\d.]+)\s*s", re.IGNORECASE)
+
+def _dimension_for_quota_id(quota_id: str) -> Optional[str]:
+    if "PerDay" in quota_id:
+        return "rpd"
+    if "PerMinute" in quota_id:
+        return "tpm" if "Token" in quota_id else "rpm"
+    return None
+
+def parse_quota_error(error: Exception) -> Tuple[Dict[str, int], Optional[float]]:
+    """
+    Đọc lỗi 429: trả về (chiều quota bị vượt -> giới hạn được báo, số giây nên chờ trước khi thử lại).
+    Thời gian chờ lấy từ header Retry-After nếu có, nếu không thì từ RetryInfo trong thông điệp lỗi.
+    """
+    text = str(error)
+    limits: Dict[str, int] = {}
+    for quota_id, value in _VIOLATION_RE.findall(text):
+        dimension = _dimension_for_quota_id(quota_id)
+        if dimension:
+            limits[dimension] = min(int(value), limits.get(dimension, int(value)))
+
+    retry_after = None
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers:
+        try:
+            retry_after = float(headers.get("retry-after") or headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            retry_after = None
+    if retry_after is None:
+        match = _RETRY_DELAY_RE.search(text) or _RETRY_IN_RE.search(text)
+        if match:
+            retry_after = float(match.group(1))
+    return limits, retry_after
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Ước tính nhanh số token đầu vào (~4 ký tự/token) trước khi có usage_metadata thực tế."""
+    return len(text or "") // 4
+
+class QuotaUsage:
+    """Một lượt dùng key. `tokens` là ước tính cho tới khi lệnh gọi báo số token thực tế."""
+    __slots__ = ("at", "tokens")
+
+    def __init__(self, at: float, tokens: int):
+        self.at = at
+        self.tokens = tokens
+
+class _KeyState:
+    def __init__(self):
+        # Các lượt dùng trong 24 giờ gần nhất, sắp theo thời điểm (có thể gồm slot đã giữ trong tương lai gần)
+        self.usages: List[QuotaUsage] = []
+        # chiều -> (giới hạn học được từ lỗi 429, thời điểm học)
+        self.learned: Dict[str, Tuple[int, float]] = {}
+
+class KeyQuotaTracker:
+    def __init__(self, db_path: str, flush_interval_seconds: float, learned_ttl_seconds: float):
+        self.db_path = db_path
+        self.flush_interval_seconds = flush_interval_seconds
+        self.learned_ttl_seconds = learned_ttl_seconds
+        self.lock = threading.Lock()
+        # (tier, key_hash) -> trạng thái; key không được lưu dạng rõ, chỉ lưu sha256
+        self._states: Dict[Tuple[str, str], _KeyState] = {}
+        self._dirty: set = set()
+        self._last_flush = time.monotonic()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS key_quota_state (
+                tier TEXT NOT NULL,
+                key_hash TEXT NOT NULL,
+                usages TEXT NOT NULL,
+                learned TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (tier, key_hash)
+            )
+            """
+        )
+        self._conn.commit()
+        self._load()
+
+    @staticmethod
+    def _key_hash(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        cutoff = time.time() - DAY_SECONDS
+        try:
+            rows = self._conn.execute("SELECT tier, key_hash, usages, learned FROM key_quota_state").fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Could not load key quota state: {e}")
+            return
+        for tier, key_hash, usages, learned in rows:
+            state = _KeyState()
+            state.usages = [QuotaUsage(at, tokens) for at, tokens in json.loads(usages) if at > cutoff]
+            state.usages.sort(key=lambda usage: usage.at)
+            state.learned = {dimension: tuple(value) for dimension, value in json.loads(learned).items()}
+            self._states[(tier, key_hash)] = state
+
+    def _state(self, tier: str, api_key: str) -> _KeyState:
+        state_key = (tier, self._key_hash(api_key))
+        state = self._states.get(state_key)
+        if state is None:
+            state = self._states[state_key] = _KeyState()
+        return state
+
+    def _prune(self, state: _KeyState, now: float):
+        cutoff = now - DAY_SECONDS
+        if state.usages and state.usages[0].at <= cutoff:
+            del state.usages[:bisect.bisect_right(state.usages, cutoff, key=lambda usage: usage.at)]
+
+    def _limits(self, tier: str, state: _KeyState, now: float) -> Dict[str, Optional[int]]:
+        """Giới hạn cấu hình của tier, hạ xuống theo giới hạn đã học (hết hạn sau learned_ttl_seconds)."""
+        limits = dict(model_routing.quota_limits_for_tier(tier))
+        for dimension, (value, learned_at) in list(state.learned.items()):
+            if now - learned_at > self.learned_ttl_seconds:
+                del state.learned[dimension]
+                continue
+            configured = limits.get(dimension)
+            limits[dimension] = value if configured is None else min(configured, value)
+        return limits
+
+    def limits(self, tier: str, api_key: str) -> Dict[str, Optional[int]]:
+        with self.lock:
+            return self._limits(tier, self._state(tier, api_key), time.time())
+
+    def available_at(self, tier: str, api_key: str, tokens: int, at: float) -> float:
+        """
+        Thời điểm sớm nhất (>= `at`) key có thể phục vụ một lệnh gọi `tokens` token mà không vượt RPM, TPM, RPD.
+        Các lượt dùng mới luôn nằm sau các lượt đã có, nên chỉ cần xét phần cuối của danh sách lượt dùng.
+        """
+        with self.lock:
+            state = self._state(tier, api_key)
+            now = time.time()
+            self._prune(state, now)
+            limits = self._limits(tier, state, now)
+            usages = state.usages
+            ready = at
+            for dimension, window in (("rpm", MINUTE_SECONDS), ("rpd", DAY_SECONDS)):
+                limit = limits.get(dimension)
+                if limit and len(usages) >= limit:
+                    # Lượt dùng thứ `limit` tính từ cuối phải ra khỏi cửa sổ
+                    ready = max(ready, usages[len(usages) - limit].at + window)
+            tpm = limits.get("tpm")
+            if tpm:
+                # Lệnh gọi lớn hơn cả giới hạn TPM chỉ cần cửa sổ phút trống
+                budget = tpm - min(tokens, tpm)
+                used = 0
+                for usage in reversed(usages):
+                    if usage.at + MINUTE_SECONDS <= ready:
+                        break
+                    used += usage.tokens
+                    if used > budget:
+                        ready = max(ready, usage.at + MINUTE_SECONDS)
+                        break
+            return ready
+
+    def reserve(self, tier: str, api_key: str, tokens: int, at: float) -> QuotaUsage:
+        """Ghi một lượt dùng của key tại thời điểm slot đã giữ."""
+        usage = QuotaUsage(at, tokens)
+        with self.lock:
+            state = self._state(tier, api_key)
+            if state.usages and state.usages[-1].at > at:
+                bisect.insort(state.usages, usage, key=lambda item: item.at)
+            else:
+                state.usages.append(usage)
+            self._dirty.add((tier, self._key_hash(api_key)))
+        return usage
+
+    def release(self, tier: str, api_key: str, usage: Optional[QuotaUsage]):
+        """Hủy một lượt dùng (slot bị hủy trước khi gọi, hoặc request bị từ chối với 429 nên không tính quota)."""
+        if usage is None:
+            return
+        with self.lock:
+            state = self._state(tier, api_key)
+            try:
+                state.usages.remove(usage)
+            except ValueError:
+                return
+            self._dirty.add((tier, self._key_hash(api_key)))
+
+    def settle(self, tier: str, api_key: str, usage: Optional[QuotaUsage], input_tokens: int):
+        """Cập nhật số token thực tế của lượt dùng (0 = chưa có usage_metadata, giữ ước tính)."""
+        if usage is None or not input_tokens:
+            return
+        with self.lock:
+            usage.tokens = input_tokens
+            self._dirty.add((tier, self._key_hash(api_key)))
+
+    def learn(self, tier: str, api_key: str, error: Exception) -> Optional[float]:
+        """
+        Học giới hạn từ lỗi 429 (quota_value của chiều bị vượt) và trả về số giây nên cooldown key, nếu lỗi có báo.
+        """
+        limits, retry_after = parse_quota_error(error)
+        if limits:
+            now = time.time()
+            with self.lock:
+                state = self._state(tier, api_key)
+                for dimension, value in limits.items():
+                    state.learned[dimension] = (value, now)
+                self._dirty.add((tier, self._key_hash(api_key)))
+            logger.info("Learned API key quota limits from a quota error.", extra={"fields": {"key_id": f"...{api_key[-4:]}", "tier": tier, "limits": limits, "retry_after_seconds": retry_after}})
+        return retry_after
+
+    def flush_due(self) -> bool:
+        return bool(self._dirty) and time.monotonic() - self._last_flush >= self.flush_interval_seconds
+
+    def flush(self):
+        """Ghi trạng thái của các key đã thay đổi xuống SQLite."""
+        now = time.time()
+        with self.lock:
+            dirty, self._dirty = self._dirty, set()
+            self._last_flush = time.monotonic()
+            if not dirty:
+                return
+            rows = []
+            for state_key in dirty:
+                state = self._states.get(state_key)
+                if state is None:
+                    continue
+                self._prune(state, now)
+                usages = json.dumps([[usage.at, usage.tokens] for usage in state.usages])
+                rows.append(state_key + (usages, json.dumps(state.learned), now))
+            self._conn.executemany(
+                """
+                INSERT INTO key_quota_state (tier, key_hash, usages, learned, updated_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (tier, key_hash) DO UPDATE SET
+                    usages = excluded.usages, learned = excluded.learned, updated_at = excluded.updated_at
+                """,
+                rows
+            )
+            self._conn.execute("DELETE FROM key_quota_state WHERE updated_at <= ?", (now - DAY_SECONDS,))
+            self._conn.commit()
+
+class QuotaGate:
+    """
+    Cổng quota cho một lệnh gọi, được KeyScheduler.acquire dùng khi chọn key:
+    key chưa đủ quota cho `tokens` token bị đẩy lùi tới thời điểm đủ quota, và lượt dùng được giữ cùng với slot.
+    Thời điểm của bộ lập lịch là time.monotonic(); độ lệch với wall clock được cố định khi tạo cổng.
+    """
+    def __init__(self, tracker: KeyQuotaTracker, tier: str, tokens: int):
+        self.tracker = tracker
+        self.tier = tier
+        self.tokens = tokens
+        self.usage: Optional[QuotaUsage] = None
+        self._offset = time.time() - time.monotonic()
+
+    def ready_at(self, key: str, slot: float) -> float:
+        return self.tracker.available_at(self.tier, key, self.tokens, slot + self._offset) - self._offset
+
+    def reserve(self, key: str, slot: float):
+        self.usage = self.tracker.reserve(self.tier, key, self.tokens, slot + self._offset)
+
+    def release(self, key: str):
+        self.tracker.release(self.tier, key, self.usage)
+        self.usage = None
+
+key_quota = KeyQuotaTracker(settings.KEY_QUOTA_PATH, settings.KEY_QUOTA_FLUSH_SECONDS, settings.KEY_QUOTA_LEARNED_TTL_SECONDS)
@@ -0,0 +1,169 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Protocol, Tuple
+
+# Bộ lập lịch key cho một tier: min-heap theo thời điểm key sẵn sàng.
+# Mỗi lệnh gọi giữ chỗ (reserve) slot sớm nhất của key sớm nhất ngay khi vào hàng, rồi chờ tới slot đó
+# mà KHÔNG giữ lock, nên một lệnh gọi đang chờ không chặn các lệnh gọi khác và các key đã nguội được dùng ngay.
+# Lock chỉ bảo vệ các thao tác ngắn trên heap (không có await bên trong), dùng được từ cả event loop lẫn thread khác.
+
+class SlotGate(Protocol):
+    """Ràng buộc bổ sung cho một lệnh gọi (ví dụ quota RPM/TPM/RPD, xem key_quota.QuotaGate)."""
+    def ready_at(self, key: str, slot: float) -> float:
+        """Thời điểm sớm nhất (>= `slot`) key có thể phục vụ lệnh gọi."""
+    def reserve(self, key: str, slot: float) -> None:
+        """Ghi nhận slot đã giữ của key."""
+    def release(self, key: str) -> None:
+        """Hủy slot đã giữ (key bị xóa/cooldown trong lúc chờ)."""
+
+class KeyQuotaExhaustedError(Exception):
+    """Không key nào sẵn sàng trong thời gian chờ tối đa; `retry_after`: số giây tới slot sớm nhất."""
+    def __init__(self, retry_after: float):
+        super().__init__(f"All API keys are rate limited; retry in {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+class KeyScheduler:
+    def __init__(self, interval: float):
+        """`interval`: thời gian tối thiểu (giây) giữa hai lần dùng cùng một key."""
+        self.interval = interval
+        self._lock = threading.Lock()
+        # (thời điểm slot kế tiếp còn trống, thứ tự chèn, key). Mục có thời điểm khác _next_slot[key] là mục cũ, bị bỏ qua.
+        self._heap: List[Tuple[float, int, str]] = []
+        self._next_slot: Dict[str, float] = {}
+        # Key bị cooldown (lỗi 429) không được dùng trước thời điểm này; các slot đã giữ trước đó bị hủy
+        self._blocked_until: Dict[str, float] = {}
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._next_slot)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._next_slot
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._next_slot)
+
+    def _push(self, key: str, slot: float) -> None:
+        self._next_slot[key] = slot
+        heapq.heappush(self._heap, (slot, next(self._counter), key))
+        # Dọn các mục cũ khi heap phình to
+        if len(self._heap) > 4 * len(self._next_slot) + 64:
+            self._heap = [(s, c, k) for s, c, k in self._heap if self._next_slot.get(k) == s]
+            heapq.heapify(self._heap)
+
+    def set_keys(self, keys: Iterable[str]) -> None:
+        """Thay toàn bộ tập key; key mới sẵn sàng ngay."""
+        with self._lock:
+            self._heap.clear()
+            self._next_slot.clear()
+            self._blocked_until.clear()
+            for key in dict.fromkeys(keys):
+                self._push(key, 0.0)
+
+    def sync(self, keys: Iterable[str]) -> None:
+        """Đồng bộ tập key: thêm key mới, bỏ key không còn; slot và cooldown của các key còn lại được giữ nguyên."""
+        with self._lock:
+            keys = dict.fromkeys(keys)
+            for key in [key for key in self._next_slot if key not in keys]:
+                del self._next_slot[key]
+                self._blocked_until.pop(key, None)
+            for key in keys:
+                if key not in self._next_slot:
+                    self._push(key, 0.0)
+
+    def add(self, key: str, ready_at: float = 0.0) -> None:
+        """Thêm một key (không ảnh hưởng trạng thái các key khác); `ready_at` theo time.monotonic()."""
+        with self._lock:
+            if key not in self._next_slot:
+                self._push(key, ready_at)
+
+    def remove(self, key: str) -> bool:
+        """Bỏ một key; các lệnh gọi đang chờ slot của key này sẽ tự chọn key khác."""
+        with self._lock:
+            self._blocked_until.pop(key, None)
+            return self._next_slot.pop(key, None) is not None
+
+    def defer(self, key: str, delay_seconds: float) -> None:
+        """Key chỉ được dùng lại sau `delay_seconds` giây (ví dụ sau lỗi quota)."""
+        with self._lock:
+            if key not in self._next_slot:
+                return
+            until = time.monotonic() + delay_seconds
+            self._blocked_until[key] = until
+            # Slot đã giữ sau thời điểm `until` vẫn hợp lệ nên slot trống kế tiếp không lùi lại
+            self._push(key, max(until, self._next_slot[key]))
+
+    def ready_at(self, key: str) -> Optional[float]:
+        """Thời điểm slot trống kế tiếp của key (time.monotonic()), None nếu key không có."""
+        return self._next_slot.get(key)
+
+    def _reserve(
+        self, preferred_keys: Optional[Iterable[str]], gate: Optional[SlotGate], max_wait: Optional[float]
+    ) -> Tuple[str, float]:
+        now = time.monotonic()
+        if preferred_keys:
+            for key in preferred_keys:
+                slot = self._next_slot.get(key)
+                if slot is not None and slot <= now and (gate is None or gate.ready_at(key, now) <= now):
+                    self._push(key, now + self.interval)
+                    return key, now
+        while self._heap:
+            slot, _, key = heapq.heappop(self._heap)
+            if self._next_slot.get(key) != slot:
+                continue
+            start = max(slot, now)
+            if gate is not None:
+                ready = gate.ready_at(key, start)
+                if ready > start:
+                    # Key chưa đủ quota cho lệnh gọi này: đưa lại vào heap ở thời điểm đủ quota rồi xét key kế tiếp
+                    self._push(key, ready)
+                    continue
+            if max_wait is not None and start - now > max_wait:
+                # Key sớm nhất vẫn quá xa: không giữ chỗ, trả key về heap ở slot cũ
+                self._push(key, start)
+                raise KeyQuotaExhaustedError(start - now)
+            self._push(key, start + self.interval)
+            return key, start
+        raise ValueError("No valid API keys available.")
+
+    def _still_valid(self, key: str, slot: float) -> bool:
+        return key in self._next_slot and self._blocked_until.get(key, 0.0) <= slot
+
+    async def acquire(
+        self,
+        preferred_keys: Optional[Iterable[str]] = None,
+        gate: Optional[SlotGate] = None,
+        max_wait: Optional[float] = None,
+    ) -> str:
+        """
+        Lấy key sẵn sàng sớm nhất. `preferred_keys` được ưu tiên nếu đang sẵn sàng ngay.
+        Nếu chưa có key nào nguội, giữ chỗ slot sớm nhất rồi chờ (ngoài lock) tới slot đó.
+        `gate` (tùy chọn) loại các key chưa đủ quota cho lệnh gọi và được báo slot đã giữ.
+        Raise ValueError nếu không có key nào, KeyQuotaExhaustedError nếu slot sớm nhất xa hơn `max_wait` giây.
+        """
+        while True:
+            with self._lock:
+                key, slot = self._reserve(preferred_keys, gate, max_wait)
+                if gate is not None:
+                    gate.reserve(key, slot)
+            wait = slot - time.monotonic()
+            if wait <= 0:
+                return key
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # Lệnh gọi bị hủy (ví dụ client ngắt kết nối): trả lại quota đã giữ
+                if gate is not None:
+                    with self._lock:
+                        gate.release(key)
+                raise
+            with self._lock:
+                # Trong lúc chờ, key có thể đã bị xóa hoặc bị cooldown: giữ chỗ lại
+                if self._still_valid(key, slot):
+                    return key
+                if gate is not None:
+                    gate.release(key)
@@ -0,0 +1,130 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from backend.core.log import get_logger
+
+logger = get_logger(__name__)
+
+# Kho Gemini API key trên SQLite: một bảng có chỉ mục theo trạng thái, các thao tác hàng loạt
+# (thêm/xóa/cập nhật trạng thái) chạy trong một transaction thay vì ghi lại toàn bộ file JSON cho mỗi key.
+# Lần khởi tạo đầu tiên nhập các key từ file api_keys.json cũ (nếu có).
+
+_SCHEMA_VERSION = 1
+
+class ApiKeyStore:
+    def __init__(self, db_path: str, legacy_json_path: Optional[str] = None):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS api_keys (
+                key TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                tiers TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_api_keys_status ON api_keys (status)")
+        self._conn.commit()
+        if legacy_json_path:
+            self._import_legacy_json(legacy_json_path)
+
+    def _import_legacy_json(self, path: str):
+        """Nhập key từ file JSON cũ một lần duy nhất (đánh dấu bằng PRAGMA user_version)."""
+        with self.lock:
+            if self._conn.execute("PRAGMA user_version").fetchone()[0] >= _SCHEMA_VERSION:
+                return
+            keys_config: List[Any] = []
+            if os.path.exists(path):
+                try:
+                    with open(path, "r") as f:
+                        keys_config = json.load(f).get("keys", [])
+                except (OSError, ValueError) as e:
+                    logger.error(f"Could not read legacy API key file: {e}")
+                    return
+            # Định dạng cũ nhất là danh sách chuỗi
+            rows = [{"key": item, "status": "unchecked"} if isinstance(item, str) else item for item in keys_config]
+            now = time.time()
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO api_keys (key, status, tiers, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(row["key"], row.get("status", "unchecked"), json.dumps(row["tiers"]) if row.get("tiers") else None, now, now)
+                     for row in rows if row.get("key")]
+                )
+                self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            if rows:
+                logger.info("Imported API keys from the legacy JSON file.", extra={"fields": {"keys": len(rows), "path": path}})
+
+    @staticmethod
+    def _row_to_info(key: str, status: str, tiers: Optional[str]) -> Dict[str, Any]:
+        info = {"key": key, "status": status}
+        if tiers:
+            info["tiers"] = json.loads(tiers)
+        return info
+
+    def all(self) -> List[Dict[str, Any]]:
+        """Mọi key theo thứ tự thêm vào: {"key", "status"[, "tiers"]}."""
+        with self.lock:
+            rows = self._conn.execute("SELECT key, status, tiers FROM api_keys ORDER BY created_at, rowid").fetchall()
+        return [self._row_to_info(*row) for row in rows]
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, Dict[str, Any]] = {}
+        with self.lock:
+            # Chia nhỏ để không vượt giới hạn số tham số của SQLite
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, status, tiers FROM api_keys WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for row in rows:
+                    found[row[0]] = self._row_to_info(*row)
+        return found
+
+    def insert_many(self, keys: Iterable[str], status: str) -> List[str]:
+        """Thêm các key chưa có trong một transaction; trả về các key đã được thêm (bỏ qua key trùng)."""
+        keys = [key for key in dict.fromkeys(keys) if key]
+        existing = self.get_many(keys)
+        new_keys = [key for key in keys if key not in existing]
+        if not new_keys:
+            return []
+        now = time.time()
+        with self.lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO api_keys (key, status, tiers, created_at, updated_at) VALUES (?, ?, NULL, ?, ?)",
+                [(key, status, now, now) for key in new_keys]
+            )
+        return new_keys
+
+    def delete_many(self, keys: Iterable[str]) -> List[str]:
+        """Xóa các key trong một transaction; trả về các key thực sự bị xóa."""
+        existing = list(self.get_many(keys))
+        if not existing:
+            return []
+        with self.lock, self._conn:
+            self._conn.executemany("DELETE FROM api_keys WHERE key = ?", [(key,) for key in existing])
+        return existing
+
+    def update_status_many(self, keys: Iterable[str], status: str) -> List[str]:
+        """Cập nhật trạng thái các key trong một transaction; trả về các key tồn tại (đã được cập nhật)."""
+        existing = list(self.get_many(keys))
+        if not existing:
+            return []
+        now = time.time()
+        with self.lock, self._conn:
+            self._conn.executemany(
+                "UPDATE api_keys SET status = ?, updated_at = ? WHERE key = ?", [(status, now, key) for key in existing]
+            )
+        return existing
@@ -1,54 +1,52 @@
 from typing import List, Dict, Any, Optional
-import google.generativeai as genai
-from backend.services.api_key_manager import api_key_manager
-import json
+from pydantic import BaseModel, Field
+from backend.core.config import settings
+from backend.services import hashtag_engine, llm_client
+from backend.services.hashtag_engine import hashtag_cache
+from backend.services.postal_gazetteer import postal_gazetteer
 import asyncio
+from backend.core.log import get_logger
 
-async def get_model():
-    """
-    Configures and returns a new instance of the GenerativeModel asynchronously.
-    """
-    try:
-        api_key = await api_key_manager.get_next_key_async()
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        return model
-    except (ValueError, FileNotFoundError) as e:
-        print(f"Error configuring Generative AI: {e}")
-        return None
+logger = get_logger(__name__)
+
+# --- Pydantic Models for Structured Output ---
+class BasicInfo(BaseModel):
+    """Completed basic information of a business profile."""
+    name: Optional[str] = Field(default=None, description="Business or entity name.")
+    address: Optional[str] = Field(default=None, description="Full postal address.")
+    hotline: Optional[str] = Field(default=None, description="Contact phone number.")
+    zipcode: Optional[str] = Field(default=None, description="Postal code of the address.")
+    username: Optional[str] = Field(default=None, description="Single word username without spaces or special characters.")
+
+class BioEntities(BaseModel):
+    """A list of bio paragraphs."""
+    bioEntities: List[str] = Field(description="The generated bio paragraphs.")
 
 async def generate_basic_info(state: Dict[str, Any]) -> Dict[str, Any]:
     """
     Generates missing basic information using an LLM. (Async version)
-    If address is provided, it also generates the corresponding zipcode.
+    If address is provided, its province-level postal code from the local gazetteer is passed to the LLM as a hint
+    (the bundled data has no district/ward codes, so the LLM still resolves the exact zipcode).
     """
-    model = await get_model()
-    if not model:
-        raise RuntimeError("Generative AI model could not be configured.")
-
     required_fields = ["username", "name", "address", "hotline", "zipcode"]
-    missing_fields = [field for field in required_fields if not state.get(field)]
-
-    if not missing_fields and "address" not in missing_fields:
-        return state # No generation needed if all fields are present
 
     # Special handling for username based on website
-    if "username" in missing_fields and state.get("website"):
+    if not state.get("username") and state.get("website"):
         try:
             domain = state["website"].split('//')[-1].split('/')[0]
             username = domain.split('.')[0].replace('-', '').replace('.', '')
             state["username"] = username
-            missing_fields.remove("username")
         except Exception:
             pass # If parsing fails, let the LLM handle it
 
-    if not missing_fields:
-         # If only zipcode was missing but address is present
-        if not state.get("zipcode") and state.get("address"):
-            pass
-        else:
-            return state
+    # Mã bưu chính cấp tỉnh của địa chỉ đã có chỉ đủ để gợi ý cho LLM
+    province_hint = None
+    if not state.get("zipcode") and state.get("address"):
+        province_hint = postal_gazetteer.lookup(state["address"])
 
+    missing_fields = [field for field in required_fields if not state.get(field)]
+    if not missing_fields:
+        return state # No generation needed if all fields are present
 
     language = state.get("language", "Vietnamese")
     prompt_parts = [
@@ -63,6 +61,10 @@ async def generate_basic_info(state: Dict[str, Any]) -> Dict[str, Any]:
         f"- Hotline: {state.get('hotline', 'Missing')}",
         f"- Zipcode: {state.get('zipcode', 'Missing')}",
         f"- Username: {state.get('username', 'Missing')}",
+    ]
+    if province_hint:
+        prompt_parts.append(f"Postal code of the province ({province_hint['province']}): {province_hint['postal_code']}")
+    prompt_parts += [
         "\nInstructions:",
         "1. Generate plausible information for all 'Missing' fields.",
         "2. If the Address is provided but the Zipcode is missing, find the correct zipcode for that address.",
@@ -75,8 +77,8 @@ async def generate_basic_info(state: Dict[str, Any]) -> Dict[str, Any]:
     prompt = "\n".join(prompt_parts)
 
     try:
-        response = await model.generate_content_async(prompt)
-        generated_data = json.loads(response.text.strip())
+        result = await llm_client.generate_json(prompt, BasicInfo, task="basic_info", caller="generate_basic_info")
+        generated_data = result.model_dump(exclude_none=True)
         
         # Update state with generated data, only if the original was missing
         for key, value in generated_data.items():
@@ -84,7 +86,7 @@ async def generate_basic_info(state: Dict[str, Any]) -> Dict[str, Any]:
                 state[key] = value
 
     except Exception as e:
-        print(f"Error during LLM call for basic info: {e}")
+        logger.error(f"Error during LLM call for basic info: {e}")
         # Fallback for critical fields if LLM fails
         if not state.get("name"): state["name"] = state.get("keyword", "Default Name")
         if not state.get("username"): state["username"] = "defaultuser"
@@ -95,44 +97,61 @@ async def generate_basic_info(state: Dict[str, Any]) -> Dict[str, Any]:
     return state
 
 async def generate_hashtags(state: Dict[str, Any]) -> Dict[str, Any]:
-    """Generates a string of relevant hashtags using an LLM. (Async version)"""
-    model = await get_model()
-    if not model:
-        raise RuntimeError("Generative AI model could not be configured.")
-
-    language = state.get("language", "Vietnamese")
-    prompt_parts = [
-        "You are a social media marketing expert.",
-        "Based on the following business profile, generate a list of 15 relevant and effective hashtags for social media.",
-        f"Main Keyword: {state.get('main_keyword') or state.get('keyword')}",
-        f"Name: {state.get('name')}",
-        f"Website: {state.get('website')}",
-        f"Description: {state.get('short_description', 'N/A')}",
-        "\nInstructions:",
-        f"1. The hashtags should be in {language} but written without accent marks (if applicable).",
-        "2. Each hashtag must follow PascalCase format (e.g., #MonNgonVietNam, #AmThucDuongPho).",
-        "3. They should be relevant to the main keyword and business.",
-        "4. Create a mix of popular and niche hashtags.",
-        "5. Return the result as a single string, with each hashtag starting with '#' and separated by a space."
-    ]
-
-    prompt = "\n".join(prompt_parts)
-
-    try:
-        response = await model.generate_content_async(prompt)
-        state["hashtag"] = response.text.strip()
-    except Exception as e:
-        print(f"Error during LLM call for hashtags: {e}")
-        state["hashtag"] = f"#{state.get('keyword', 'general').replace(' ', '')}"
+    """
+    Generates a string of relevant hashtags. (Async version)
+    Most tags are produced locally and deterministically (hashtag_engine); the LLM only adds a few niche tags.
+    Results are cached per profile.
+    """
+    cache_key = hashtag_cache.key(state)
+    cached = hashtag_cache.get(cache_key)
+    if cached is not None:
+        state["hashtag"] = cached
+        return state
+
+    local_tags = hashtag_engine.local_hashtags(state)
+    # LLM bù phần còn thiếu để đủ HASHTAG_TOTAL, ít nhất HASHTAG_LLM_NICHE_COUNT hashtag (0 = chỉ dùng hashtag cục bộ)
+    niche_count = 0
+    if settings.HASHTAG_LLM_NICHE_COUNT > 0:
+        niche_count = min(max(settings.HASHTAG_LLM_NICHE_COUNT, settings.HASHTAG_TOTAL - len(local_tags)), settings.HASHTAG_TOTAL)
+    niche_tags = []
+    if niche_count > 0:
+        language = state.get("language", "Vietnamese")
+        prompt_parts = [
+            "You are a social media marketing expert.",
+            f"Based on the following business profile, suggest {niche_count} niche hashtags for social media.",
+            f"Main Keyword: {state.get('main_keyword') or state.get('keyword')}",
+            f"Name: {state.get('name')}",
+            f"Website: {state.get('website')}",
+            f"Description: {state.get('short_description', 'N/A')}",
+            f"Hashtags already chosen (do not repeat them): {' '.join(local_tags)}",
+            "\nInstructions:",
+            f"1. The hashtags should be in {language} but written without accent marks (if applicable).",
+            "2. Each hashtag must follow PascalCase format (e.g., #MonNgonVietNam, #AmThucDuongPho).",
+            "3. Focus on specific niche topics, audiences, or use cases related to the business, not generic terms.",
+            "4. Return the result as a single string, with each hashtag starting with '#' and separated by a space."
+        ]
+
+        prompt = "\n".join(prompt_parts)
 
+        try:
+            response_text = await llm_client.generate_text(prompt, task="hashtags", caller="generate_hashtags")
+            niche_tags = hashtag_engine.normalize_hashtags(response_text)[:niche_count]
+        except Exception as e:
+            # Vẫn trả về các hashtag sinh cục bộ
+            logger.error(f"Error during LLM call for hashtags: {e}")
+
+    # Hashtag cục bộ chiếm phần còn lại sau khi dành chỗ cho hashtag ngách
+    tags = hashtag_engine.merge_hashtags(local_tags[:settings.HASHTAG_TOTAL - len(niche_tags)], niche_tags, local_tags)
+    if not tags:
+        tags = [f"#{state.get('keyword', 'general').replace(' ', '')}"]
+    state["hashtag"] = " ".join(tags)
+    # Chỉ cache khi LLM đã bổ sung (hoặc không cần bổ sung), để lỗi tạm thời không bị cache lại
+    if niche_tags or niche_count == 0:
+        hashtag_cache.put(cache_key, state["hashtag"])
     return state
 
 async def generate_bio_entities(state: Dict[str, Any]) -> Dict[str, Any]:
     """Generates a list of bio entity strings using an LLM. (Async version)"""
-    model = await get_model()
-    if not model:
-        raise RuntimeError("Generative AI model could not be configured.")
-
     num_entities = state.get("num_bio_entities") or 5 # Default to 5 if not specified
 
     language = state.get("language", "Vietnamese")
@@ -161,17 +180,9 @@ async def generate_bio_entities(state: Dict[str, Any]) -> Dict[str, Any]:
     prompt = "\n".join(prompt_parts)
 
     try:
-        response = await model.generate_content_async(prompt)
-        # Clean the response text before parsing
-        cleaned_text = response.text.strip()
-        if cleaned_text.startswith("```json"):
-            cleaned_text = cleaned_text[7:]
-        if cleaned_text.endswith("```"):
-            cleaned_text = cleaned_text[:-3]
-        
-        data = json.loads(cleaned_text)
-        state["bioEntities"] = data.get("bioEntities", [])
+        result = await llm_client.generate_json(prompt, BioEntities, task="bio_entities", caller="generate_bio_entities")
+        state["bioEntities"] = result.bioEntities
     except Exception as e:
-        print(f"Error during LLM call for bio entities: {e}")
+        logger.error(f"Error during LLM call for bio entities: {e}")
 
     return state
@@ -0,0 +1,150 @@
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Optional
+
+from backend.core.config import settings
+
+# Cho phép bỏ qua cache theo từng request (xem dependency `llm_cache_control` ở processing.py).
+# ContextVar được sao chép sang các task/thread con nên áp dụng cho mọi lệnh gọi LLM trong request.
+llm_cache_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+def normalize_prompt(prompt: str) -> str:
+    """Chuẩn hóa prompt: bỏ khoảng trắng đầu/cuối mỗi dòng (thụt lề của f-string không làm lệch key)."""
+    return "\n".join(line.strip() for line in prompt.strip().splitlines())
+
+def make_cache_key(model_name: str, prompt: str, generation_config: Optional[Dict[str, Any]] = None) -> str:
+    """Key = sha256(model, prompt đã chuẩn hóa, generation config)."""
+    payload = json.dumps(
+        [model_name, normalize_prompt(prompt), generation_config or {}],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def schema_fingerprint(schema: Any) -> str:
+    """Định danh của một schema structured output: tên + hash JSON schema, để key cache đổi khi các trường thay đổi."""
+    digest = hashlib.sha256(json.dumps(schema.model_json_schema(), sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{schema.__name__}:{digest[:16]}"
+
+class LlmResponseCache:
+    """
+    Cache exact-match cho phản hồi LLM, lưu trong SQLite với TTL và giới hạn số bản ghi.
+    Đồng thời thống kê hit/miss theo hàm gọi để theo dõi hiệu quả.
+    Bản ghi hết hạn được dọn định kỳ (mỗi `purge_interval_seconds`, xem purge_due) để không chiếm chỗ của max_entries.
+    """
+    def __init__(self, db_path: str, ttl_seconds: int, max_entries: int, purge_interval_seconds: float = 3600.0):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.purge_interval_seconds = purge_interval_seconds
+        self._last_purge = time.monotonic()
+        self.lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "bypassed": 0})
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                caller TEXT,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created_at ON llm_cache (created_at)")
+        self._conn.commit()
+
+    def get(self, key: str, caller: str) -> Optional[str]:
+        """Trả về phản hồi đã cache (nếu còn hạn) và ghi nhận hit/miss cho `caller`."""
+        if llm_cache_bypass.get():
+            with self.lock:
+                self._stats[caller]["bypassed"] += 1
+            return None
+
+        now = time.time()
+        with self.lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if row is None:
+                self._stats[caller]["misses"] += 1
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._stats[caller]["hits"] += 1
+            return row[0]
+
+    def set(self, key: str, model_name: str, caller: str, response: str):
+        """Lưu phản hồi và loại bỏ các bản ghi ít được dùng nhất nếu vượt giới hạn."""
+        if not response:
+            return
+        now = time.time()
+        with self.lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, caller, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, caller, response, now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def purge_due(self) -> bool:
+        return time.monotonic() - self._last_purge >= self.purge_interval_seconds
+
+    def purge_expired(self) -> int:
+        """Xóa các bản ghi đã hết hạn, trả về số bản ghi bị xóa."""
+        with self.lock:
+            self._last_purge = time.monotonic()
+            cursor = self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê hit rate theo hàm gọi và tổng số bản ghi hiện có."""
+        with self.lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            callers = {}
+            for caller, counts in self._stats.items():
+                lookups = counts["hits"] + counts["misses"]
+                callers[caller] = {
+                    **counts,
+                    "hit_rate": round(counts["hits"] / lookups, 4) if lookups else 0.0,
+                }
+        return {"entries": entries, "max_entries": self.max_entries, "ttl_seconds": self.ttl_seconds, "callers": callers}
+
+# Tạo một instance duy nhất (singleton) để toàn bộ ứng dụng sử dụng
+llm_response_cache = LlmResponseCache(
+    db_path=settings.LLM_CACHE_PATH,
+    ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+    max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+    purge_interval_seconds=settings.LLM_CACHE_PURGE_SECONDS,
+)
@@ -0,0 +1,345 @@
+import asyncio
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Type, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+from langchain_core.exceptions import OutputParserException
+from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel, ValidationError
+
+from backend.core import model_routing
+from backend.core.config import settings
+from backend.core.log import get_logger
+from backend.services.api_key_manager import api_key_manager
+from backend.services.context_cache import SharedPrefixPrompt, context_cache_backend
+from backend.services.json_repair import parse_model
+from backend.services.key_quota import estimate_tokens, key_quota
+from backend.services.llm_cache import llm_response_cache, make_cache_key, schema_fingerprint
+from backend.services.llm_metrics import LlmCallRecord, key_id, llm_metrics, reset_current_record, set_current_record
+from backend.services.model_backends import MODE_LIVE, llm_backend
+
+logger = get_logger(__name__)
+
+# Điểm vào chung cho mọi lệnh gọi Gemini của các service.
+# Mỗi lệnh gọi khai báo `task`; bảng định tuyến (model_routing) quyết định tier, model và hàng đợi key.
+# Cache phản hồi được kiểm tra trước, nên khi cache hit sẽ không tốn lượt key nào.
+
+SchemaT = TypeVar("SchemaT", bound=BaseModel)
+ResultT = TypeVar("ResultT")
+
+# --- Phân loại lỗi cho chính sách retry ---
+# 429: thử lại ngay bằng key khác, key lỗi bị cooldown.
+QUOTA_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+# 401: key bị loại khỏi vòng xoay (đánh dấu invalid), thử lại ngay bằng key khác.
+AUTH_ERRORS = (google_exceptions.Unauthenticated,)
+# 403: có thể do model chưa bật, vùng bị chặn hay API bị tắt cho project, nên key chỉ bị cách ly trong tier;
+# key chỉ bị đánh dấu invalid sau KEY_INVALID_AFTER_FORBIDDEN lần 403 liên tiếp. Thử lại ngay bằng key khác.
+FORBIDDEN_ERRORS = (google_exceptions.PermissionDenied,)
+# 5xx / timeout: chờ theo exponential backoff có jitter rồi thử lại.
+TRANSIENT_ERRORS = (google_exceptions.ServerError, google_exceptions.DeadlineExceeded)
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff với full jitter: random(0, min(max, base * 2^attempt))."""
+    ceiling = min(settings.LLM_BACKOFF_MAX_SECONDS, settings.LLM_BACKOFF_BASE_SECONDS * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+def _classify_error(error: Exception) -> str:
+    if isinstance(error, QUOTA_ERRORS):
+        return "quota"
+    if isinstance(error, AUTH_ERRORS):
+        return "auth"
+    if isinstance(error, FORBIDDEN_ERRORS):
+        return "forbidden"
+    if isinstance(error, TRANSIENT_ERRORS):
+        return "transient"
+    return "error"
+
+async def _with_retry(
+    caller: str,
+    tier: str,
+    call: Callable[[str], Awaitable[ResultT]],
+    preferred_keys: Optional[Callable[[], set]] = None,
+    estimated_tokens: int = 0,
+) -> ResultT:
+    """
+    Thực thi `call(api_key)` với chính sách retry chung cho mọi lệnh gọi LLM.
+    Mỗi lần thử lấy một key mới từ hàng đợi của `tier`, và báo lại kết quả để manager cooldown/loại key lỗi.
+    `preferred_keys` (tùy chọn) trả về tập key nên được ưu tiên ở mỗi lần thử.
+    `estimated_tokens`: số token đầu vào ước tính, để chỉ nhận key còn đủ quota TPM;
+    số token thực tế (nếu phản hồi có usage_metadata) được báo lại sau lệnh gọi.
+    """
+    model_name = model_routing.model_for_tier(tier)
+    last_error: Exception | None = None
+    for attempt in range(settings.LLM_MAX_ATTEMPTS):
+        # Mỗi lần thử được đo riêng: thời gian chờ key, thời gian sinh, token và kết quả
+        record = LlmCallRecord(caller, model_name)
+        wait_started = time.perf_counter()
+        api_key, quota_usage = await api_key_manager.acquire_key(
+            tier, preferred_keys=preferred_keys() if preferred_keys else None, tokens=estimated_tokens
+        )
+        record.key_wait_seconds = time.perf_counter() - wait_started
+        record.key_id = key_id(api_key)
+        token = set_current_record(record)
+        call_started = time.perf_counter()
+        error: Exception | None = None
+        try:
+            result = await call(api_key)
+        except Exception as e:
+            error = e
+        finally:
+            record.latency_seconds = time.perf_counter() - call_started
+            reset_current_record(token)
+
+        if error is None:
+            await _record_call(record)
+            # Với streaming, token chỉ có khi stream kết thúc nên lượt dùng giữ số token ước tính
+            api_key_manager.report_success(api_key, tier, usage=quota_usage, input_tokens=record.input_tokens)
+            return result
+
+        record.outcome = _classify_error(error)
+        await _record_call(record)
+
+        last_error = error
+        if record.outcome == "quota":
+            logger.warning(f"Quota error, retrying with another key: {error}", extra={"fields": {"caller": caller, "attempt": attempt + 1, "key_id": record.key_id}})
+            await api_key_manager.report_quota_error(api_key, tier, error=error, usage=quota_usage)
+        elif record.outcome == "auth":
+            logger.warning(f"Key rejected, retrying with another key: {error}", extra={"fields": {"caller": caller, "attempt": attempt + 1, "key_id": record.key_id}})
+            await api_key_manager.report_invalid_key(api_key)
+        elif record.outcome == "forbidden":
+            logger.warning(f"Key forbidden, retrying with another key: {error}", extra={"fields": {"caller": caller, "attempt": attempt + 1, "key_id": record.key_id}})
+            await api_key_manager.report_forbidden(api_key, tier, usage=quota_usage)
+        elif record.outcome == "transient":
+            delay = _backoff_delay(attempt)
+            logger.warning(f"Transient error, retrying in {delay:.1f}s: {error}", extra={"fields": {"caller": caller, "attempt": attempt + 1, "key_id": record.key_id}})
+            await asyncio.sleep(delay)
+        else:
+            raise error
+    raise last_error
+
+async def _record_call(record: LlmCallRecord):
+    if llm_metrics.record(record):
+        await asyncio.to_thread(llm_metrics.flush)
+    if key_quota.flush_due():
+        await asyncio.to_thread(key_quota.flush)
+    if llm_response_cache.purge_due():
+        await asyncio.to_thread(llm_response_cache.purge_expired)
+
+def _response_cache_enabled() -> bool:
+    # Cache phản hồi chỉ dùng với backend thật: phản hồi giả (replay/synthetic) không được lẫn vào cache
+    # dùng chung với lưu lượng thật, và cache hit không được bỏ qua backend khi ghi/replay cassette hay chạy load test
+    return settings.LLM_CACHE_ENABLED and llm_backend.mode == MODE_LIVE
+
+async def _cache_get(cache_key: str, caller: str) -> Optional[str]:
+    if not _response_cache_enabled():
+        return None
+    return await asyncio.to_thread(llm_response_cache.get, cache_key, caller)
+
+async def _cache_set(cache_key: str, model_name: str, caller: str, response: str):
+    if not _response_cache_enabled():
+        return
+    await asyncio.to_thread(llm_response_cache.set, cache_key, model_name, caller, response)
+
+def _validate_cached(cached: Optional[str], schema: Type[SchemaT]) -> Optional[SchemaT]:
+    """Kết quả structured output từ cache; bản ghi không còn hợp lệ với schema hiện tại được coi là cache miss."""
+    if cached is None:
+        return None
+    try:
+        return schema.model_validate_json(cached)
+    except ValueError:
+        return None
+
+async def generate_text(
+    prompt: str,
+    *,
+    task: str,
+    caller: str,
+    generation_config: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Gửi prompt tới Gemini và trả về text của phản hồi.
+
+    Args:
+        prompt: Nội dung prompt.
+        task: Tên tác vụ trong bảng định tuyến (LLM_TASK_TIERS), quyết định model và hàng đợi key.
+        caller: Tên hàm gọi, dùng để thống kê hit rate của cache.
+        generation_config: Cấu hình sinh (temperature, response_mime_type, ...), cũng là một phần của cache key.
+    """
+    tier = model_routing.tier_for_task(task)
+    model_name = model_routing.model_for_tier(tier)
+    cache_key = make_cache_key(model_name, prompt, generation_config)
+    cached = await _cache_get(cache_key, caller)
+    if cached is not None:
+        return cached
+
+    async def call(api_key: str) -> str:
+        return await llm_backend.generate(api_key, model_name, prompt, generation_config)
+
+    text = await _with_retry(caller, tier, call, estimated_tokens=estimate_tokens(prompt))
+
+    await _cache_set(cache_key, model_name, caller, text)
+    return text
+
+async def generate_text_with_prefix(
+    prompt: SharedPrefixPrompt,
+    *,
+    task: str,
+    caller: str,
+    generation_config: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Giống generate_text nhưng prompt gồm một tiền tố dùng chung (ví dụ content brief) và phần riêng của lệnh gọi.
+
+    Khi context caching được bật, tiền tố được lưu thành cached content một lần cho mỗi key
+    và các lệnh gọi sau chỉ gửi phần riêng; key đã giữ cache của tiền tố được ưu tiên.
+    Nếu không tạo được cache (tiền tố quá ngắn, provider từ chối, cache hết hạn) thì gửi prompt đầy đủ.
+    Cache phản hồi dùng prompt đầy đủ làm khóa, nên kết quả dùng chung với generate_text.
+    """
+    backend = context_cache_backend
+    # Context caching chỉ dùng với backend thật; record/replay làm việc trên prompt đầy đủ
+    if backend is None or not backend.supports(prompt) or llm_backend.mode != MODE_LIVE:
+        return await generate_text(prompt.text, task=task, caller=caller, generation_config=generation_config)
+
+    tier = model_routing.tier_for_task(task)
+    model_name = model_routing.model_for_tier(tier)
+    full_prompt = prompt.text
+    cache_key = make_cache_key(model_name, full_prompt, generation_config)
+    # Backend giả lập (chỉ dùng cho kiểm thử) không được đọc/ghi cache phản hồi dùng chung với lưu lượng thật
+    cacheable = backend.cacheable_responses
+    cached = await _cache_get(cache_key, caller) if cacheable else None
+    if cached is not None:
+        return cached
+
+    async def call(api_key: str) -> str:
+        handle = await backend.get_or_create(api_key, model_name, prompt)
+        if handle is not None:
+            try:
+                return await backend.generate(api_key, model_name, handle, prompt.suffix, generation_config)
+            except google_exceptions.NotFound:
+                # Cache đã hết hạn/bị xóa phía provider: bỏ handle và gửi prompt đầy đủ
+                backend.invalidate(api_key, model_name, prompt)
+        return await llm_backend.generate(api_key, model_name, full_prompt, generation_config)
+
+    text = await _with_retry(
+        caller, tier, call, preferred_keys=lambda: backend.keys_with_prefix(model_name, prompt),
+        estimated_tokens=estimate_tokens(full_prompt),
+    )
+
+    if cacheable:
+        await _cache_set(cache_key, model_name, caller, text)
+    return text
+
+async def stream_text(
+    prompt: str,
+    *,
+    task: str,
+    caller: str,
+    generation_config: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """
+    Giống generate_text nhưng trả về từng đoạn text ngay khi Gemini sinh ra (streaming generation).
+    Khi cache hit, toàn bộ phản hồi được trả về trong một đoạn duy nhất.
+    Phản hồi chỉ được lưu vào cache khi stream hoàn tất.
+    Chỉ việc mở stream được retry; lỗi sau khi đã gửi đoạn đầu tiên sẽ được ném ra cho nơi gọi.
+    """
+    tier = model_routing.tier_for_task(task)
+    model_name = model_routing.model_for_tier(tier)
+    cache_key = make_cache_key(model_name, prompt, generation_config)
+    cached = await _cache_get(cache_key, caller)
+    if cached is not None:
+        yield cached
+        return
+
+    stream_key = None
+
+    async def call(api_key: str):
+        nonlocal stream_key
+        stream_key = api_key
+        return await llm_backend.open_stream(api_key, model_name, prompt, generation_config)
+
+    chunks = await _with_retry(caller, tier, call, estimated_tokens=estimate_tokens(prompt))
+    parts = []
+    async for chunk in chunks:
+        if chunk.text:
+            parts.append(chunk.text)
+            yield chunk.text
+        if chunk.output_tokens is not None:
+            # Lần gọi đã được đo khi mở stream; token chỉ có ở đoạn cuối nên được cộng riêng
+            llm_metrics.add_tokens(caller, model_name, stream_key, chunk.input_tokens, chunk.output_tokens)
+
+    await _cache_set(cache_key, model_name, caller, "".join(parts))
+
+async def invoke_structured(
+    prompt: ChatPromptTemplate,
+    inputs: Dict[str, Any],
+    schema: Type[SchemaT],
+    *,
+    task: str,
+    caller: str,
+) -> SchemaT:
+    """
+    Chạy prompt LangChain với `llm.with_structured_output(schema)` (tương đương chain `prompt | llm...`)
+    và trả về instance của `schema`.
+    Kết quả được cache dưới dạng JSON của schema.
+    """
+    tier = model_routing.tier_for_task(task)
+    model_name = model_routing.model_for_tier(tier)
+    rendered_prompt = prompt.format(**inputs)
+    cache_key = make_cache_key(model_name, rendered_prompt, {"structured_output": schema_fingerprint(schema)})
+    cached = _validate_cached(await _cache_get(cache_key, caller), schema)
+    if cached is not None:
+        return cached
+
+    messages = prompt.format_messages(**inputs)
+
+    async def call(api_key: str) -> SchemaT:
+        return await llm_backend.structured(api_key, model_name, messages, schema)
+
+    result = await _with_retry(caller, tier, call, estimated_tokens=estimate_tokens(rendered_prompt))
+
+    await _cache_set(cache_key, model_name, caller, result.model_dump_json())
+    return result
+
+async def generate_json(
+    prompt: str,
+    schema: Type[SchemaT],
+    *,
+    task: str,
+    caller: str,
+) -> SchemaT:
+    """
+    Gửi một prompt dạng text và nhận về kết quả có cấu trúc theo `schema`.
+
+    Ưu tiên structured output (ràng buộc theo schema) như generate_seo_ideas.
+    Nếu phản hồi structured không parse được, gửi lại ở chế độ JSON (response_mime_type)
+    và dùng lớp trích xuất/sửa JSON (json_repair) để cứu kết quả thay vì làm hỏng workflow.
+    """
+    tier = model_routing.tier_for_task(task)
+    model_name = model_routing.model_for_tier(tier)
+    cache_key = make_cache_key(model_name, prompt, {"structured_output": schema_fingerprint(schema)})
+    cached = _validate_cached(await _cache_get(cache_key, caller), schema)
+    if cached is not None:
+        return cached
+
+    async def call_structured(api_key: str) -> SchemaT | None:
+        return await llm_backend.structured(api_key, model_name, prompt, schema)
+
+    result = None
+    try:
+        result = await _with_retry(caller, tier, call_structured, estimated_tokens=estimate_tokens(prompt))
+    except (OutputParserException, ValidationError) as e:
+        logger.warning(f"Structured output could not be parsed, falling back to JSON mode: {e}", extra={"fields": {"caller": caller}})
+
+    if result is None:
+        async def call_json_mode(api_key: str) -> str:
+            return await llm_backend.generate(
+                api_key, model_name, prompt, {"response_mime_type": "application/json"}
+            )
+
+        result = parse_model(
+            await _with_retry(caller, tier, call_json_mode, estimated_tokens=estimate_tokens(prompt)), schema
+        )
+
+    await _cache_set(cache_key, model_name, caller, result.model_dump_json())
+    return result
@@ -0,0 +1,217 @@
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict, Optional
+
+from backend.core.config import settings
+
+# Đo lường từng lệnh gọi LLM: thời gian chờ key, thời gian sinh, token vào/ra và kết quả.
+# Mỗi lần thử (attempt) trong llm_client._with_retry là một bản ghi; bản ghi được gộp (rollup)
+# theo giờ/hàm gọi/model/key/kết quả trong bộ nhớ và định kỳ ghi xuống SQLite.
+
+def key_id(api_key: str) -> str:
+    """Định danh key đã che, giống định dạng trong log của api_key_manager."""
+    return f"...{api_key[-4:]}" if api_key else "none"
+
+class LlmCallRecord:
+    """Số liệu của một lần gọi Gemini. Hàm `call` trong llm_client điền token qua `record_usage`."""
+    def __init__(self, caller: str, model: str):
+        self.caller = caller
+        self.model = model
+        self.key_id = "none"
+        self.key_wait_seconds = 0.0
+        self.latency_seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.outcome = "ok"
+
+# Bản ghi của lần thử đang chạy trong task hiện tại
+_current_record: contextvars.ContextVar[Optional[LlmCallRecord]] = contextvars.ContextVar("llm_call_record", default=None)
+
+def set_current_record(record: Optional[LlmCallRecord]) -> contextvars.Token:
+    return _current_record.set(record)
+
+def reset_current_record(token: contextvars.Token):
+    _current_record.reset(token)
+
+def record_usage(input_tokens: Optional[int], output_tokens: Optional[int]):
+    """Ghi số token của lần gọi hiện tại (bỏ qua nếu không nằm trong một lần gọi được đo)."""
+    record = _current_record.get()
+    if record is not None:
+        record.input_tokens += input_tokens or 0
+        record.output_tokens += output_tokens or 0
+
+def record_response_usage(response: Any):
+    """Đọc usage_metadata từ phản hồi google.generativeai / glm."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        record_usage(getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0))
+
+def record_message_usage(message: Any):
+    """Đọc usage_metadata từ AIMessage của LangChain."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    record_usage(usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+
+class LlmMetrics:
+    """
+    Gộp số liệu lệnh gọi LLM theo giờ và lưu xuống SQLite để lập kế hoạch dung lượng (capacity planning).
+    Ngoài ra giữ một cửa sổ các lần gọi gần nhất theo từng hàm gọi để tính p50/p95.
+    """
+    _FIELDS = ("calls", "key_wait_seconds", "latency_seconds", "latency_max_seconds", "input_tokens", "output_tokens")
+
+    def __init__(self, db_path: str, flush_interval_seconds: float, window_size: int):
+        self.db_path = db_path
+        self.flush_interval_seconds = flush_interval_seconds
+        self.lock = threading.Lock()
+        # (bucket, caller, model, key_id, outcome) -> tổng chưa ghi xuống DB
+        self._pending: Dict[tuple, Dict[str, float]] = defaultdict(lambda: dict.fromkeys(self._FIELDS, 0))
+        self._recent: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window_size))
+        self._last_flush = time.monotonic()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_call_rollups (
+                bucket TEXT NOT NULL,
+                caller TEXT NOT NULL,
+                model TEXT NOT NULL,
+                key_id TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                calls INTEGER NOT NULL DEFAULT 0,
+                key_wait_seconds REAL NOT NULL DEFAULT 0,
+                latency_seconds REAL NOT NULL DEFAULT 0,
+                latency_max_seconds REAL NOT NULL DEFAULT 0,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (bucket, caller, model, key_id, outcome)
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _bucket() -> str:
+        return time.strftime("%Y-%m-%dT%H:00", time.gmtime())
+
+    def record(self, record: LlmCallRecord) -> bool:
+        """
+        Cộng một lần gọi vào rollup của giờ hiện tại.
+        Trả về True nếu đã tới hạn flush; nơi gọi sẽ chạy `flush` ngoài event loop.
+        """
+        bucket = self._bucket()
+        with self.lock:
+            totals = self._pending[(bucket, record.caller, record.model, record.key_id, record.outcome)]
+            totals["calls"] += 1
+            totals["key_wait_seconds"] += record.key_wait_seconds
+            totals["latency_seconds"] += record.latency_seconds
+            totals["latency_max_seconds"] = max(totals["latency_max_seconds"], record.latency_seconds)
+            totals["input_tokens"] += record.input_tokens
+            totals["output_tokens"] += record.output_tokens
+            self._recent[record.caller].append((record.key_wait_seconds, record.latency_seconds, record.outcome))
+            return time.monotonic() - self._last_flush >= self.flush_interval_seconds
+
+    def add_tokens(self, caller: str, model: str, api_key: str, input_tokens: int, output_tokens: int):
+        """Cộng token vào rollup mà không tính thêm lượt gọi (dùng cho streaming: usage chỉ có khi stream kết thúc)."""
+        with self.lock:
+            totals = self._pending[(self._bucket(), caller, model, key_id(api_key), "ok")]
+            totals["input_tokens"] += input_tokens or 0
+            totals["output_tokens"] += output_tokens or 0
+
+    def flush(self):
+        """Ghi các rollup đang chờ xuống SQLite (cộng dồn vào bản ghi cùng giờ)."""
+        with self.lock:
+            pending, self._pending = self._pending, defaultdict(lambda: dict.fromkeys(self._FIELDS, 0))
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            self._conn.executemany(
+                """
+                INSERT INTO llm_call_rollups (bucket, caller, model, key_id, outcome, calls, key_wait_seconds,
+                                              latency_seconds, latency_max_seconds, input_tokens, output_tokens)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (bucket, caller, model, key_id, outcome) DO UPDATE SET
+                    calls = calls + excluded.calls,
+                    key_wait_seconds = key_wait_seconds + excluded.key_wait_seconds,
+                    latency_seconds = latency_seconds + excluded.latency_seconds,
+                    latency_max_seconds = MAX(latency_max_seconds, excluded.latency_max_seconds),
+                    input_tokens = input_tokens + excluded.input_tokens,
+                    output_tokens = output_tokens + excluded.output_tokens
+                """,
+                [key + tuple(totals[field] for field in self._FIELDS) for key, totals in pending.items()]
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _percentile(values, fraction: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 4)
+
+    def get_metrics(self, hours: int = 24) -> Dict[str, Any]:
+        """
+        Tổng hợp số liệu `hours` giờ gần nhất theo hàm gọi, model và key,
+        kèm p50/p95 của thời gian chờ key và thời gian sinh trên cửa sổ gần nhất.
+        """
+        self.flush()
+        since = time.strftime("%Y-%m-%dT%H:00", time.gmtime(time.time() - hours * 3600))
+        with self.lock:
+            rows = self._conn.execute(
+                "SELECT caller, model, key_id, outcome, calls, key_wait_seconds, latency_seconds, "
+                "latency_max_seconds, input_tokens, output_tokens FROM llm_call_rollups WHERE bucket >= ?",
+                (since,)
+            ).fetchall()
+            recent = {caller: list(window) for caller, window in self._recent.items()}
+
+        def empty():
+            return {"calls": 0, "errors": 0, "key_wait_seconds": 0.0, "latency_seconds": 0.0,
+                    "latency_max_seconds": 0.0, "input_tokens": 0, "output_tokens": 0}
+
+        groups = {"callers": defaultdict(empty), "models": defaultdict(empty), "keys": defaultdict(empty)}
+        outcomes: Dict[str, int] = defaultdict(int)
+        for caller, model, key, outcome, calls, wait, latency, latency_max, tokens_in, tokens_out in rows:
+            outcomes[outcome] += calls
+            for group, name in (("callers", caller), ("models", model), ("keys", key)):
+                totals = groups[group][name]
+                totals["calls"] += calls
+                if outcome != "ok":
+                    totals["errors"] += calls
+                totals["key_wait_seconds"] += wait
+                totals["latency_seconds"] += latency
+                totals["latency_max_seconds"] = max(totals["latency_max_seconds"], latency_max)
+                totals["input_tokens"] += tokens_in
+                totals["output_tokens"] += tokens_out
+
+        for by_name in groups.values():
+            for totals in by_name.values():
+                calls = totals["calls"] or 1
+                totals["avg_key_wait_seconds"] = round(totals["key_wait_seconds"] / calls, 4)
+                totals["avg_latency_seconds"] = round(totals["latency_seconds"] / calls, 4)
+                totals["key_wait_seconds"] = round(totals["key_wait_seconds"], 4)
+                totals["latency_seconds"] = round(totals["latency_seconds"], 4)
+
+        for caller, window in recent.items():
+            totals = groups["callers"][caller]
+            totals["recent"] = {
+                "samples": len(window),
+                "key_wait_p50": self._percentile([w for w, _, _ in window], 0.5),
+                "key_wait_p95": self._percentile([w for w, _, _ in window], 0.95),
+                "latency_p50": self._percentile([l for _, l, _ in window], 0.5),
+                "latency_p95": self._percentile([l for _, l, _ in window], 0.95),
+            }
+
+        return {"hours": hours, "outcomes": dict(outcomes), **{name: dict(by_name) for name, by_name in groups.items()}}
+
+# Tạo một instance duy nhất (singleton) để toàn bộ ứng dụng sử dụng
+llm_metrics = LlmMetrics(
+    db_path=settings.LLM_METRICS_PATH,
+    flush_interval_seconds=settings.LLM_METRICS_FLUSH_SECONDS,
+    window_size=settings.LLM_METRICS_WINDOW_SIZE,
+)
@@ -1,7 +1,18 @@
-import google.generativeai as genai
-import json
-from backend.services.api_key_manager import api_key_manager
+from typing import AsyncIterator, List
+from pydantic import BaseModel, Field
+from backend.core.config import settings
+from backend.services import llm_client, text_stats
+from backend.services.key_scheduler import KeyQuotaExhaustedError
 import asyncio
+import re
+from backend.core.log import get_logger, log_payload
+
+logger = get_logger(__name__)
+
+# --- Pydantic Model for Structured Output ---
+class ContextInsights(BaseModel):
+    """Actionable insights from the LLM context analysis."""
+    insights: List[str] = Field(description="One-sentence actionable insights, each starting with 'Actionable Insight:'.")
 
 async def analyze_context_with_llm(content: str, main_topic: str, search_intent: str) -> list[str]:
     """
@@ -16,7 +27,7 @@ async def analyze_context_with_llm(content: str, main_topic: str, search_intent:
         "You are an expert SEO analyst. Your task is to analyze the provided article against the user's stated goals. Do not rewrite the article. Only provide your analysis.",
         f"Here is the full article:\n---\n{content}\n---\n",
         "Based on the article, please answer the following questions concisely. For each question, provide a one-sentence 'Actionable Insight' that can be used to instruct a writer.",
-        "Your response MUST be a valid JSON array of strings, where each string is an actionable insight. For example: [\"Actionable Insight: The main topic 'X' is not central. The content should emphasize it more.\", \"Actionable Insight: The search intent is 'comparison', but the article only discusses one product. It should compare at least two.\"]"
+        "Your response MUST be a valid JSON object with key 'insights' holding an array of strings, where each string is an actionable insight. For example: {\"insights\": [\"Actionable Insight: The main topic 'X' is not central. The content should emphasize it more.\", \"Actionable Insight: The search intent is 'comparison', but the article only discusses one product. It should compare at least two.\"]}"
     ]
 
     if main_topic:
@@ -31,57 +42,70 @@ async def analyze_context_with_llm(content: str, main_topic: str, search_intent:
 
     final_prompt = "\n".join(prompt_parts)
 
-    print("--- CONTEXT ANALYSIS PROMPT SENT TO GEMINI ---")
-    print(final_prompt)
-    print("----------------------------------------------")
+    log_payload(logger, "Context analysis prompt", final_prompt, caller="analyze_context_with_llm")
 
-    # --- Sử dụng ApiKeyManager để lấy key và cấu hình ---
+    # --- Gọi Gemini qua llm_client (structured output, có lớp sửa JSON dự phòng) ---
     try:
-        api_key = await api_key_manager.get_next_key_async()
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        response = await model.generate_content_async(final_prompt)
-        
-        # Cố gắng parse chuỗi JSON từ phản hồi.
-        # LLM có thể trả về chuỗi JSON nằm trong ```json ... ```, nên cần làm sạch.
-        cleaned_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        insights = json.loads(cleaned_text)
-        
-        if isinstance(insights, list):
-            return insights
-        else:
-            # Fallback nếu LLM không trả về cấu trúc list như mong đợi.
-            return ["Error: LLM analysis did not return a valid list structure."]
+        result = await llm_client.generate_json(
+            final_prompt, ContextInsights, task="context_analysis", caller="analyze_context_with_llm"
+        )
+        return result.insights
 
     except Exception as e:
-        print(f"An error occurred during LLM context analysis: {e}")
-        # Fallback nếu có lỗi (ví dụ: JSON không hợp lệ hoặc lỗi API).
-        raw_response = response.text if 'response' in locals() else 'N/A'
-        return [f"Could not perform LLM context analysis. Raw response: {raw_response}"]
+        logger.error(f"An error occurred during LLM context analysis: {e}")
+        # Fallback nếu có lỗi (ví dụ: JSON không thể sửa được hoặc lỗi API).
+        return [f"Could not perform LLM context analysis. Details: {e}"]
 
 
 def _generate_syntax_instructions(content: str) -> list[str]:
     """
-    Tạo ra các chỉ dẫn biên tập dựa trên phân tích cú pháp đơn giản (độ dài câu).
+    Tạo ra các chỉ dẫn biên tập dựa trên chỉ số dễ đọc (text_stats): tỷ lệ câu dài và độ dài câu trung bình.
     Mục tiêu: Cải thiện độ dễ đọc của văn bản.
-    Hàm này giờ hoạt động trực tiếp trên nội dung gốc, không cần kết quả từ NLP API.
     """
     instructions = []
-    
-    # Tách văn bản thành các câu.
-    sentences = content.split('.')
-    
-    # Tìm các câu được coi là "dài" (ví dụ: hơn 25 từ).
-    long_sentences = [s for s in sentences if len(s.split()) > 25]
-    
+    stats = text_stats.readability(content)
+
     # Nếu có nhiều hơn 2 câu dài, tạo một chỉ dẫn yêu cầu làm cho câu ngắn gọn hơn.
-    if len(long_sentences) > 2:
+    if stats["long_sentences"] > 2:
         instructions.append(
-            "Readability Improvement: The text contains several long sentences (over 25 words). "
+            f"Readability Improvement: {stats['long_sentences']} of {stats['sentences']} sentences are long "
+            f"(over {text_stats.LONG_SENTENCE_WORDS} words; average {stats['words_per_sentence']} words per sentence). "
             "Break them down into shorter, clearer sentences to improve readability."
         )
     return instructions
 
+def _generate_structure_instructions(content: str) -> list[str]:
+    """
+    Tạo ra các chỉ dẫn biên tập dựa trên cấu trúc heading của bài viết.
+    Mục tiêu: Cấu trúc rõ ràng, đúng thứ bậc H1 > H2 > H3 cho người đọc và công cụ tìm kiếm.
+    """
+    instructions = []
+    structure = text_stats.heading_structure(content)
+
+    if not structure["headings"] and len(text_stats.tokenize_words(content)) > 300:
+        instructions.append(
+            "Structure: The article has no headings. Organize it into logical sections with descriptive H2/H3 headings."
+        )
+    if "multiple_h1" in structure["issues"]:
+        instructions.append("Structure: The article has more than one H1. Keep a single H1 and demote the others.")
+    if any(issue.startswith("skipped_level") for issue in structure["issues"]):
+        instructions.append("Structure: Some headings skip levels (e.g., H2 followed by H4). Keep the heading hierarchy sequential.")
+    return instructions
+
+def _generate_keyword_instructions(content: str, main_topic: str = None) -> list[str]:
+    """
+    Tạo ra các chỉ dẫn biên tập dựa trên mật độ từ khóa của chủ đề chính.
+    Mục tiêu: Chủ đề chính xuất hiện đủ nhưng không bị nhồi nhét.
+    """
+    if not main_topic:
+        return []
+    density = text_stats.keyword_density(content, main_topic)
+    if density["occurrences"] == 0:
+        return [f"Keyword Usage: The main topic '{main_topic}' never appears verbatim. Use it naturally in the introduction and at least one heading."]
+    if density["density"] > 0.03:
+        return [f"Keyword Usage: The main topic '{main_topic}' is overused ({density['density']:.1%} of words). Replace some occurrences with synonyms to avoid keyword stuffing."]
+    return []
+
 def _generate_entity_instructions(nlp_analysis: dict, main_topic: str = None) -> list[str]:
     """
     Tạo ra các chỉ dẫn biên tập dựa trên phân tích thực thể.
@@ -93,13 +117,9 @@ def _generate_entity_instructions(nlp_analysis: dict, main_topic: str = None) ->
     if not entities:
         return instructions
 
-    # Tìm các thực thể xuất hiện thường xuyên nhất để xác định chủ đề chính của bài viết.
-    entity_names = [e.get("name", "").lower() for e in entities]
-    entity_counts = {name: entity_names.count(name) for name in set(entity_names)}
-    sorted_entities = sorted(entity_counts.items(), key=lambda item: item[1], reverse=True)
-    
+    # Tìm các thực thể xuất hiện thường xuyên nhất (đếm bằng Counter) để xác định chủ đề chính của bài viết.
     # Lấy 3 thực thể hàng đầu.
-    top_3_entities = [e[0] for e in sorted_entities[:3]]
+    top_3_entities = [name for name, _ in text_stats.entity_frequency(entities, top_n=3)]
 
     instructions.append(
         f"Topical Focus: The main entities detected are: {', '.join(top_3_entities)}. "
@@ -171,59 +191,436 @@ def _generate_category_instructions(nlp_analysis: dict, search_intent: str = Non
     return instructions
 
 
-async def rewrite_content_with_gemini(enriched_data: dict, content: str) -> str:
-    """
-    Sử dụng Google Gemini để viết lại nội dung dựa trên dữ liệu phân tích đã được làm giàu.
-    Đây là "Động cơ Tái cấu trúc" chính.
-    """
-    
-    # --- 1. Xây dựng Prompt Chi tiết ---
-    # "Module Tạo Prompt" sẽ tổng hợp tất cả các phân tích thành một mệnh lệnh lớn cho AI.
+def _build_guidance_parts(enriched_data: dict, content: str) -> list[str]:
+    """Các chỉ dẫn chung rút ra từ phân tích (insights của LLM + chỉ dẫn biên tập từ NLP) cho cả bài viết."""
     nlp_analysis = enriched_data.get("nlp_analysis", {})
-    
-    prompt_parts = [
-        # Đóng vai: Yêu cầu AI hành động như một chuyên gia biên tập SEO.
-        "You are an expert SEO content editor. Your task is to rewrite the following article to significantly improve its quality, readability, and SEO performance.",
-        # Cung cấp nội dung gốc.
-        f"Original Article:\n---\n{content}\n---\n",
-        # Đưa ra yêu cầu chung.
-        "Based on a deep NLP analysis, you MUST apply the following strategic improvements:",
-    ]
+    guidance_parts = []
 
     # Thêm các ghi chú từ logic đối chiếu (quan trọng nhất).
     if enriched_data.get("cross_reference_notes"):
         notes = "\n".join(f"- {note}" for note in enriched_data["cross_reference_notes"])
-        prompt_parts.append(f"\n**High-Priority Actionable Insights:**\n{notes}")
+        guidance_parts.append(f"\n**High-Priority Actionable Insights:**\n{notes}")
 
     # Tạo và thêm các chỉ dẫn chi tiết từ các hàm phân tích.
     all_instructions = []
     all_instructions.extend(_generate_syntax_instructions(content)) # Sửa đổi: Truyền content trực tiếp
-    all_instructions.extend(_generate_entity_instructions(nlp_analysis))
+    all_instructions.extend(_generate_structure_instructions(content))
+    all_instructions.extend(_generate_keyword_instructions(content, enriched_data.get("main_topic")))
+    all_instructions.extend(_generate_entity_instructions(nlp_analysis, enriched_data.get("main_topic")))
     all_instructions.extend(_generate_sentiment_instructions(nlp_analysis))
     all_instructions.extend(_generate_category_instructions(nlp_analysis))
 
     if all_instructions:
         instructions_text = "\n".join(f"- {inst}" for inst in all_instructions)
-        prompt_parts.append(f"\n**Detailed Editorial Guidelines:**\n{instructions_text}")
+        guidance_parts.append(f"\n**Detailed Editorial Guidelines:**\n{instructions_text}")
+    return guidance_parts
+
+def build_rewrite_prompt(enriched_data: dict, content: str) -> str:
+    """
+    "Module Tạo Prompt": tổng hợp tất cả các phân tích thành một mệnh lệnh lớn cho AI.
+    Dùng chung cho chế độ trả về toàn bộ và chế độ streaming.
+    """
+    prompt_parts = [
+        # Đóng vai: Yêu cầu AI hành động như một chuyên gia biên tập SEO.
+        "You are an expert SEO content editor. Your task is to rewrite the following article to significantly improve its quality, readability, and SEO performance.",
+        # Cung cấp nội dung gốc.
+        f"Original Article:\n---\n{content}\n---\n",
+        # Đưa ra yêu cầu chung.
+        "Based on a deep NLP analysis, you MUST apply the following strategic improvements:",
+    ]
+    prompt_parts.extend(_build_guidance_parts(enriched_data, content))
     
     # Lời kêu gọi hành động cuối cùng.
     prompt_parts.append("\nRewrite the entire article now, incorporating all of the above instructions. Do not just list the changes; provide the full, rewritten text.")
     
     # Nối tất cả các phần lại thành prompt cuối cùng.
-    final_prompt = "\n".join(prompt_parts)
+    return "\n".join(prompt_parts)
+
+
+# --- Chế độ viết lại theo từng phần (section-parallel) ---
+_HEADING_RE = re.compile(r"^#{1,6}\s+\S", re.MULTILINE)
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\n(.*)\n```$", re.DOTALL)
+
+def _pack_blocks(blocks: list[str], target_chars: int) -> list[str]:
+    """Gộp các khối liên tiếp thành các phần có độ dài xấp xỉ `target_chars` (không cắt ngang khối)."""
+    sections, current = [], []
+    current_len = 0
+    for block in blocks:
+        if current and current_len + len(block) > target_chars:
+            sections.append("\n\n".join(current))
+            current, current_len = [], 0
+        current.append(block)
+        current_len += len(block)
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
+def _markdown_blocks(content: str) -> list[str]:
+    """
+    Các khối của bài, ngăn cách bởi dòng trống; mỗi dòng heading mở đầu một khối mới.
+    Nội dung trong khối code (giữa hai fence ``` hoặc ~~~) không bao giờ bị tách, kể cả dòng trống hay dòng "# ..." bên trong.
+    """
+    blocks, current = [], []
+    in_fence = False
+    for line in content.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith("```") or stripped.startswith("~~~"):
+            in_fence = not in_fence
+        elif not in_fence and (not stripped or _HEADING_RE.match(stripped)):
+            if current:
+                blocks.append("\n".join(current).strip())
+                current = []
+            if not stripped:
+                continue
+        current.append(line)
+    if current:
+        blocks.append("\n".join(current).strip())
+    return [block for block in blocks if block]
+
+def split_into_sections(content: str, target_chars: int) -> list[str]:
+    """
+    Chia bài viết thành các phần tại ranh giới heading (Markdown) hoặc đoạn văn, không cắt ngang khối code.
+    Mỗi heading mở đầu một nhóm mới; các nhóm nhỏ liền nhau được gộp lại, nhóm quá dài được chia theo đoạn văn.
+    """
+    groups: list[list[str]] = []
+    for block in _markdown_blocks(content.strip()):
+        if not groups or _HEADING_RE.match(block):
+            groups.append([block])
+        else:
+            groups[-1].append(block)
+
+    sections = []
+    for group in groups:
+        text = "\n\n".join(group)
+        if len(text) > target_chars:
+            sections.extend(_pack_blocks(group, target_chars))
+        else:
+            sections.append(text)
+    # Gộp các phần nhỏ liền nhau (ví dụ nhiều heading ngắn) để không tạo quá nhiều lệnh gọi
+    return _pack_blocks(sections, target_chars)
+
+def _build_section_prompt(guidance: str, section: str, index: int, total: int, previous_tail: str, next_head: str) -> str:
+    position = "the opening section" if index == 0 else ("the final section" if index == total - 1 else "a middle section")
+    prompt_parts = [
+        "You are an expert SEO content editor rewriting a long article section by section. Several editors work on the other sections in parallel, so you must rewrite ONLY the section given to you.",
+        "The following guidance applies to the whole article:",
+        guidance,
+        f"\nYou are rewriting section {index + 1} of {total} ({position}).",
+    ]
+    if previous_tail:
+        prompt_parts.append(f"For continuity, the previous section ends with:\n---\n{previous_tail}\n---")
+    if next_head:
+        prompt_parts.append(f"The next section begins with:\n---\n{next_head}\n---")
+    prompt_parts.extend([
+        f"\nSection to rewrite:\n---\n{section}\n---\n",
+        "Rules:",
+        "- Keep the section's headings (same level and meaning); do not add headings from other sections.",
+        "- Do not add an introduction unless this is the opening section, and do not add a conclusion unless this is the final section.",
+        "- Make the first sentence flow naturally from the previous section and the last sentence lead into the next one.",
+        "- Return only the rewritten section text in Markdown, without commentary.",
+    ])
+    return "\n".join(prompt_parts)
+
+def _first_heading(text: str) -> str | None:
+    match = _HEADING_RE.search(text)
+    if match is None:
+        return None
+    return text[match.start():].split("\n", 1)[0].strip()
+
+def _check_section(original: str, rewritten: str, index: int, label: str = "Section") -> tuple[str, str | None]:
+    """
+    Kiểm tra tính liên tục của một phần đã viết lại. Trả về (nội dung dùng để ghép, ghi chú nếu phải sửa).
+    `label`: tên đơn vị trong ghi chú ("Section", "Paragraph").
+    - Bỏ code fence bao ngoài.
+    - Phần trống hoặc ngắn bất thường (nghi bị cắt cụt) được thay bằng bản gốc.
+    - Heading mở đầu của bản gốc bị mất thì được thêm lại.
+    """
+    text = (rewritten or "").strip()
+    fenced = _FENCE_RE.match(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    if len(text) < 0.3 * len(original):
+        return original, f"{label} {index + 1} rewrite looked truncated; the original text was kept."
+
+    heading = _first_heading(original)
+    if original.lstrip().startswith("#") and heading and not text.lstrip().startswith("#"):
+        return f"{heading}\n\n{text}", f"{label} {index + 1} lost its heading; it was restored."
+    return text, None
+
+async def rewrite_content_in_sections(
+    enriched_data: dict, content: str, llm_slots: asyncio.Semaphore | None = None, sections: list[str] | None = None
+) -> tuple[str, list[str]]:
+    """
+    Viết lại bài dài theo từng phần song song: mỗi phần nhận chung bộ chỉ dẫn toàn cục và ngữ cảnh của phần liền kề,
+    sau đó được ghép lại theo thứ tự với các bước kiểm tra liên tục. Thời gian xử lý xấp xỉ thời gian của phần chậm nhất.
+    `llm_slots`: semaphore dùng chung (ví dụ của một batch); mặc định mỗi bài có REWRITE_MAX_CONCURRENT_SECTIONS slot riêng.
+    `sections`: các phần đã chia sẵn của `content` (nếu nơi gọi đã chia để quyết định chế độ).
+    Trả về (nội dung đã ghép, các ghi chú về phần phải sửa/giữ nguyên).
+    """
+    if sections is None:
+        sections = split_into_sections(content, settings.REWRITE_SECTION_TARGET_CHARS)
+    guidance = "\n".join(_build_guidance_parts(enriched_data, content))
+    semaphore = llm_slots or asyncio.Semaphore(settings.REWRITE_MAX_CONCURRENT_SECTIONS)
+    failed_sections = []
+
+    async def rewrite_section(index: int) -> tuple[str, str | None]:
+        section = sections[index]
+        previous_tail = sections[index - 1][-400:] if index > 0 else ""
+        next_head = sections[index + 1][:300] if index + 1 < len(sections) else ""
+        prompt = _build_section_prompt(guidance, section, index, len(sections), previous_tail, next_head)
+        async with semaphore:
+            try:
+                rewritten = await llm_client.generate_text(prompt, task="rewrite", caller="rewrite_content_in_sections")
+            except KeyQuotaExhaustedError:
+                # Hết quota: cả bài được báo lỗi 429 (kèm Retry-After) thay vì âm thầm giữ nguyên phần này
+                raise
+            except Exception as e:
+                logger.error(f"Section rewrite failed, keeping the original section: {e}", extra={"fields": {"section": index + 1}})
+                failed_sections.append(index)
+                return section, f"Section {index + 1} could not be rewritten; the original text was kept."
+        return _check_section(section, rewritten, index)
+
+    tasks = [asyncio.ensure_future(rewrite_section(index)) for index in range(len(sections))]
+    try:
+        results = await asyncio.gather(*tasks)
+    except KeyQuotaExhaustedError:
+        # Các phần còn lại đang chờ key bị hủy và trả lại quota đã giữ
+        for task in tasks:
+            task.cancel()
+        raise
+    if len(failed_sections) == len(sections):
+        raise RuntimeError("All sections failed to rewrite.")
+
+    logger.info("Rewrote article in sections", extra={"fields": {"sections": len(sections), "chars": len(content)}})
+    return "\n\n".join(text for text, _ in results), [note for _, note in results if note]
+
+# --- Chế độ viết lại có chọn lọc (targeted): chỉ viết lại các đoạn văn cần sửa ---
+
+class RewrittenParagraph(BaseModel):
+    id: int = Field(description="The paragraph id given in the prompt.")
+    text: str = Field(description="The rewritten paragraph text in Markdown.")
+
+class TargetedRewrite(BaseModel):
+    """Only the rewritten paragraphs, keyed by the ids given in the prompt."""
+    paragraphs: List[RewrittenParagraph]
+
+_REASON_TEXT = {
+    "long_sentences": "contains sentences over {limit} words; split them into shorter, clearer sentences",
+    "long_paragraph": "is too long ({words} words); tighten it and split it into shorter paragraphs if needed",
+    "missing_topic": "is the introduction, but the main topic '{topic}' is not central to the article; introduce it clearly here",
+}
+
+def split_paragraphs(content: str) -> list[dict]:
+    """
+    Các đoạn văn có thể viết lại, kèm vị trí (start, end) trong bài gốc.
+    Đoạn văn là các dòng liền nhau, ngăn cách bởi dòng trống. Mọi dòng heading (kể cả giữa khối) là ranh giới
+    và không bị viết lại; nội dung trong khối code (giữa hai fence ```, kể cả dòng trống bên trong) và dòng bảng bị bỏ qua.
+    """
+    paragraphs = []
+    block_start = None
+    block_end = 0
+    in_fence = False
+
+    def flush():
+        nonlocal block_start
+        if block_start is not None:
+            block = content[block_start:block_end].rstrip()
+            stripped = block.lstrip()
+            if stripped:
+                start = block_start + len(block) - len(stripped)
+                paragraphs.append({"start": start, "end": start + len(stripped), "text": stripped})
+        block_start = None
+
+    offset = 0
+    for line in content.splitlines(keepends=True):
+        line_start, offset = offset, offset + len(line)
+        stripped = line.strip()
+        if stripped.startswith("```") or stripped.startswith("~~~"):
+            flush()
+            in_fence = not in_fence
+            continue
+        if in_fence or not stripped or stripped.startswith("#") or stripped.startswith("|"):
+            flush()
+            continue
+        if block_start is None:
+            block_start = line_start
+        block_end = offset
+    flush()
+    return paragraphs
+
+def _main_topic_missing(content: str, nlp_analysis: dict, main_topic: str | None) -> bool:
+    """Chủ đề chính không xuất hiện trong bài, hoặc không nằm trong nhóm thực thể nổi bật mà NLP tìm thấy."""
+    if not main_topic:
+        return False
+    if text_stats.keyword_density(content, main_topic)["occurrences"] == 0:
+        return True
+    entities = nlp_analysis.get("entities") or []
+    if not entities:
+        return False
+    topic = text_stats.strip_accents(main_topic.lower())
+    top_names = [text_stats.strip_accents(name) for name, _ in text_stats.entity_frequency(entities, top_n=5)]
+    return not any(topic in name or name in topic for name in top_names)
+
+def select_paragraphs(enriched_data: dict, content: str, paragraphs: list[dict]) -> dict[int, list[str]]:
+    """
+    Chọn các đoạn cần viết lại từ phân tích cục bộ (text_stats) và kết quả NLP.
+    Trả về {chỉ số đoạn: [lý do]}.
+    """
+    selected: dict[int, list[str]] = {}
+    for index, paragraph in enumerate(paragraphs):
+        sentence_lengths = [len(text_stats.tokenize_words(sentence)) for sentence in text_stats.split_sentences(paragraph["text"])]
+        if any(length > text_stats.LONG_SENTENCE_WORDS for length in sentence_lengths):
+            selected.setdefault(index, []).append("long_sentences")
+        if sum(sentence_lengths) > settings.REWRITE_TARGETED_PARAGRAPH_WORDS:
+            selected.setdefault(index, []).append("long_paragraph")
+    if paragraphs and _main_topic_missing(content, enriched_data.get("nlp_analysis", {}), enriched_data.get("main_topic")):
+        selected.setdefault(0, []).append("missing_topic")
+    return selected
+
+def _build_targeted_prompt(guidance: str, paragraphs: list[dict], selected: dict[int, list[str]], main_topic: str | None) -> str:
+    prompt_parts = [
+        "You are an expert SEO content editor. An analysis flagged only some paragraphs of an article; the rest of the article stays unchanged.",
+        "Rewrite ONLY the paragraphs listed below. Keep each paragraph's meaning and its role in the article, and make it flow with the surrounding text.",
+        "The following guidance applies to the whole article:",
+        guidance,
+        "\nParagraphs to rewrite:",
+    ]
+    for index in sorted(selected):
+        reasons = "; ".join(
+            _REASON_TEXT[reason].format(limit=text_stats.LONG_SENTENCE_WORDS, topic=main_topic,
+                                        words=len(text_stats.tokenize_words(paragraphs[index]["text"])))
+            for reason in selected[index]
+        )
+        previous_tail = paragraphs[index - 1]["text"][-200:] if index > 0 else ""
+        next_head = paragraphs[index + 1]["text"][:200] if index + 1 < len(paragraphs) else ""
+        prompt_parts.append(f"\n[Paragraph id={index}] This paragraph {reasons}.")
+        if previous_tail:
+            prompt_parts.append(f"Preceding text: ...{previous_tail}")
+        if next_head:
+            prompt_parts.append(f"Following text: {next_head}...")
+        prompt_parts.append(f"Paragraph:\n---\n{paragraphs[index]['text']}\n---")
+    prompt_parts.append(
+        "\nReturn a JSON object with key 'paragraphs': an array of {\"id\": <paragraph id>, \"text\": <rewritten paragraph>}, "
+        "one entry per paragraph above. Do not return any other paragraphs."
+    )
+    return "\n".join(prompt_parts)
+
+async def rewrite_content_targeted(
+    enriched_data: dict, content: str, selected: dict[int, list[str]], paragraphs: list[dict],
+    llm_slots: asyncio.Semaphore | None = None
+) -> tuple[str, list[dict], list[str]]:
+    """
+    Viết lại chỉ các đoạn đã chọn trong một lệnh gọi (output chỉ gồm các đoạn đó), rồi ghép vào bài gốc.
+    Trả về (nội dung đã ghép, patch, ghi chú). Mỗi phần tử patch gồm vị trí [start, end) trong bài gốc,
+    đoạn gốc, đoạn thay thế và lý do.
+    """
+    guidance = "\n".join(_build_guidance_parts(enriched_data, content))
+    prompt = _build_targeted_prompt(guidance, paragraphs, selected, enriched_data.get("main_topic"))
+    log_payload(logger, "Targeted rewrite prompt", prompt, caller="rewrite_content_targeted")
+    if llm_slots is None:
+        result = await llm_client.generate_json(prompt, TargetedRewrite, task="rewrite", caller="rewrite_content_targeted")
+    else:
+        async with llm_slots:
+            result = await llm_client.generate_json(prompt, TargetedRewrite, task="rewrite", caller="rewrite_content_targeted")
+
+    rewritten = {item.id: item.text for item in result.paragraphs if item.id in selected}
+    patch, notes = [], []
+    for index in sorted(selected):
+        paragraph = paragraphs[index]
+        if index not in rewritten:
+            notes.append(f"Paragraph {index + 1} was not returned by the rewrite; the original text was kept.")
+            continue
+        text, note = _check_section(paragraph["text"], rewritten[index], index, label="Paragraph")
+        if note:
+            notes.append(note)
+        if text == paragraph["text"]:
+            continue
+        patch.append({
+            "paragraph": index, "start": paragraph["start"], "end": paragraph["end"],
+            "original": paragraph["text"], "replacement": text, "reasons": selected[index],
+        })
+
+    merged = content
+    for change in reversed(patch):
+        merged = merged[:change["start"]] + change["replacement"] + merged[change["end"]:]
+    logger.info("Targeted rewrite finished", extra={"fields": {
+        "paragraphs": len(paragraphs), "selected": len(selected), "changed": len(patch),
+    }})
+    return merged, patch, notes
+
+def _use_sections(content: str, rewrite_mode: str | None) -> bool:
+    if rewrite_mode == "sections":
+        return True
+    if rewrite_mode == "full":
+        return False
+    return len(content) > settings.REWRITE_SECTION_THRESHOLD_CHARS
+
+async def rewrite_content_with_gemini(
+    enriched_data: dict, content: str, rewrite_mode: str | None = "auto", llm_slots: asyncio.Semaphore | None = None
+) -> str:
+    """
+    Sử dụng Google Gemini để viết lại nội dung dựa trên dữ liệu phân tích đã được làm giàu.
+    Đây là "Động cơ Tái cấu trúc" chính.
+    Bài dài (hoặc khi `rewrite_mode="sections"`) được viết lại song song theo từng phần; ghi chú về các phần
+    phải giữ nguyên/sửa được thêm vào enriched_data["cross_reference_notes"].
+    `llm_slots`: nếu có, mỗi lệnh gọi Gemini chiếm một slot của semaphore dùng chung này (xem core/rewrite_batch).
+    Với `rewrite_mode="targeted"`, chỉ các đoạn được phân tích đánh dấu mới được viết lại; patch có cấu trúc được lưu vào
+    enriched_data["rewrite_patch"]. Nếu phần lớn bài cần sửa thì viết lại toàn bài như chế độ "auto".
+    """
+    if rewrite_mode == "targeted":
+        paragraphs = split_paragraphs(content)
+        selected = select_paragraphs(enriched_data, content, paragraphs)
+        selected_chars = sum(len(paragraphs[index]["text"]) for index in selected)
+        if selected_chars <= settings.REWRITE_TARGETED_MAX_FRACTION * max(1, sum(len(p["text"]) for p in paragraphs)):
+            if not selected:
+                enriched_data["rewrite_patch"] = []
+                return content
+            try:
+                rewritten, patch, notes = await rewrite_content_targeted(enriched_data, content, selected, paragraphs, llm_slots)
+            except Exception as e:
+                logger.error(f"An error occurred with the Gemini API: {e}")
+                raise e
+            enriched_data["rewrite_patch"] = patch
+            enriched_data.setdefault("cross_reference_notes", []).extend(notes)
+            return rewritten
+        logger.info("Most of the article needs work; falling back to a full rewrite", extra={"fields": {"selected": len(selected), "paragraphs": len(paragraphs)}})
+        rewrite_mode = "auto"
+
+    sections = split_into_sections(content, settings.REWRITE_SECTION_TARGET_CHARS) if _use_sections(content, rewrite_mode) else []
+    if len(sections) > 1:
+        try:
+            rewritten, notes = await rewrite_content_in_sections(enriched_data, content, llm_slots, sections)
+            enriched_data.setdefault("cross_reference_notes", []).extend(notes)
+            return rewritten
+        except Exception as e:
+            logger.error(f"An error occurred with the Gemini API: {e}")
+            raise e
+
+    # --- 1. Xây dựng Prompt Chi tiết ---
+    final_prompt = build_rewrite_prompt(enriched_data, content)
     
-    print("--- PROMPT SENT TO GEMINI ---")
-    print(final_prompt)
-    print("-----------------------------")
+    log_payload(logger, "Rewrite prompt", final_prompt, caller="rewrite_content_with_gemini")
 
     # --- 2. Gọi API của Gemini với key được quản lý ---
     try:
-        api_key = await api_key_manager.get_next_key_async()
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        response = await model.generate_content_async(final_prompt)
-        return response.text
+        if llm_slots is None:
+            return await llm_client.generate_text(final_prompt, task="rewrite", caller="rewrite_content_with_gemini")
+        async with llm_slots:
+            return await llm_client.generate_text(final_prompt, task="rewrite", caller="rewrite_content_with_gemini")
     except Exception as e:
-        print(f"An error occurred with the Gemini API: {e}")
+        logger.error(f"An error occurred with the Gemini API: {e}")
         # Trả về thông báo lỗi thay vì làm sập ứng dụng.
         raise e # Re-raise the exception to be handled by the endpoint
+
+
+async def stream_rewrite_content_with_gemini(enriched_data: dict, content: str) -> AsyncIterator[str]:
+    """
+    Phiên bản streaming của rewrite_content_with_gemini: trả về từng đoạn text ngay khi Gemini sinh ra.
+    """
+    final_prompt = build_rewrite_prompt(enriched_data, content)
+    try:
+        async for chunk in llm_client.stream_text(final_prompt, task="rewrite", caller="rewrite_content_with_gemini"):
+            yield chunk
+    except Exception as e:
+        logger.error(f"An error occurred with the Gemini streaming API: {e}")
+        raise e
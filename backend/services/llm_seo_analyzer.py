@@ -1,25 +1,47 @@
-import google.generativeai as genai
 import json
 from typing import List, Dict, Any
 import asyncio
 
 # --- Langchain Imports for Structured Output ---
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 
-from backend.services.api_key_manager import api_key_manager
+from backend.services import llm_client
+from backend.services.context_cache import SharedPrefixPrompt
+from backend.core.log import get_logger
+
+logger = get_logger(__name__)
+
+# --- Pydantic Models for Structured Output ---
+class EeatSignals(BaseModel):
+    """E-E-A-T assessment of a competitor article."""
+    experience: str = Field(description="Does the author demonstrate first-hand experience? A brief assessment.")
+    expertise: str = Field(description="Does the content show deep knowledge? A brief assessment.")
+    authoritativeness: str = Field(description="Does the article establish authority (e.g., citing sources, author bio)? A brief assessment.")
+    trustworthiness: str = Field(description="Is the information presented in a trustworthy manner? A brief assessment.")
+
+class CompetitorAnalysis(BaseModel):
+    """Structured SEO analysis of a single competitor article."""
+    search_intent: str = Field(description="Primary user intent ('Informational', 'Commercial Investigation', 'Transactional' or 'Navigational') with a one-sentence explanation.")
+    content_structure: str = Field(description="The article's structure (e.g., 'Listicle', 'How-to Guide', 'Comparison Review', 'News Article').")
+    key_arguments: List[str] = Field(description="The top 3-5 main arguments or key points the article makes.")
+    eeat_signals: EeatSignals = Field(description="E-E-A-T assessment.")
+    key_entities: List[str] = Field(description="The top 5-7 most important entities mentioned in the text.")
+
+class SeoIdea(BaseModel):
+    """Represents a single SEO content idea."""
+    title: str = Field(description="The unique and compelling title for the article.")
+    meta_description: str = Field(description="The SEO-optimized meta description.")
+    sapo: str = Field(description="The engaging opening paragraph (sapo).")
+
+class SeoIdeasResponse(BaseModel):
+    """A list of diverse SEO ideas."""
+    ideas: List[SeoIdea] = Field(description="A list of diverse SEO ideas.")
 
 async def analyze_competitor(content: str) -> Dict[str, Any]:
     """
     Phân tích nội dung của đối thủ cạnh tranh bằng LLM để trích xuất các insight SEO. (Async version)
     """
-    api_key = await api_key_manager.get_next_key_async()
-    # No need to check for api_key here, as get_next_key_async will raise an exception if none are available.
-
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.5-pro') # Using 1.5 Pro for better JSON handling
-
     prompt = f"""
     You are an expert SEO analyst. Analyze the following article content and provide a structured analysis in JSON format.
 
@@ -49,13 +71,13 @@ async def analyze_competitor(content: str) -> Dict[str, Any]:
     """
 
     try:
-        # Use generate_content_async for non-blocking call
-        response = await model.generate_content_async(prompt)
-        # Clean the response to ensure it's valid JSON
-        cleaned_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        return json.loads(cleaned_text)
+        # Structured output, with a tolerant JSON parser as fallback
+        analysis = await llm_client.generate_json(
+            prompt, CompetitorAnalysis, task="competitor_analysis", caller="analyze_competitor"
+        )
+        return analysis.model_dump()
     except Exception as e:
-        print(f"Error during competitor analysis with LLM: {e}")
+        logger.error(f"Error during competitor analysis with LLM: {e}")
         # It's better to raise the exception to be handled by the workflow
         raise e
 
@@ -71,11 +93,6 @@ async def synthesize_insights(
     """
     Tổng hợp kết quả phân tích từ nhiều đối thủ và ngữ cảnh tùy chỉnh để tạo ra một 'Content Brief'. (Async version)
     """
-    api_key = await api_key_manager.get_next_key_async()
-
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.5-pro')
-
     analyses_str = json.dumps(analyses, indent=2)
 
     # --- Xây dựng phần prompt tùy chỉnh một cách linh hoạt ---
@@ -132,79 +149,68 @@ async def synthesize_insights(
     """
 
     try:
-        response = await model.generate_content_async(prompt)
-        return response.text
+        return await llm_client.generate_text(prompt, task="brief_synthesis", caller="synthesize_insights")
     except Exception as e:
-        print(f"Error during insight synthesis with LLM: {e}")
+        logger.error(f"Error during insight synthesis with LLM: {e}")
         raise e
 
-# --- Pydantic Models for Structured Output ---
-class SeoIdea(BaseModel):
-    """Represents a single SEO content idea."""
-    title: str = Field(description="The unique and compelling title for the article.")
-    meta_description: str = Field(description="The SEO-optimized meta description.")
-    sapo: str = Field(description="The engaging opening paragraph (sapo).")
-
-class SeoIdeasResponse(BaseModel):
-    """A list of diverse SEO ideas."""
-    ideas: List[SeoIdea] = Field(description="A list of diverse SEO ideas.")
-
-
 async def generate_seo_ideas(brief: str, num_suggestions: int, language: str | None = "Vietnamese") -> List[Dict[str, str]]:
     """
     Từ Content Brief, tạo ra N bộ ý tưởng (Title, Meta Description, Sapo) đa dạng bằng cách sử dụng structured output.
     """
     try:
-        api_key = await api_key_manager.get_next_key_async()
-
-        # 1. Khởi tạo model và bind với structured output
-        llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro", google_api_key=api_key)
-        structured_llm = llm.with_structured_output(SeoIdeasResponse)
-
-        # 2. Tạo prompt template
+        # 1. Tạo prompt template
         prompt = ChatPromptTemplate.from_messages([
             ("system", "You are a creative SEO strategist. Your task is to generate diverse and compelling article ideas based on a content brief. The language for the content must be {language}."),
             ("human", "Please generate {num_suggestions} ideas based on the following Content Brief:\n\n---BEGIN CONTENT BRIEF---\n{brief}\n---END CONTENT BRIEF---")
         ])
 
-        # 3. Tạo chain và thực thi
-        chain = prompt | structured_llm
-        response_model = await chain.ainvoke({
-            "language": language,
-            "num_suggestions": num_suggestions,
-            "brief": brief
-        })
-
-        # 4. Chuyển đổi Pydantic model thành list of dicts để tương thích với workflow hiện tại
+        # 2. Thực thi với structured output (qua cache phản hồi)
+        response_model = await llm_client.invoke_structured(
+            prompt,
+            {
+                "language": language,
+                "num_suggestions": num_suggestions,
+                "brief": brief
+            },
+            SeoIdeasResponse,
+            task="ideas", caller="generate_seo_ideas"
+        )
+
+        # 3. Chuyển đổi Pydantic model thành list of dicts để tương thích với workflow hiện tại
         return [idea.dict() for idea in response_model.ideas]
 
     except Exception as e:
-        print(f"Error during structured SEO idea generation with LLM: {e}")
+        logger.error(f"Error during structured SEO idea generation with LLM: {e}")
         # Trả về lỗi theo format cũ để workflow có thể xử lý
         return [{"error": f"Failed to generate ideas with structured output. Details: {e}"}]
 
-async def generate_seo_outline(brief: str, title: str, meta_description: str, language: str | None = "Vietnamese") -> str:
+def build_brief_prefix(brief: str) -> str:
     """
-    Tạo ra một dàn ý chuẩn SEO (outline) chi tiết cho bài viết dựa trên brief và một ý tưởng cụ thể. (Async version)
+    Phần đầu prompt dùng chung cho outline và article của cùng một keyword: chỉ chứa content brief.
+    Giữ phần này giống hệt nhau giữa các lệnh gọi để provider có thể cache (context caching) thay vì xử lý lại brief mỗi lần.
     """
-    api_key = await api_key_manager.get_next_key_async()
+    return f"""
+    The following Content Brief provides the overall strategy, core topics, and must-include entities for an article. All subsequent instructions refer to it.
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.5-pro')
+    Content Brief:
+    ---
+    {brief}
+    ---
+    """
 
-    prompt = f"""
+async def generate_seo_outline(brief: str, title: str, meta_description: str, language: str | None = "Vietnamese") -> str:
+    """
+    Tạo ra một dàn ý chuẩn SEO (outline) chi tiết cho bài viết dựa trên brief và một ý tưởng cụ thể. (Async version)
+    """
+    suffix = f"""
     You are a meticulous content architect and SEO expert. Your task is to create a detailed, SEO-optimized article outline.
 
     Use the following information:
-    1.  **Content Brief:** Provides the overall strategy, topics, and entities.
+    1.  **Content Brief (above):** Provides the overall strategy, topics, and entities.
     2.  **Chosen Title:** The main headline for the article.
     3.  **Meta Description:** A summary of the article's core message.
 
-    Content Brief:
-    ---
-    {brief}
-    ---
-
     Chosen Title: "{title}"
     Meta Description: "{meta_description}"
 
@@ -214,36 +220,26 @@ async def generate_seo_outline(brief: str, title: str, meta_description: str, la
 
     Provide the response as a well-formatted Markdown string.
     """
+    prompt = SharedPrefixPrompt(build_brief_prefix(brief), suffix)
     try:
-        response = await model.generate_content_async(prompt)
-        return response.text
+        return await llm_client.generate_text_with_prefix(prompt, task="outline", caller="generate_seo_outline")
     except Exception as e:
-        print(f"Error during outline generation with LLM: {e}")
+        logger.error(f"Error during outline generation with LLM: {e}")
         raise e
 
 async def generate_article_from_outline(brief: str, title: str, outline: str, language: str | None = "Vietnamese") -> str:
     """
     Viết một bài viết hoàn chỉnh dựa trên brief, title, và một dàn ý chi tiết. (Async version)
     """
-    api_key = await api_key_manager.get_next_key_async()
-
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.5-pro')
-
-    prompt = f"""
-    You are an expert SEO copywriter. Your task is to write a complete, high-quality article. You must strictly follow the provided outline and adhere to the strategic goals in the content brief.
-
-    **1. Content Brief (Overall Strategy):**
-    ---
-    {brief}
-    ---
+    suffix = f"""
+    You are an expert SEO copywriter. Your task is to write a complete, high-quality article. You must strictly follow the provided outline and adhere to the strategic goals in the Content Brief above.
 
-    **2. Article Title:**
+    **1. Article Title:**
     ---
     {title}
     ---
 
-    **3. Detailed Outline (Your Structural Blueprint):**
+    **2. Detailed Outline (Your Structural Blueprint):**
     ---
     {outline}
     ---
@@ -259,9 +255,9 @@ async def generate_article_from_outline(brief: str, title: str, outline: str, la
     -  Do **not** include explanations, meta comments, or summary outside the article body.
     -  The output must be **the final publish-ready article**, suitable for direct upload to a website.
     """
+    prompt = SharedPrefixPrompt(build_brief_prefix(brief), suffix)
     try:
-        response = await model.generate_content_async(prompt)
-        return response.text
+        return await llm_client.generate_text_with_prefix(prompt, task="article", caller="generate_article_from_outline")
     except Exception as e:
-        print(f"Error during article generation with LLM: {e}")
+        logger.error(f"Error during article generation with LLM: {e}")
         raise e
@@ -0,0 +1,397 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Type, Union, get_args, get_origin
+
+from langchain_core.messages import BaseMessage, get_buffer_string
+from pydantic import BaseModel
+
+from backend.core.config import settings
+from backend.core.log import get_logger
+from backend.services.gemini_client_pool import gemini_client_pool
+from backend.services.llm_cache import make_cache_key, schema_fingerprint
+from backend.services.llm_metrics import record_message_usage, record_response_usage, record_usage
+
+logger = get_logger(__name__)
+
+# Lớp chuyển mạch backend cho các lệnh gọi model bên ngoài (Gemini, ChatGoogleGenerativeAI, Cloud Natural Language).
+#   live:      gọi API thật (mặc định).
+#   record:    gọi API thật và ghi phản hồi vào cassette (thư mục JSON).
+#   replay:    trả phản hồi từ cassette, không cần mạng; khi thiếu cassette thì sinh phản hồi giả (hoặc báo lỗi).
+#   synthetic: luôn sinh phản hồi giả với độ trễ theo phân phối cấu hình.
+# Ở chế độ replay/synthetic, key vẫn đi qua api_key_manager (có thể dùng key giả) để vẫn đo được bộ điều phối key.
+
+MODE_LIVE = "live"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+MODE_SYNTHETIC = "synthetic"
+
+LlmPrompt = Union[str, List[BaseMessage]]
+
+class CassetteMissError(LookupError):
+    """Không có cassette cho lệnh gọi ở chế độ replay nghiêm ngặt."""
+
+class StreamChunk(NamedTuple):
+    text: str
+    # Token chỉ có ở đoạn cuối của stream
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+
+def _prompt_text(prompt: LlmPrompt) -> str:
+    return prompt if isinstance(prompt, str) else get_buffer_string(prompt)
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+# --- Cassette ---
+class CassetteStore:
+    """Lưu phản hồi theo khóa (sha256 của model, prompt, cấu hình): mỗi bản ghi là một file JSON."""
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self._memory: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def _path(self, namespace: str, key: str) -> str:
+        return os.path.join(self.directory, namespace, f"{key}.json")
+
+    def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        memory_key = f"{namespace}/{key}"
+        with self.lock:
+            if memory_key in self._memory:
+                return self._memory[memory_key]
+        path = self._path(namespace, key)
+        payload = None
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        with self.lock:
+            self._memory[memory_key] = payload
+        return payload
+
+    def put(self, namespace: str, key: str, payload: Dict[str, Any]):
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Ghi ra file tạm rồi đổi tên để replay không bao giờ đọc phải file ghi dở
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self._memory[f"{namespace}/{key}"] = payload
+
+# --- Độ trễ giả lập ---
+class LatencyModel:
+    """Độ trễ theo phân phối log-normal: trung vị `median_seconds`, độ phân tán `sigma`."""
+    def __init__(self, median_seconds: float, sigma: float):
+        self.median_seconds = median_seconds
+        self.sigma = sigma
+
+    def sample(self) -> float:
+        if self.median_seconds <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median_seconds), self.sigma)
+
+def _latency_model(name: str) -> LatencyModel:
+    config = settings.MODEL_FAKE_LATENCY.get(name, {})
+    return LatencyModel(config.get("median_seconds", 0.0), config.get("sigma", 0.0))
+
+# --- Sinh phản hồi giả ---
+def _seed(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:8]
+
+def synthesize_text(model_name: str, prompt: str) -> str:
+    """Phản hồi Markdown xác định (deterministic) theo prompt, đủ dài để các bước sau có dữ liệu xử lý."""
+    seed = _seed(model_name, prompt)
+    sections = "\n\n".join(
+        f"## Section {index} ({seed})\n\n" + " ".join(f"Synthetic sentence {index}.{n} for load testing." for n in range(1, 9))
+        for index in range(1, 5)
+    )
+    return f"# Synthetic response {seed}\n\n{sections}\n"
+
+def _synthesize_value(annotation: Any, name: str, seed: str) -> Any:
+    origin = get_origin(annotation)
+    if origin is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return _synthesize_value(args[0], name, seed) if args else None
+    if origin in (list, List):
+        (item_type,) = get_args(annotation) or (str,)
+        return [_synthesize_value(item_type, f"{name} {index}", seed) for index in range(1, 4)]
+    if origin is dict:
+        return {}
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return synthesize_model(annotation, seed).model_dump()
+    if annotation is bool:
+        return True
+    if annotation is int:
+        return int(seed[:4], 16) % 100
+    if annotation is float:
+        return int(seed[:4], 16) % 100 / 100
+    return f"Synthetic {name} {seed}"
+
+def synthesize_model(schema: Type[BaseModel], seed: str) -> BaseModel:
+    """Tạo instance hợp lệ của `schema` với giá trị giả cho từng trường."""
+    return schema.model_validate({
+        name: _synthesize_value(field.annotation, name, seed) for name, field in schema.model_fields.items()
+    })
+
+def synthesize_nlp(text_content: str, features) -> dict:
+    """Kết quả NLP giả theo đúng định dạng của gcp_nlp.analyze_text."""
+    words = [word.strip(".,:;!?()\"'").lower() for word in text_content.split()]
+    candidates = sorted({word for word in words if len(word) > 4}, key=lambda word: (-words.count(word), word))
+    results = {}
+    if "entities" in features:
+        results["entities"] = [{"name": word, "type": "OTHER"} for word in candidates[:10]]
+    if "categories" in features:
+        results["categories"] = [{"name": "/Synthetic/Load Testing", "confidence": 0.9}]
+    if "sentiment" in features:
+        results["sentiment"] = {"score": 0.1, "magnitude": 0.5}
+    results["language"] = "en"
+    return results
+
+# --- Backend LLM ---
+def _chunk_text(chunk) -> str:
+    """
+    Text của một đoạn stream, đọc qua candidates/parts. `chunk.text` ném ValueError với đoạn không có part
+    (bị chặn bởi safety filter, hay đoạn cuối chỉ chứa usage); các đoạn đó được coi là rỗng.
+    """
+    candidates = getattr(chunk, "candidates", None) or []
+    if not candidates:
+        return ""
+    content = getattr(candidates[0], "content", None)
+    return "".join(getattr(part, "text", "") or "" for part in (getattr(content, "parts", None) or []))
+
+class LlmBackend:
+    """Gọi Gemini thật qua gemini_client_pool. Token của mỗi lệnh gọi được ghi vào llm_metrics."""
+    mode = MODE_LIVE
+
+    async def generate(self, api_key: str, model_name: str, prompt: str,
+                       generation_config: Optional[Dict[str, Any]] = None) -> str:
+        model = gemini_client_pool.get_model(api_key, model_name)
+        response = await model.generate_content_async(prompt, generation_config=generation_config)
+        record_response_usage(response)
+        return response.text
+
+    async def open_stream(self, api_key: str, model_name: str, prompt: str,
+                          generation_config: Optional[Dict[str, Any]] = None) -> AsyncIterator[StreamChunk]:
+        """Mở stream (phần được retry) và trả về iterator các đoạn text."""
+        model = gemini_client_pool.get_model(api_key, model_name)
+        response = await model.generate_content_async(prompt, generation_config=generation_config, stream=True)
+
+        async def chunks():
+            usage = None
+            async for chunk in response:
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                text = _chunk_text(chunk)
+                if text:
+                    yield StreamChunk(text)
+            if usage is not None:
+                yield StreamChunk("", getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0))
+
+        return chunks()
+
+    async def structured(self, api_key: str, model_name: str, prompt: LlmPrompt, schema: Type[BaseModel]) -> Optional[BaseModel]:
+        """
+        Structured output qua ChatGoogleGenerativeAI. Dùng include_raw=True để đọc token từ message gốc;
+        lỗi parse được ném lại như khi không dùng include_raw.
+        """
+        llm = gemini_client_pool.get_chat_model(api_key, model_name)
+        output = await llm.with_structured_output(schema, include_raw=True).ainvoke(prompt)
+        record_message_usage(output.get("raw"))
+        if output.get("parsing_error") is not None:
+            raise output["parsing_error"]
+        return output.get("parsed")
+
+class RecordingLlmBackend(LlmBackend):
+    """Gọi Gemini thật và ghi phản hồi (kèm độ trễ, token) vào cassette."""
+    mode = MODE_RECORD
+
+    def __init__(self, store: CassetteStore):
+        self.store = store
+
+    async def _save(self, key: str, payload: Dict[str, Any]):
+        await asyncio.to_thread(self.store.put, "llm", key, payload)
+
+    async def generate(self, api_key, model_name, prompt, generation_config=None):
+        started = time.perf_counter()
+        text = await super().generate(api_key, model_name, prompt, generation_config)
+        await self._save(make_cache_key(model_name, prompt, generation_config), {
+            "model": model_name, "kind": "text", "text": text, "latency_seconds": time.perf_counter() - started,
+        })
+        return text
+
+    async def open_stream(self, api_key, model_name, prompt, generation_config=None):
+        started = time.perf_counter()
+        live_chunks = await super().open_stream(api_key, model_name, prompt, generation_config)
+        first_chunk_seconds = time.perf_counter() - started
+
+        async def chunks():
+            parts = []
+            async for chunk in live_chunks:
+                parts.append(chunk.text)
+                yield chunk
+            await self._save(make_cache_key(model_name, prompt, generation_config), {
+                "model": model_name, "kind": "text", "text": "".join(parts), "latency_seconds": first_chunk_seconds,
+            })
+
+        return chunks()
+
+    async def structured(self, api_key, model_name, prompt, schema):
+        started = time.perf_counter()
+        result = await super().structured(api_key, model_name, prompt, schema)
+        if result is not None:
+            await self._save(make_cache_key(model_name, _prompt_text(prompt), {"structured_output": schema_fingerprint(schema)}), {
+                "model": model_name, "kind": "structured", "parsed": result.model_dump(),
+                "latency_seconds": time.perf_counter() - started,
+            })
+        return result
+
+class ReplayLlmBackend(LlmBackend):
+    """
+    Trả phản hồi từ cassette (nếu có) hoặc phản hồi giả, không gọi mạng.
+    Độ trễ lấy từ cassette (nếu cấu hình dùng độ trễ đã ghi) hoặc từ phân phối cấu hình.
+    """
+    def __init__(self, store: Optional[CassetteStore], miss_policy: str, use_recorded_latency: bool):
+        self.store = store
+        self.mode = MODE_REPLAY if store is not None else MODE_SYNTHETIC
+        self.miss_policy = miss_policy
+        self.use_recorded_latency = use_recorded_latency
+        self.latency = _latency_model("llm")
+        self.chunk_latency = _latency_model("llm_stream_chunk")
+
+    async def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.store is None:
+            return None
+        payload = await asyncio.to_thread(self.store.get, "llm", key)
+        if payload is None and self.miss_policy == "error":
+            raise CassetteMissError(f"No LLM cassette recorded for key {key}.")
+        return payload
+
+    async def _delay(self, payload: Optional[Dict[str, Any]]):
+        if payload is not None and self.use_recorded_latency and "latency_seconds" in payload:
+            await asyncio.sleep(payload["latency_seconds"])
+        else:
+            await asyncio.sleep(self.latency.sample())
+
+    async def generate(self, api_key, model_name, prompt, generation_config=None):
+        payload = await self._lookup(make_cache_key(model_name, prompt, generation_config))
+        await self._delay(payload)
+        text = payload["text"] if payload is not None else synthesize_text(model_name, prompt)
+        record_usage(_estimate_tokens(prompt), _estimate_tokens(text))
+        return text
+
+    async def open_stream(self, api_key, model_name, prompt, generation_config=None):
+        payload = await self._lookup(make_cache_key(model_name, prompt, generation_config))
+        await self._delay(payload)
+        text = payload["text"] if payload is not None else synthesize_text(model_name, prompt)
+
+        async def chunks():
+            for start in range(0, len(text), 200):
+                if start:
+                    await asyncio.sleep(self.chunk_latency.sample())
+                yield StreamChunk(text[start:start + 200])
+            yield StreamChunk("", _estimate_tokens(prompt), _estimate_tokens(text))
+
+        return chunks()
+
+    async def structured(self, api_key, model_name, prompt, schema):
+        prompt_text = _prompt_text(prompt)
+        payload = await self._lookup(make_cache_key(model_name, prompt_text, {"structured_output": schema_fingerprint(schema)}))
+        await self._delay(payload)
+        if payload is not None:
+            result = schema.model_validate(payload["parsed"])
+        else:
+            result = synthesize_model(schema, _seed(model_name, prompt_text))
+        record_usage(_estimate_tokens(prompt_text), _estimate_tokens(result.model_dump_json()))
+        return result
+
+# --- Backend NLP ---
+class NlpBackend:
+    """Gọi Cloud Natural Language thật thông qua hàm `live_call` do gcp_nlp cung cấp."""
+    mode = MODE_LIVE
+
+    def analyze(self, text_content: str, features: frozenset, live_call: Callable[[str, frozenset], dict]) -> dict:
+        return live_call(text_content, features)
+
+    async def analyze_async(self, text_content: str, features: frozenset,
+                            live_call: Callable[[str, frozenset], Awaitable[dict]]) -> dict:
+        return await live_call(text_content, features)
+
+    @staticmethod
+    def cassette_key(text_content: str, features: frozenset) -> str:
+        return make_cache_key("language_v2", text_content, {"features": sorted(features)})
+
+class RecordingNlpBackend(NlpBackend):
+    mode = MODE_RECORD
+
+    def __init__(self, store: CassetteStore):
+        self.store = store
+
+    def analyze(self, text_content, features, live_call):
+        started = time.perf_counter()
+        results = live_call(text_content, features)
+        self.store.put("nlp", self.cassette_key(text_content, features), {
+            "results": results, "latency_seconds": time.perf_counter() - started,
+        })
+        return results
+
+    async def analyze_async(self, text_content, features, live_call):
+        started = time.perf_counter()
+        results = await live_call(text_content, features)
+        await asyncio.to_thread(self.store.put, "nlp", self.cassette_key(text_content, features), {
+            "results": results, "latency_seconds": time.perf_counter() - started,
+        })
+        return results
+
+class ReplayNlpBackend(NlpBackend):
+    def __init__(self, store: Optional[CassetteStore], miss_policy: str, use_recorded_latency: bool):
+        self.store = store
+        self.mode = MODE_REPLAY if store is not None else MODE_SYNTHETIC
+        self.miss_policy = miss_policy
+        self.use_recorded_latency = use_recorded_latency
+        self.latency = _latency_model("nlp")
+
+    def _lookup(self, text_content, features) -> Optional[Dict[str, Any]]:
+        payload = None
+        if self.store is not None:
+            payload = self.store.get("nlp", self.cassette_key(text_content, features))
+            if payload is None and self.miss_policy == "error":
+                raise CassetteMissError("No NLP cassette recorded for this document.")
+        return payload
+
+    def _delay_seconds(self, payload: Optional[Dict[str, Any]]) -> float:
+        if payload is not None and self.use_recorded_latency:
+            return payload.get("latency_seconds", 0.0)
+        return self.latency.sample()
+
+    def analyze(self, text_content, features, live_call):
+        payload = self._lookup(text_content, features)
+        # analyze_text là hàm đồng bộ và được gọi qua asyncio.to_thread, nên sleep đồng bộ ở đây
+        time.sleep(self._delay_seconds(payload))
+        return payload["results"] if payload is not None else synthesize_nlp(text_content, features)
+
+    async def analyze_async(self, text_content, features, live_call):
+        payload = await asyncio.to_thread(self._lookup, text_content, features)
+        await asyncio.sleep(self._delay_seconds(payload))
+        return payload["results"] if payload is not None else synthesize_nlp(text_content, features)
+
+def _build_backends():
+    mode = (settings.MODEL_BACKEND_MODE or MODE_LIVE).lower()
+    if mode == MODE_LIVE:
+        return LlmBackend(), NlpBackend()
+    store = CassetteStore(settings.MODEL_CASSETTE_DIR)
+    if mode == MODE_RECORD:
+        return RecordingLlmBackend(store), RecordingNlpBackend(store)
+    if mode not in (MODE_REPLAY, MODE_SYNTHETIC):
+        raise ValueError(f"Unknown MODEL_BACKEND_MODE: {settings.MODEL_BACKEND_MODE}")
+    replay_store = store if mode == MODE_REPLAY else None
+    options = dict(miss_policy=settings.MODEL_REPLAY_MISS_POLICY, use_recorded_latency=settings.MODEL_REPLAY_RECORDED_LATENCY)
+    logger.warning(f"Model backends running in '{mode}' mode: no Gemini or Natural Language API calls will be made.")
+    return ReplayLlmBackend(replay_store, **options), ReplayNlpBackend(replay_store, **options)
+
+# Backend dùng chung cho toàn bộ ứng dụng
+llm_backend, nlp_backend = _build_backends()
@@ -0,0 +1,126 @@
+import csv
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from backend.core.config import settings
+from backend.services.text_stats import strip_accents
+from backend.core.log import get_logger
+
+logger = get_logger(__name__)
+
+# Nhận diện tỉnh/thành của một địa chỉ và mã bưu chính cấp tỉnh bằng dữ liệu cục bộ, không cần gọi LLM.
+# Dữ liệu nằm trong một file CSV (province, postal_code, aliases) gồm 63 mã cấp tỉnh; chưa có dữ liệu quận/phường
+# nên mã tìm được chỉ dùng làm gợi ý (xem llm_bio_generator) và để lấy địa điểm cho hashtag.
+# Tên được chuẩn hóa (bỏ dấu, bỏ tiền tố hành chính như "TP.", "Tỉnh") nên so khớp không phân biệt dấu/hoa thường.
+# Tỉnh chỉ được nhận khi là thành phần cuối của địa chỉ hoặc đứng sau "Tỉnh"/"TP"/"Thành phố", để tên đường
+# trùng tên tỉnh ("Nguyễn Huệ", "Quốc lộ Hà Nội") không bị nhận nhầm.
+
+_NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+_ADMIN_PREFIX_RE = re.compile(r"^(?:thanh pho|tp|tinh|quan|huyen|thi xa|tx|thi tran|tt|phuong|xa|p|q)\s+")
+_COMPONENT_SPLIT_RE = re.compile(r"[,;\n]")
+# Thành phần cuối chỉ tên quốc gia được bỏ qua khi tìm tỉnh
+_COUNTRY_NAMES = frozenset({"viet nam", "vietnam", "vn"})
+
+def _plain(name: str) -> str:
+    """Bỏ dấu, chữ thường, bỏ dấu câu (giữ tiền tố hành chính)."""
+    return _NON_ALNUM_RE.sub(" ", strip_accents(name).lower()).strip()
+
+def normalize_name(name: str) -> str:
+    """Chuẩn hóa tên địa danh: bỏ dấu, chữ thường, bỏ dấu câu và tiền tố hành chính ("TP. Hồ Chí Minh" -> "ho chi minh")."""
+    return _ADMIN_PREFIX_RE.sub("", _plain(name))
+
+class PostalGazetteer:
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Tên chuẩn hóa (kể cả alias) -> chỉ số tỉnh; tên hiển thị của từng tỉnh
+        self._provinces: Dict[str, int] = {}
+        self._province_names: List[str] = []
+        # Chỉ số tỉnh -> mã bưu chính cấp tỉnh
+        self._codes: Dict[int, str] = {}
+        self._province_re: Optional[re.Pattern] = None
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._load()
+            self._loaded = True
+
+    def _province_index(self, name: str, aliases: str) -> int:
+        key = normalize_name(name)
+        index = self._provinces.get(key)
+        if index is None:
+            index = len(self._province_names)
+            self._province_names.append(name)
+            self._provinces[key] = index
+        for alias in filter(None, (alias.strip() for alias in (aliases or "").split("|"))):
+            self._provinces.setdefault(normalize_name(alias), index)
+        return index
+
+    def _load(self) -> None:
+        if not os.path.exists(self.data_path):
+            logger.warning("Postal gazetteer data file not found; province lookups are disabled.", extra={"fields": {"path": self.data_path}})
+            return
+        with open(self.data_path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                province = (row.get("province") or "").strip()
+                code = (row.get("postal_code") or "").strip()
+                if not province or not code:
+                    continue
+                self._codes[self._province_index(province, row.get("aliases"))] = code
+
+        aliases = sorted(self._provinces, key=len, reverse=True)
+        if aliases:
+            # Tên tỉnh đứng sau tiền tố hành chính cấp tỉnh, ở cuối một thành phần ("Quận 1 TP Hồ Chí Minh")
+            self._province_re = re.compile(
+                r"\b(?:thanh pho|tp|tinh)\s+(" + "|".join(re.escape(alias) for alias in aliases) + r")$"
+            )
+        logger.info("Loaded postal gazetteer", extra={"fields": {"provinces": len(self._province_names)}})
+
+    def _find_province(self, raw_components: List[str]) -> Tuple[Optional[int], str]:
+        """
+        Tìm tỉnh trong các thành phần (chưa bỏ tiền tố) của địa chỉ. Trả về (chỉ số tỉnh, nguồn):
+        nguồn "trailing" khi tỉnh là thành phần cuối (bỏ qua tên quốc gia), "prefix" khi tỉnh đứng sau
+        "Tỉnh"/"TP"/"Thành phố" ở một thành phần khác. Tên tỉnh xuất hiện ở vị trí khác (tên đường...) bị bỏ qua.
+        """
+        last = len(raw_components) - 1
+        while last >= 0 and raw_components[last] in _COUNTRY_NAMES:
+            last -= 1
+        if last < 0:
+            return None, ""
+        index = self._provinces.get(_ADMIN_PREFIX_RE.sub("", raw_components[last]))
+        if index is not None:
+            return index, "trailing"
+        if self._province_re is not None:
+            for position in range(last, -1, -1):
+                match = self._province_re.search(raw_components[position])
+                if match:
+                    return self._provinces[match.group(1)], "prefix"
+        return None, ""
+
+    def lookup(self, address: Optional[str]) -> Optional[dict]:
+        """
+        Nhận diện tỉnh/thành của một địa chỉ: {"postal_code", "province", "source"} với mã bưu chính cấp tỉnh,
+        hoặc None nếu không nhận ra tỉnh/thành nào. "source" là "trailing" | "prefix" (xem _find_province).
+        """
+        if not address:
+            return None
+        self._ensure_loaded()
+        raw_components = [part for part in (_plain(part) for part in _COMPONENT_SPLIT_RE.split(address)) if part]
+        province, source = self._find_province(raw_components)
+        if province is None or province not in self._codes:
+            return None
+        return {
+            "postal_code": self._codes[province],
+            "province": self._province_names[province],
+            "source": source,
+        }
+
+# Tạo một instance duy nhất (singleton); dữ liệu được nạp ở lần tra cứu đầu tiên
+postal_gazetteer = PostalGazetteer(settings.POSTAL_GAZETTEER_PATH)
@@ -0,0 +1,180 @@
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+# Thống kê văn bản cục bộ (không gọi API) cho các heuristic biên tập và workflow SEO:
+# tách câu (hỗ trợ tiếng Việt), chỉ số dễ đọc, mật độ từ khóa, cấu trúc heading và tần suất thực thể.
+# Mọi hàm đều chạy tuyến tính theo độ dài văn bản (một lượt regex + Counter), dùng được cho bài rất dài.
+
+LONG_SENTENCE_WORDS = 25
+
+# Viết tắt thường gặp (tiếng Việt và tiếng Anh) có dấu chấm nhưng không kết thúc câu
+_ABBREVIATIONS = frozenset({
+    "tp", "q", "p", "tx", "ths", "ts", "pgs", "gs", "bs", "ks", "cn", "th.s", "t.s", "st", "ctcp", "tnhh", "v.v",
+    "mr", "mrs", "ms", "dr", "prof", "inc", "ltd", "co", "jr", "sr", "vs", "etc", "e.g", "i.e", "no", "fig",
+})
+
+_WORD_RE = re.compile(r"\w+(?:[-'’]\w+)*", re.UNICODE)
+# Ứng viên kết thúc câu: dấu câu (kèm ngoặc/nháy đóng) theo sau là khoảng trắng, hoặc một hay nhiều dòng trống
+_BOUNDARY_RE = re.compile(r"([.!?…]+[\"'”’)\]]*)(\s+)|(\n\s*\n)")
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$", re.MULTILINE)
+_VOWEL_GROUP_RE = re.compile(r"[aeiouy]+")
+
+def strip_accents(text: str) -> str:
+    """Bỏ dấu tiếng Việt (kể cả đ/Đ) để so khớp không phân biệt dấu."""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    return "".join(char for char in unicodedata.normalize("NFD", text) if unicodedata.category(char) != "Mn")
+
+def tokenize_words(text: str) -> List[str]:
+    """Tách từ (token) theo khoảng trắng/dấu câu; với tiếng Việt mỗi token là một âm tiết."""
+    return _WORD_RE.findall(text)
+
+def _is_abbreviation(text: str, dot_index: int) -> bool:
+    """Dấu chấm tại `dot_index` thuộc một từ viết tắt hoặc chữ cái đầu tên (ví dụ: "TP.", "N. V. A.")."""
+    start = dot_index
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    token = text[start:dot_index].lower().lstrip("(\"'“‘")
+    return token in _ABBREVIATIONS or (len(token) == 1 and token.isalpha())
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Tách câu cho tiếng Việt và tiếng Anh.
+    Không tách tại số thập phân/số có dấu chấm ("3.5", "1.000.000"), từ viết tắt ("TP. HCM", "PGS. TS."),
+    chữ cái đầu tên, hoặc khi ký tự tiếp theo là chữ thường. Dòng trống và heading luôn là ranh giới câu.
+    """
+    sentences = []
+    start = 0
+    for match in _BOUNDARY_RE.finditer(text):
+        if match.group(3) is not None:
+            end = match.start()
+        else:
+            punctuation = match.group(1)
+            next_index = match.end()
+            next_char = text[next_index] if next_index < len(text) else ""
+            # Câu tiếp theo phải bắt đầu bằng chữ hoa, chữ số, nháy/ngoặc mở, gạch đầu dòng hoặc heading
+            if next_char and not (next_char.isupper() or next_char.isdigit() or next_char in "\"'“‘([-*#•"):
+                continue
+            if punctuation.startswith(".") and len(punctuation.rstrip("\"'”’)]")) == 1 and _is_abbreviation(text, match.start(1)):
+                continue
+            end = match.start(2)
+        sentence = text[start:end].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    # Heading (dòng bắt đầu bằng #) đứng riêng thành một "câu"
+    result = []
+    for sentence in sentences:
+        lines = sentence.split("\n")
+        if len(lines) > 1 and any(line.lstrip().startswith("#") for line in lines):
+            result.extend(line.strip() for line in lines if line.strip())
+        else:
+            result.append(sentence)
+    return result
+
+def _english_syllables(word: str) -> int:
+    word = word.lower()
+    count = len(_VOWEL_GROUP_RE.findall(word))
+    if word.endswith("e") and count > 1:
+        count -= 1
+    return max(1, count)
+
+def readability(text: str, language: Optional[str] = None, sentences: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Chỉ số dễ đọc: số câu, số từ, số từ trung bình mỗi câu, tỷ lệ câu dài (> LONG_SENTENCE_WORDS từ),
+    độ dài từ trung bình và điểm Flesch Reading Ease.
+    Với tiếng Việt (mặc định), mỗi token là một âm tiết nên điểm Flesch chỉ phản ánh độ dài câu;
+    với tiếng Anh, âm tiết được ước lượng theo cụm nguyên âm.
+    """
+    sentences = sentences if sentences is not None else split_sentences(text)
+    sentence_lengths = [len(tokenize_words(sentence)) for sentence in sentences]
+    sentence_lengths = [length for length in sentence_lengths if length]
+    words = tokenize_words(text)
+    word_count = len(words)
+    sentence_count = len(sentence_lengths)
+    if not word_count or not sentence_count:
+        return {"sentences": 0, "words": 0, "words_per_sentence": 0.0, "long_sentences": 0,
+                "long_sentence_ratio": 0.0, "chars_per_word": 0.0, "flesch_reading_ease": 0.0}
+
+    is_english = (language or "").lower() in ("en", "english")
+    syllables = sum(_english_syllables(word) for word in words) if is_english else word_count
+    words_per_sentence = word_count / sentence_count
+    long_sentences = sum(1 for length in sentence_lengths if length > LONG_SENTENCE_WORDS)
+    return {
+        "sentences": sentence_count,
+        "words": word_count,
+        "words_per_sentence": round(words_per_sentence, 2),
+        "long_sentences": long_sentences,
+        "long_sentence_ratio": round(long_sentences / sentence_count, 4),
+        "chars_per_word": round(sum(len(word) for word in words) / word_count, 2),
+        "flesch_reading_ease": round(206.835 - 1.015 * words_per_sentence - 84.6 * syllables / word_count, 2),
+    }
+
+def keyword_density(text: str, keyword: str, words: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Số lần xuất hiện và mật độ của một cụm từ khóa (không phân biệt hoa thường và dấu).
+    Mật độ = (số lần xuất hiện × số từ của cụm) / tổng số từ.
+    """
+    words = words if words is not None else tokenize_words(text)
+    phrase = [strip_accents(token.lower()) for token in tokenize_words(keyword)]
+    if not phrase or not words:
+        return {"keyword": keyword, "occurrences": 0, "density": 0.0}
+
+    # Chuẩn hóa mỗi từ khác nhau đúng một lần (văn bản dài lặp lại rất nhiều từ)
+    normalized_forms: Dict[str, str] = {}
+    normalized = []
+    for word in words:
+        form = normalized_forms.get(word)
+        if form is None:
+            form = normalized_forms[word] = strip_accents(word.lower())
+        normalized.append(form)
+    size = len(phrase)
+    first = phrase[0]
+    occurrences = 0
+    index = 0
+    limit = len(normalized) - size
+    while index <= limit:
+        if normalized[index] == first and normalized[index:index + size] == phrase:
+            occurrences += 1
+            index += size
+        else:
+            index += 1
+    return {
+        "keyword": keyword,
+        "occurrences": occurrences,
+        "density": round(occurrences * size / len(normalized), 4),
+    }
+
+def heading_structure(text: str) -> Dict[str, Any]:
+    """Cấu trúc heading Markdown: danh sách heading, số lượng theo cấp và các vấn đề (nhiều H1, nhảy cấp)."""
+    headings = [{"level": len(match.group(1)), "text": match.group(2)} for match in _HEADING_RE.finditer(text)]
+    counts = Counter(f"h{heading['level']}" for heading in headings)
+    issues = []
+    if counts.get("h1", 0) > 1:
+        issues.append("multiple_h1")
+    previous_level = None
+    for heading in headings:
+        if previous_level is not None and heading["level"] > previous_level + 1:
+            issues.append(f"skipped_level:{heading['text']}")
+        previous_level = heading["level"]
+    return {"headings": headings, "counts": dict(counts), "issues": issues}
+
+def entity_frequency(entities: Iterable[Dict[str, Any]], top_n: int = 10) -> List[tuple]:
+    """Tần suất thực thể (theo tên, không phân biệt hoa thường) bằng Counter, trả về top_n phổ biến nhất."""
+    counter = Counter(name.lower() for name in (entity.get("name", "") for entity in entities) if name)
+    return counter.most_common(top_n)
+
+def analyze(text: str, keyword: Optional[str] = None, language: Optional[str] = None) -> Dict[str, Any]:
+    """Tổng hợp mọi thống kê cho một văn bản trong một lượt tách câu/tách từ."""
+    sentences = split_sentences(text)
+    stats = {
+        "readability": readability(text, language=language, sentences=sentences),
+        "headings": heading_structure(text),
+    }
+    if keyword:
+        stats["keyword"] = keyword_density(text, keyword)
+    return stats
@@ -83,3 +83,33 @@ function callApi_(endpoint, payload) {
   }
   throw new Error(`Lỗi API tại ${endpoint}. Lỗi ${responseCode}: ${responseBody}`);
 }
+
+/**
+ * Makes a GET call to the backend (e.g., polling a background job).
+ * @param {string} endpoint The API endpoint to call (e.g., '/api/v1/bio-jobs/<id>?offset=0').
+ * @returns {object} The JSON response from the API.
+ * @throws {Error} If the API call fails.
+ */
+function getApi_(endpoint) {
+  const { clientId, clientSecret } = getClientCredentials_();
+  const accessToken = getAccessToken_(clientId, clientSecret);
+
+  const url = `${CONFIG.BACKEND_URL}${endpoint}`;
+  const options = {
+    'method': 'get',
+    'headers': {
+      'Authorization': 'Bearer ' + accessToken,
+      'X-User-Email': Session.getActiveUser().getEmail()
+    },
+    'muteHttpExceptions': true
+  };
+
+  const response = UrlFetchApp.fetch(url, options);
+  const responseCode = response.getResponseCode();
+  const responseBody = response.getContentText();
+
+  if (responseCode === 200) {
+    return JSON.parse(responseBody);
+  }
+  throw new Error(`Lỗi API tại ${endpoint}. Lỗi ${responseCode}: ${responseBody}`);
+}
@@ -159,18 +159,7 @@ function processFirstPendingBioRow() {
     statusCell.setValue(STATUS.PROCESSING);
     SpreadsheetApp.flush();
     
-    const requestData = {
-      keyword: keyword,
-      website: website,
-      name: rowData[BIO_INPUT_COLS.NAME - 1],
-      username: rowData[BIO_INPUT_COLS.USERNAME - 1],
-      short_description: rowData[BIO_INPUT_COLS.SHORT_DESC - 1],
-      address: rowData[BIO_INPUT_COLS.ADDRESS - 1],
-      hotline: String(rowData[BIO_INPUT_COLS.HOTLINE - 1] || ''),
-      zipcode: String(rowData[BIO_INPUT_COLS.ZIPCODE - 1] || ''),
-      num_bio_entities: parseInt(rowData[BIO_INPUT_COLS.NUM_ENTITIES - 1], 10) || 5,
-      language: rowData[BIO_INPUT_COLS.LANGUAGE - 1] || 'Vietnamese'
-    };
+    const requestData = buildBioRequest_(rowData);
 
     const result = callApi_('/api/v1/generate-bio-entities', requestData);
     
@@ -184,6 +173,123 @@ function processFirstPendingBioRow() {
   }
 }
 
+/**
+ * Builds the API request payload for one Bio_Input row.
+ * @private
+ */
+function buildBioRequest_(rowData) {
+  return {
+    keyword: rowData[BIO_INPUT_COLS.KEYWORD - 1],
+    website: rowData[BIO_INPUT_COLS.WEBSITE - 1],
+    name: rowData[BIO_INPUT_COLS.NAME - 1],
+    username: rowData[BIO_INPUT_COLS.USERNAME - 1],
+    short_description: rowData[BIO_INPUT_COLS.SHORT_DESC - 1],
+    address: rowData[BIO_INPUT_COLS.ADDRESS - 1],
+    hotline: String(rowData[BIO_INPUT_COLS.HOTLINE - 1] || ''),
+    zipcode: String(rowData[BIO_INPUT_COLS.ZIPCODE - 1] || ''),
+    num_bio_entities: parseInt(rowData[BIO_INPUT_COLS.NUM_ENTITIES - 1], 10) || 5,
+    language: rowData[BIO_INPUT_COLS.LANGUAGE - 1] || 'Vietnamese'
+  };
+}
+
+// Apps Script dừng sau 6 phút; dừng poll sớm hơn và lưu job để lần chạy sau tiếp tục.
+const BIO_JOB_PROPERTY = 'pendingBioJob';
+const BIO_JOB_POLL_MS = 5000;
+const BIO_JOB_MAX_RUNTIME_MS = 5 * 60 * 1000;
+
+/**
+ * Processes all pending rows in the Bio_Input sheet with one bulk job on the backend.
+ * Results are written as soon as each row completes. If the script runs out of time,
+ * the job is saved and running this menu item again resumes it.
+ */
+function processAllPendingBioRows() {
+  const ui = SpreadsheetApp.getUi();
+  const sheet = SpreadsheetApp.getActiveSpreadsheet().getSheetByName(SHEET_NAMES.BIO_INPUT);
+  if (!sheet) {
+    ui.alert(`Không tìm thấy sheet "${SHEET_NAMES.BIO_INPUT}". Vui lòng tạo template trước.`);
+    return;
+  }
+
+  const properties = PropertiesService.getDocumentProperties();
+  let job = JSON.parse(properties.getProperty(BIO_JOB_PROPERTY) || 'null');
+
+  if (!job) {
+    const values = sheet.getRange(2, 1, Math.max(sheet.getLastRow() - 1, 1), sheet.getLastColumn()).getValues();
+    const rows = [];
+    const rowNumbers = [];
+    values.forEach((rowData, i) => {
+      const keyword = String(rowData[BIO_INPUT_COLS.KEYWORD - 1] || '').trim();
+      const website = String(rowData[BIO_INPUT_COLS.WEBSITE - 1] || '').trim();
+      if (rowData[BIO_INPUT_COLS.STATUS - 1] === STATUS.PENDING && keyword && website) {
+        rows.push(buildBioRequest_(rowData));
+        rowNumbers.push(i + 2);
+      }
+    });
+
+    if (rows.length === 0) {
+      ui.alert(`Không có yêu cầu hợp lệ nào đang ở trạng thái "${STATUS.PENDING}".`);
+      return;
+    }
+
+    const created = callApi_('/api/v1/bio-jobs', { rows: rows });
+    job = { jobId: created.job_id, offset: 0, rowNumbers: rowNumbers };
+    rowNumbers.forEach(rowNumber => sheet.getRange(rowNumber, BIO_INPUT_COLS.STATUS).setValue(STATUS.PROCESSING));
+    properties.setProperty(BIO_JOB_PROPERTY, JSON.stringify(job));
+    SpreadsheetApp.flush();
+  }
+
+  const startedAt = Date.now();
+  let jobStatus;
+  try {
+    while (true) {
+      jobStatus = getApi_(`/api/v1/bio-jobs/${job.jobId}?offset=${job.offset}`);
+      jobStatus.results.forEach(item => {
+        const rowNumber = job.rowNumbers[item.index];
+        const statusCell = sheet.getRange(rowNumber, BIO_INPUT_COLS.STATUS);
+        if (item.error || !item.result) {
+          console.error(`Error processing bio generation row ${rowNumber}:`, item.error);
+          statusCell.setValue(STATUS.ERROR);
+        } else {
+          writeBioOutputData_(sheet.getRange(rowNumber, BIO_INPUT_COLS.ID).getValue(), item.result);
+          statusCell.setValue(STATUS.SUCCESS);
+        }
+      });
+      job.offset += jobStatus.results.length;
+      properties.setProperty(BIO_JOB_PROPERTY, JSON.stringify(job));
+      SpreadsheetApp.flush();
+
+      if (jobStatus.status !== 'running' && job.offset >= jobStatus.completed) break;
+      if (Date.now() - startedAt > BIO_JOB_MAX_RUNTIME_MS) {
+        ui.alert(`Đã xử lý ${job.offset}/${jobStatus.total} dòng. Job vẫn đang chạy, vui lòng chạy lại mục này để tiếp tục.`);
+        return;
+      }
+      Utilities.sleep(BIO_JOB_POLL_MS);
+    }
+  } catch (e) {
+    console.error('Error polling bulk bio job:', e);
+    // Job không còn trên backend (hết hạn/khởi động lại): đưa các dòng chưa có kết quả về trạng thái chờ
+    // để lần chạy sau tạo job mới cho chúng, rồi bỏ job đã lưu
+    if (String(e.message).indexOf('404') !== -1) {
+      job.rowNumbers.forEach(rowNumber => {
+        const statusCell = sheet.getRange(rowNumber, BIO_INPUT_COLS.STATUS);
+        if (statusCell.getValue() === STATUS.PROCESSING) statusCell.setValue(STATUS.PENDING);
+      });
+      SpreadsheetApp.flush();
+      properties.deleteProperty(BIO_JOB_PROPERTY);
+    }
+    ui.alert('Đã xảy ra lỗi', `Chi tiết: ${e.message}`, ui.ButtonSet.OK);
+    return;
+  }
+
+  properties.deleteProperty(BIO_JOB_PROPERTY);
+  // Các dòng không có kết quả (job lỗi/bị hủy) được đánh dấu lỗi
+  job.rowNumbers.forEach(rowNumber => {
+    const statusCell = sheet.getRange(rowNumber, BIO_INPUT_COLS.STATUS);
+    if (statusCell.getValue() === STATUS.PROCESSING) statusCell.setValue(STATUS.ERROR);
+  });
+  ui.alert(`Hoàn tất: đã xử lý ${job.offset}/${jobStatus.total} dòng.`);
+}
+
 /**
  * Writes the bio generation results to the 'Bio_Output' sheet.
  * @private
@@ -16,6 +16,7 @@ function onOpen() {
   menu.addItem('4. Tạo Template Tạo Bio', 'createBioTemplate');
   menu.addItem('5. Thêm dòng Tạo Bio mới', 'addNewBioRow');
   menu.addItem('6. Tạo Bio (Dòng chờ duyệt đầu tiên)', 'processFirstPendingBioRow');
+  menu.addItem('6b. Tạo Bio (Tất cả dòng chờ duyệt)', 'processAllPendingBioRows');
   menu.addSeparator();
   menu.addItem('7. Cấu hình', 'showConfigurationSidebar');
   
@@ -105,7 +105,7 @@ function addNewSeoSuggestionRow() {
   
   sheet.getRange(newRow, SEO_INPUT_COLS.ID).setValue(Utilities.getUuid());
   sheet.getRange(newRow, SEO_INPUT_COLS.NUM_SUGGESTIONS).setValue(3);
-  sheet.getRange(newRow, SEO_INPUT_COLS.OUTPUT_FIELDS).setValue('title, description, h1, sapo, content');
+  sheet.getRange(newRow, SEO_INPUT_COLS.OUTPUT_FIELDS).setValue('title, description, h1, sapo, content, categories');
   sheet.getRange(newRow, SEO_INPUT_COLS.LANGUAGE).setValue('Vietnamese');
   sheet.getRange(newRow, SEO_INPUT_COLS.STATUS).setValue(STATUS.PENDING);
   
@@ -154,6 +154,10 @@ function processFirstSeoSuggestionRow() {
     
     const outputFieldsStr = rowData[SEO_INPUT_COLS.OUTPUT_FIELDS - 1] || '';
     const outputFields = outputFieldsStr.split(',').map(item => item.trim()).filter(item => item);
+    // Sheet kết quả luôn có cột 'Chuyên mục (Categories)', nên luôn yêu cầu phân loại chuyên mục
+    if (outputFields.length > 0 && !outputFields.includes('categories')) {
+      outputFields.push('categories');
+    }
 
     const requestData = {
       keyword: keyword,
@@ -162,7 +166,7 @@ function processFirstSeoSuggestionRow() {
       brand_voice: rowData[SEO_INPUT_COLS.VOICE - 1],
       custom_notes: rowData[SEO_INPUT_COLS.NOTES - 1],
       num_suggestions: parseInt(rowData[SEO_INPUT_COLS.NUM_SUGGESTIONS - 1], 10) || 3,
-      output_fields: outputFields.length > 0 ? outputFields : ["title", "description", "h1", "sapo", "content"],
+      output_fields: outputFields.length > 0 ? outputFields : ["title", "description", "h1", "sapo", "content", "categories"],
       language: rowData[SEO_INPUT_COLS.LANGUAGE - 1] || 'Vietnamese',
       article_type: rowData[SEO_INPUT_COLS.ARTICLE_TYPE - 1]
     };